@@ -0,0 +1,146 @@
+"""
+Microbenchmark of one gauge update cycle, comparing the original per-cycle
+regex name mapping and `Gauge.labels(**kwargs)` calls against the
+precompiled metric table and cached children in server.py. The new updater
+skips values that haven't changed, so it is timed both with the same output
+every cycle and with the plain number fields changing every cycle.
+
+Uses example.json expanded to 16 cards:
+
+    python benchmarks/bench_mapping.py
+"""
+import copy
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from prometheus_client import CollectorRegistry, Gauge  # noqa: E402
+
+import server  # noqa: E402
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "example.json")
+NUM_CARDS = 16
+ITERATIONS = 200
+
+# server._metrics before value parsing was added, the original loop can only
+# handle plain numbers
+LEGACY_METRICS = [
+    "Temperature (Sensor edge) (C)",
+    "Temperature (Sensor junction) (C)",
+    "Temperature (Sensor memory) (C)",
+    "GPU OverDrive value (%)",
+    "GPU Memory OverDrive value (%)",
+    "Max Graphics Package Power (W)",
+    "Average Graphics Package Power (W)",
+    "GPU use (%)",
+    "GPU memory use (%)",
+    "GPU memory use",
+    "PCIe Replay Count",
+    "Voltage (mV)",
+    "Energy counter",
+    "Accumulated Energy (uJ)",
+    "Fan speed (%)",
+    "GPU memory available",
+]
+
+
+def expand_cards(output: Dict[str, Dict[str, Any]], num_cards: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Repeat the cards in `output` until there are `num_cards` of them, giving
+    each a distinct serial number so they get their own label set
+    """
+    cards = [values for name, values in output.items() if name != "system"]
+    expanded = {}
+    for i in range(num_cards):
+        card = copy.deepcopy(cards[i % len(cards)])
+        card["Serial Number"] = f"{card['Serial Number']}-{i}"
+        expanded[f"card{i}"] = card
+    expanded["system"] = output.get("system", {})
+    return expanded
+
+
+def perturb(output: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Copy of `output` with every plain integer/float value increased by one
+    """
+    perturbed = copy.deepcopy(output)
+    for card_name, card_metrics in perturbed.items():
+        if card_name == "system":
+            continue
+        for metric_name, metric_value in card_metrics.items():
+            for number in (int, float):
+                try:
+                    card_metrics[metric_name] = str(number(metric_value) + 1)
+                    break
+                except (TypeError, ValueError):
+                    continue
+    return perturbed
+
+
+def legacy_update(output: Dict[str, Dict[str, Any]], gauges: Dict[str, Gauge]):
+    # the loop body from the original server.main()
+    labels = server._get_label_dict()
+    for card_name, card_metrics in output.items():
+        if card_name == "system":
+            continue
+        label_values = {label: card_metrics[label_raw] for label_raw, label in labels.items()}
+        for metric_name, metric_value in card_metrics.items():
+            if metric_name not in LEGACY_METRICS:
+                continue
+            server._get_prom_friendly_metric_name(metric_name)
+            gauges[metric_name].labels(gpu=card_name, **label_values).set(metric_value)
+
+
+def time_cpu(fn: Callable[[], None], iterations: int = ITERATIONS) -> float:
+    """
+    Returns the mean CPU seconds per call of `fn`
+    """
+    fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    with open(EXAMPLE_PATH, "r") as f:
+        output = expand_cards(json.load(f), NUM_CARDS)
+
+    labelnames = ["gpu", *server._get_label_dict().values()]
+    registry = CollectorRegistry()
+    legacy_gauges = {
+        metric_name: Gauge(
+            server._get_prom_friendly_metric_name(metric_name),
+            metric_name,
+            labelnames=labelnames,
+            registry=registry,
+        )
+        for metric_name in LEGACY_METRICS
+    }
+    updater = server.GaugeUpdater(server._compile_metric_table(registry=CollectorRegistry()))
+
+    before = time_cpu(lambda: legacy_update(output, legacy_gauges))
+    after = time_cpu(lambda: updater.update(output))
+
+    alternating = itertools.cycle([output, perturb(output)])
+    after_changing = time_cpu(lambda: updater.update(next(alternating)))
+
+    print(f"cards: {NUM_CARDS}, iterations: {ITERATIONS}")
+    print(f"before: {before * 1e6:.1f} us CPU per cycle ({len(LEGACY_METRICS)} fields per card)")
+    print(
+        f"after:  {after * 1e6:.1f} us CPU per cycle ({len(server._metrics)} fields per card, "
+        f"{before / after:.2f}x)"
+    )
+    print(
+        f"after, values changing: {after_changing * 1e6:.1f} us CPU per cycle "
+        f"({before / after_changing:.2f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
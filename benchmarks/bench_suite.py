@@ -0,0 +1,167 @@
+"""
+Benchmarks of each stage of a collection cycle and of exposition, at several
+card counts, using synthetic output generated from example.json so no GPU is
+needed:
+
+* parse - json.loads of the rocm-smi --json payload, as get_smi_output does
+  once rocm-smi has exited
+* mapping - mapping every raw field of every card to its prometheus name,
+  per field with the regexes and with the precompiled metric table
+* update - GaugeUpdater.update, with the same output every cycle and with
+  the plain number fields changing every cycle
+* render - generate_latest of a registry holding the gauges, and the size of
+  the payload plain and gzipped
+
+Results are written as JSON, along with the commit they were measured at, so
+runs can be compared across commits:
+
+    python benchmarks/bench_suite.py --output results.json
+"""
+import argparse
+import gzip
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from prometheus_client import CollectorRegistry, generate_latest  # noqa: E402
+
+import server  # noqa: E402
+from bench_mapping import perturb  # noqa: E402
+from synthetic import synthetic_output  # noqa: E402
+
+CARD_COUNTS = [1, 8, 64, 256]
+# cycles timed at each card count, fewer for larger counts so the whole suite
+# takes roughly the same time at each
+CYCLE_BUDGET = 2048
+
+
+def time_cpu(fn: Callable[[], Any], iterations: int) -> float:
+    """
+    Returns the mean CPU seconds per call of `fn`, after one warm up call
+    """
+    fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+
+def legacy_mapping(output: Dict[str, Dict[str, Any]]):
+    for card_name, card_metrics in output.items():
+        if card_name == "system":
+            continue
+        for metric_name in card_metrics:
+            server._get_prom_friendly_metric_name(metric_name)
+
+
+def table_mapping(output: Dict[str, Dict[str, Any]], table: Dict[str, Any]):
+    for card_name, card_metrics in output.items():
+        if card_name == "system":
+            continue
+        for metric_name in card_metrics:
+            table.get(metric_name)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_cards(num_cards: int, iterations: int, seed: int) -> Dict[str, Any]:
+    output = synthetic_output(num_cards, seed)
+    payload = json.dumps(output).encode()
+
+    registry = CollectorRegistry()
+    table = server._compile_metric_table(registry=registry)
+    updater = server.GaugeUpdater(table)
+    alternating = itertools.cycle([output, perturb(output)])
+
+    results = {
+        "cards": num_cards,
+        "iterations": iterations,
+        "smi_payload_bytes": len(payload),
+        "parse_seconds": time_cpu(lambda: json.loads(payload), iterations),
+        "mapping_legacy_seconds": time_cpu(lambda: legacy_mapping(output), iterations),
+        "mapping_table_seconds": time_cpu(lambda: table_mapping(output, table), iterations),
+        "update_unchanged_seconds": time_cpu(lambda: updater.update(output), iterations),
+        "update_changing_seconds": time_cpu(
+            lambda: updater.update(next(alternating)), iterations
+        ),
+    }
+
+    updater.update(output)
+    results["render_seconds"] = time_cpu(lambda: generate_latest(registry), iterations)
+    metrics_payload = generate_latest(registry)
+    results["metrics_payload_bytes"] = len(metrics_payload)
+    results["metrics_payload_gzip_bytes"] = len(gzip.compress(metrics_payload))
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--cards",
+        default=",".join(str(count) for count in CARD_COUNTS),
+        help="comma separated card counts to benchmark",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=None,
+        help=f"cycles timed per card count, defaults to {CYCLE_BUDGET} / cards (at least 10)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic output")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for num_cards in [int(count) for count in args.cards.split(",")]:
+        iterations = args.iterations or max(10, CYCLE_BUDGET // num_cards)
+        result = bench_cards(num_cards, iterations, args.seed)
+        runs.append(result)
+        print(
+            f"{num_cards:>4} cards: "
+            f"parse {result['parse_seconds'] * 1e3:.3f} ms, "
+            f"mapping {result['mapping_legacy_seconds'] * 1e3:.3f} -> "
+            f"{result['mapping_table_seconds'] * 1e3:.3f} ms, "
+            f"update {result['update_unchanged_seconds'] * 1e3:.3f} / "
+            f"{result['update_changing_seconds'] * 1e3:.3f} ms, "
+            f"render {result['render_seconds'] * 1e3:.3f} ms, "
+            f"/metrics {result['metrics_payload_bytes']} B "
+            f"({result['metrics_payload_gzip_bytes']} B gzipped)"
+        )
+
+    if args.output is not None:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Synthetic rocm-smi output for any number of cards, built from the cards in
+example.json with distinct identities and varied sensor values, so
+benchmarks can run without a GPU.
+"""
+import copy
+import json
+import os
+import random
+from typing import Any, Dict
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "example.json")
+
+# raw field -> (low, high, format) of the values generated for it
+_sensor_ranges = {
+    "Temperature (Sensor edge) (C)": (30, 90, "{:.1f}"),
+    "Temperature (Sensor junction) (C)": (30, 110, "{:.1f}"),
+    "Temperature (Sensor memory) (C)": (30, 100, "{:.1f}"),
+    "Average Graphics Package Power (W)": (10, 300, "{:.1f}"),
+    "GPU use (%)": (0, 100, "{:.0f}"),
+    "GPU memory use (%)": (0, 100, "{:.0f}"),
+    "Voltage (mV)": (700, 1200, "{:.0f}"),
+    "Energy counter": (0, 2**32 - 1, "{:.0f}"),
+}
+
+
+def load_example() -> Dict[str, Dict[str, Any]]:
+    with open(EXAMPLE_PATH, "r") as f:
+        return json.load(f)
+
+
+def synthetic_output(num_cards: int, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    rocm-smi --json style output for `num_cards` cards. The same seed always
+    gives the same output.
+    """
+    rng = random.Random(seed)
+    example = load_example()
+    templates = [values for name, values in example.items() if name != "system"]
+
+    output = {}
+    for i in range(num_cards):
+        card = copy.deepcopy(templates[i % len(templates)])
+        serial = f"{rng.getrandbits(64):016x}"
+        card["Serial Number"] = serial
+        card["Unique ID"] = f"0x{serial}"
+        card["PCI Bus"] = f"0000:{i // 32:02x}:{i % 32:02x}.0".upper()
+        for field, (low, high, fmt) in _sensor_ranges.items():
+            if field in card:
+                card[field] = fmt.format(rng.uniform(low, high))
+        output[f"card{i}"] = card
+
+    output["system"] = example.get("system", {})
+    return output
@@ -0,0 +1,19 @@
+"""
+Reading configuration from environment variables.
+"""
+import os
+
+# values of an on/off environment variable that turn it off
+_OFF = ("", "0", "false", "no")
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """
+    Whether the on/off environment variable `name` is on. Unset is `default`,
+    and "", "0", "false" and "no" (any case) are off, so `FLAG=0` doesn't turn
+    a feature on.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in _OFF
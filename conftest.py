@@ -0,0 +1,2 @@
+# makes pytest put the repo root on sys.path, so tests can import the
+# top-level modules when run with plain `pytest` as well as `python -m pytest`
@@ -0,0 +1,181 @@
+"""
+GPU energy as a monotonic counter, and the power derived from it.
+
+The raw "Energy counter" counts in units of the counter resolution (~15.3 uJ)
+and wraps, at 32 bits on some ASICs, so it can only be exported as a Gauge.
+EnergyTracker keeps the previous sample of each card, adds the joules between
+samples to `rocm_energy_joules_total`, and divides them by the time between
+the samples for `rocm_energy_power_watts`. That is the average power over the
+whole interval, rather than the firmware's own short power1_average window.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from prometheus_client import Counter, Gauge
+
+from parsers import parse_float, parse_int
+from scheduler import PeriodicThread
+
+# seconds between energy counter samples taken by EnergySampler, 0 derives
+# power from each collection instead
+ENERGY_SAMPLE_INTERVAL = float(os.environ.get("ENERGY_SAMPLE_INTERVAL", 0))
+
+_WRAP_32 = 1 << 32
+_WRAP_64 = 1 << 64
+
+energy_joules = Counter(
+    "rocm_energy_joules",
+    "Energy used by the GPU, from the energy counter",
+    labelnames=["gpu"],
+)
+
+energy_power = Gauge(
+    "rocm_energy_power_watts",
+    "Average power between the last two energy counter samples",
+    labelnames=["gpu"],
+)
+
+
+class EnergySample(NamedTuple):
+    counter: int
+    # uJ per count
+    resolution: float
+    # seconds, only compared with other samples of the same card
+    timestamp: float
+
+
+def counter_delta(previous: int, current: int) -> int:
+    """
+    Counts between two readings of a counter that wraps at 32 or 64 bits
+    """
+    if current >= previous:
+        return current - previous
+
+    # the counter width isn't reported, assume 32 bits while it fits
+    wrap = _WRAP_32 if previous < _WRAP_32 else _WRAP_64
+    delta = current + wrap - previous
+    # a real wrap happens close to the top of the range, anything else is the
+    # counter being reset (e.g. by a GPU reset)
+    if delta > wrap // 2:
+        return current
+    return delta
+
+
+def sample_from_values(values: Dict[str, Any], timestamp: float) -> Optional[EnergySample]:
+    """
+    Build a sample from one card's collected values, using the rsmi timestamp
+    and resolution when the backend provides them. The rocm-smi cli only
+    reports the counter and the accumulated energy, so the resolution is
+    worked out from those and `timestamp` is used.
+    """
+    try:
+        counter = int(parse_int(values["Energy counter"]))
+        if "Energy counter resolution (uJ)" in values:
+            resolution = parse_float(values["Energy counter resolution (uJ)"])
+        else:
+            resolution = parse_float(values["Accumulated Energy (uJ)"]) / counter
+        if "Energy timestamp (ns)" in values:
+            timestamp = parse_float(values["Energy timestamp (ns)"]) / 1e9
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    return EnergySample(counter, resolution, timestamp)
+
+
+class EnergyTracker:
+    """
+    Turns successive energy counter samples of each card into joules and
+    watts
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous: Dict[str, EnergySample] = {}
+
+    def observe(self, card_name: str, sample: EnergySample) -> Optional[float]:
+        """
+        Record `sample` for `card_name`, returning the power since the
+        previous sample if there is one
+        """
+        with self._lock:
+            previous = self._previous.get(card_name)
+            self._previous[card_name] = sample
+
+        if previous is None or sample.timestamp <= previous.timestamp:
+            return None
+
+        joules = counter_delta(previous.counter, sample.counter) * sample.resolution / 1e6
+        energy_joules.labels(card_name).inc(joules)
+        power = joules / (sample.timestamp - previous.timestamp)
+        energy_power.labels(card_name).set(power)
+        return power
+
+    def update(self, output: Dict[str, Dict[str, Any]], timestamp: Optional[float] = None):
+        """
+        Observe every card in a collection's output, and drop cards that are
+        no longer in it
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        for card_name, values in output.items():
+            if card_name == "system":
+                continue
+            sample = sample_from_values(values, timestamp)
+            if sample is not None:
+                self.observe(card_name, sample)
+
+        self.forget([card_name for card_name in output if card_name != "system"])
+
+    def forget(self, card_names: List[str]):
+        """
+        Drop every card not in `card_names`
+        """
+        keep = set(card_names)
+        with self._lock:
+            gone = [card_name for card_name in self._previous if card_name not in keep]
+            for card_name in gone:
+                del self._previous[card_name]
+        for card_name in gone:
+            for metric in (energy_joules, energy_power):
+                try:
+                    metric.remove(card_name)
+                except KeyError:
+                    # only sampled once, so never exported
+                    pass
+
+
+class EnergySampler:
+    """
+    Samples only the energy counters, every `interval` seconds on a daemon
+    thread, so power can be derived at a sub-second resolution independently
+    of the collection interval.
+
+    `backend` needs `devices()` and `read_energy(device)`, i.e. an
+    rsmi_backend.RsmiBackend.
+    """
+
+    def __init__(
+        self, backend: Any, tracker: EnergyTracker, interval: float = ENERGY_SAMPLE_INTERVAL
+    ):
+        self._backend = backend
+        self._tracker = tracker
+        self._interval = interval
+        self._thread: Optional[PeriodicThread] = None
+
+    def sample(self):
+        devices = self._backend.devices()
+        for device in devices:
+            sample = sample_from_values(self._backend.read_energy(device), time.monotonic())
+            if sample is not None:
+                self._tracker.observe(f"card{device}", sample)
+        self._tracker.forget([f"card{device}" for device in devices])
+
+    def start(self):
+        self._thread = PeriodicThread(self.sample, self._interval, "energy-sampler")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
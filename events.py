@@ -0,0 +1,159 @@
+"""
+GPU events from rsmi event notifications.
+
+VM faults, thermal throttling and GPU resets are reported by the driver as
+they happen. EventListener keeps notifications armed for every device on a
+thread of its own, counts each event in `rocm_events_total`, and calls back
+for the events that change what a collection would read: a throttle changes
+the sensors, and a reset can change the sensors and the identity/firmware
+info. That lets the exporter re-read the device straight away instead of at
+the next poll.
+"""
+import ctypes
+import logging
+import os
+import threading
+from ctypes import byref, c_char, c_int, c_uint32
+from typing import Any, Callable, Optional, Set
+
+from prometheus_client import Counter
+
+from rsmi_backend import RSMI_STATUS_SUCCESS, init_rocmsmi
+
+# milliseconds each rsmi_event_notification_get call waits for events, also
+# how often devices that have appeared get notifications armed
+EVENT_POLL_TIMEOUT = int(os.environ.get("EVENT_POLL_TIMEOUT", 1000))
+
+# rsmi_evt_notification_type_t, in enum order from 1
+_event_types = ["vm_fault", "thermal_throttle", "gpu_pre_reset", "gpu_post_reset"]
+
+# events after which the device's sensors should be re-read. The device is
+# unusable between the pre and post reset events, so only the post reset one
+# triggers anything.
+REFRESH_EVENTS = frozenset(["thermal_throttle", "gpu_post_reset"])
+
+# events after which the device's identity/firmware info should be re-read
+RELOAD_EVENTS = frozenset(["gpu_post_reset"])
+
+# MAX_EVENT_NOTIFICATION_MSG_SIZE
+_MESSAGE_SIZE = 64
+
+# events read per rsmi_event_notification_get call
+_BATCH_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+events = Counter(
+    "rocm_events",
+    "GPU events reported by the driver",
+    labelnames=["gpu", "type"],
+)
+
+
+class RsmiEventData(ctypes.Structure):
+    """
+    rsmi_evt_notification_data_t
+    """
+
+    _fields_ = [
+        ("dv_ind", c_uint32),
+        ("event", c_int),
+        ("message", c_char * _MESSAGE_SIZE),
+    ]
+
+
+EventCallback = Callable[[int, str], None]
+
+
+class EventListener:
+    """
+    Reads event notifications for every device on a daemon thread, counting
+    them and calling `on_event(device, event_type)` for each one.
+    """
+
+    def __init__(
+        self,
+        on_event: Optional[EventCallback] = None,
+        rocmsmi: Any = None,
+        timeout: int = EVENT_POLL_TIMEOUT,
+    ):
+        self._on_event = on_event
+        self._lib = init_rocmsmi(rocmsmi)
+        self._timeout = timeout
+        self._armed: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _arm(self):
+        """
+        Arm notifications of every event type for devices that don't have
+        them yet
+        """
+        count = c_uint32(0)
+        if self._lib.rsmi_num_monitor_devices(byref(count)) != RSMI_STATUS_SUCCESS:
+            return
+
+        mask = (1 << len(_event_types)) - 1
+        for device in range(count.value):
+            if device in self._armed:
+                continue
+            if (
+                self._lib.rsmi_event_notification_init(device) != RSMI_STATUS_SUCCESS
+                or self._lib.rsmi_event_notification_mask_set(device, mask) != RSMI_STATUS_SUCCESS
+            ):
+                logger.warning("Unable to arm event notifications for card%d", device)
+                continue
+            self._armed.add(device)
+
+    def poll(self) -> int:
+        """
+        Wait up to the timeout for events and handle them, returning how many
+        there were
+        """
+        data = (RsmiEventData * _BATCH_SIZE)()
+        num_elements = c_uint32(_BATCH_SIZE)
+        ret = self._lib.rsmi_event_notification_get(self._timeout, byref(num_elements), data)
+        if ret != RSMI_STATUS_SUCCESS:
+            # no events before the timeout
+            return 0
+
+        handled = 0
+        for event in data[: min(num_elements.value, _BATCH_SIZE)]:
+            if not 1 <= event.event <= len(_event_types):
+                continue
+            event_type = _event_types[event.event - 1]
+            message = event.message.decode("utf8", "replace")
+            logger.info("card%d %s: %s", event.dv_ind, event_type, message)
+            events.labels(f"card{event.dv_ind}", event_type).inc()
+            handled += 1
+            if self._on_event is not None:
+                try:
+                    self._on_event(event.dv_ind, event_type)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Handling %s of card%d failed", event_type, event.dv_ind)
+        return handled
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._arm()
+                if not self._armed:
+                    # nothing to wait on, check for devices again later
+                    self._stop.wait(self._timeout / 1000)
+                    continue
+                self.poll()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Reading events failed")
+                self._stop.wait(self._timeout / 1000)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for device in self._armed:
+            self._lib.rsmi_event_notification_stop(device)
+        self._armed = set()
@@ -0,0 +1,204 @@
+"""
+asyncio based /metrics server serving a pre-rendered payload.
+
+The text exposition is rendered once per collection cycle into an immutable
+bytes buffer (plus a gzipped copy), and every scrape is served from those
+buffers, so scrapers never re-serialise the registry or contend for its lock.
+Collectors whose output depends on when they are scraped (e.g. the sampler's
+"since the previous scrape" summaries) go in a separate `per_scrape`
+registry that is rendered for each scrape and appended to the buffers.
+"""
+import asyncio
+import gzip
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+
+_MAX_HEADER_LINES = 100
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadCache:
+    """
+    Holds the latest rendered exposition of `registry` and its gzipped copy.
+
+    Call `render()` after each collection cycle, `get()` returns None until
+    the first one. If `max_age` is set, `get()` re-renders a payload older
+    than that itself, which is what the scrape driven mode needs as
+    collection happens during rendering. `per_scrape` is rendered on every
+    `get()`, never cached.
+    """
+
+    def __init__(
+        self,
+        registry: CollectorRegistry = REGISTRY,
+        max_age: Optional[float] = None,
+        per_scrape: Optional[CollectorRegistry] = None,
+    ):
+        self._registry = registry
+        self._max_age = max_age
+        self._per_scrape = per_scrape
+        self._lock = threading.Lock()
+        self._payload: Optional[Tuple[bytes, bytes]] = None
+        self._rendered_at: Optional[float] = None
+
+    def render(self):
+        payload = generate_latest(self._registry)
+        # swap in both buffers at once so readers never see a mismatched pair
+        self._payload = (payload, gzip.compress(payload, compresslevel=6))
+        self._rendered_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        if self._max_age is None:
+            return False
+        return self._rendered_at is None or time.monotonic() - self._rendered_at >= self._max_age
+
+    def blocks(self) -> bool:
+        """
+        Whether `get()` has rendering to do, rather than returning buffers
+        """
+        return self._per_scrape is not None or self.is_stale()
+
+    def get(self) -> Optional[Tuple[bytes, bytes]]:
+        """
+        Returns (payload, gzipped payload), or None if nothing has been
+        rendered yet
+        """
+        if self.is_stale():
+            # concurrent scrapes wait for one render rather than each rendering
+            with self._lock:
+                if self.is_stale():
+                    self.render()
+        if self._per_scrape is None or self._payload is None:
+            return self._payload
+
+        payload, gzipped = self._payload
+        extra = generate_latest(self._per_scrape)
+        # a gzip stream can be made of several members, so the cached one is
+        # reused as is
+        return payload + extra, gzipped + gzip.compress(extra, compresslevel=6)
+
+
+def _accepts_gzip(headers: dict) -> bool:
+    accept_encoding = headers.get("accept-encoding", "")
+    return any(
+        encoding.split(";")[0].strip().lower() == "gzip" for encoding in accept_encoding.split(",")
+    )
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[str, str, dict, bool]]:
+    """
+    Returns (method, path, headers, keep alive), or None if the client has
+    closed the connection
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError(f"Bad request line: {request_line!r}")
+    method, path, version = parts
+
+    headers = {}
+    for _ in range(_MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    # HTTP/1.0 closes by default, HTTP/1.1 keeps alive by default
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+    return method, path, headers, keep_alive
+
+
+def _response(status: str, headers: dict, body: bytes, keep_alive: bool) -> bytes:
+    lines = [f"HTTP/1.1 {status}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append(f"Content-Length: {len(body)}")
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def _metrics_response(
+    cache: PayloadCache, method: str, headers: dict, keep_alive: bool
+) -> bytes:
+    try:
+        if cache.blocks():
+            rendered = await asyncio.get_running_loop().run_in_executor(None, cache.get)
+        else:
+            rendered = cache.get()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to render metrics")
+        return _response("500 Internal Server Error", {}, b"", keep_alive)
+
+    if rendered is None:
+        # before the first collection, rather than an empty 200 that would
+        # look like an exporter with no metrics
+        return _response("503 Service Unavailable", {}, b"", keep_alive)
+    payload, gzipped = rendered
+
+    response_headers = {"Content-Type": CONTENT_TYPE_LATEST}
+    if _accepts_gzip(headers):
+        body = gzipped
+        response_headers["Content-Encoding"] = "gzip"
+    else:
+        body = payload
+
+    response = _response("200 OK", response_headers, body, keep_alive)
+    if method == "HEAD":
+        response = response[: len(response) - len(body)]
+    return response
+
+
+async def _handle(cache: PayloadCache, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            method, path, headers, keep_alive = request
+
+            if method not in ("GET", "HEAD"):
+                writer.write(_response("405 Method Not Allowed", {}, b"", keep_alive))
+            elif path.split("?")[0] not in ("/", "/metrics"):
+                writer.write(_response("404 Not Found", {}, b"", keep_alive))
+            else:
+                writer.write(await _metrics_response(cache, method, headers, keep_alive))
+
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError) as e:
+        logger.debug("Dropping connection: %s", e)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to handle request")
+    finally:
+        writer.close()
+
+
+async def serve(port: int, cache: PayloadCache, addr: str = "0.0.0.0"):
+    server = await asyncio.start_server(lambda r, w: _handle(cache, r, w), addr, port)
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_http_server(port: int, cache: PayloadCache, addr: str = "0.0.0.0"):
+    """
+    Serve `cache` on `port` from an event loop in a daemon thread
+    """
+    thread = threading.Thread(
+        target=asyncio.run, args=(serve(int(port), cache, addr),), name="exposition", daemon=True
+    )
+    thread.start()
+    return thread
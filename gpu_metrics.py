@@ -0,0 +1,288 @@
+"""
+Parser for amdgpu's gpu_metrics sysfs file.
+
+/sys/class/drm/cardN/device/gpu_metrics is a versioned binary struct holding
+the temperatures, socket power, activity, current clocks, fan speed, energy
+accumulator and throttle status in one read, rather than a file (or rsmi
+call) per sensor. The struct layout depends on the format and content
+revision in its header, each known layout is precompiled into a
+`struct.Struct` and unpacked straight from a reused buffer. Layouts that
+aren't known here (e.g. the APU format 2 structs) aren't parsed, and those
+sensors are read some other way.
+
+    python gpu_metrics.py /sys/class/drm/card0/device/gpu_metrics
+
+prints what a file (or a captured copy of one) parses to.
+"""
+import os
+import struct
+import sys
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# metrics_table_header: structure_size, format_revision, content_revision
+_header = struct.Struct("<HBB")
+
+# uJ per count of energy_accumulator, the same constant librocm_smi uses
+ENERGY_RESOLUTION_UJ = 15.3
+
+# the largest struct is well under this, and it leaves room for newer
+# content revisions that extend a known layout
+_BUFFER_SIZE = 4096
+
+# gpu_metrics_v1_0, in C layout, so with 4 bytes of padding before the 64 bit
+# system_clock_counter and 4 after the u8 pcie fields
+_v1_0_fields = (
+    "system_clock_counter",
+    "temperature_edge",
+    "temperature_hotspot",
+    "temperature_mem",
+    "temperature_vrgfx",
+    "temperature_vrsoc",
+    "temperature_vrmem",
+    "average_gfx_activity",
+    "average_umc_activity",
+    "average_mm_activity",
+    "average_socket_power",
+    "energy_accumulator",
+    "average_gfxclk_frequency",
+    "average_socclk_frequency",
+    "average_uclk_frequency",
+    "average_vclk0_frequency",
+    "average_dclk0_frequency",
+    "average_vclk1_frequency",
+    "average_dclk1_frequency",
+    "current_gfxclk",
+    "current_socclk",
+    "current_uclk",
+    "current_vclk0",
+    "current_dclk0",
+    "current_vclk1",
+    "current_dclk1",
+    "throttle_status",
+    "current_fan_speed",
+    "pcie_link_width",
+    "pcie_link_speed",
+)
+
+# gpu_metrics_v1_1 up to temperature_hbm. v1_2 and v1_3 only append fields
+# after it, so they share this prefix.
+_v1_1_fields = (
+    "temperature_edge",
+    "temperature_hotspot",
+    "temperature_mem",
+    "temperature_vrgfx",
+    "temperature_vrsoc",
+    "temperature_vrmem",
+    "average_gfx_activity",
+    "average_umc_activity",
+    "average_mm_activity",
+    "average_socket_power",
+    "energy_accumulator",
+    "system_clock_counter",
+    "average_gfxclk_frequency",
+    "average_socclk_frequency",
+    "average_uclk_frequency",
+    "average_vclk0_frequency",
+    "average_dclk0_frequency",
+    "average_vclk1_frequency",
+    "average_dclk1_frequency",
+    "current_gfxclk",
+    "current_socclk",
+    "current_uclk",
+    "current_vclk0",
+    "current_dclk0",
+    "current_vclk1",
+    "current_dclk1",
+    "throttle_status",
+    "current_fan_speed",
+    "pcie_link_width",
+    "pcie_link_speed",
+    "padding",
+    "gfx_activity_acc",
+    "mem_activity_acc",
+    "temperature_hbm_0",
+    "temperature_hbm_1",
+    "temperature_hbm_2",
+    "temperature_hbm_3",
+)
+
+
+class Layout(NamedTuple):
+    struct: struct.Struct
+    fields: Tuple[str, ...]
+    # the all ones value of each field, which means the ASIC doesn't support it
+    unsupported: Tuple[int, ...]
+
+
+def _struct_codes(fmt: str) -> Tuple[str, ...]:
+    # "<4x3HQ" -> ("H", "H", "H", "Q"), pad bytes skipped
+    codes = []
+    count = ""
+    for char in fmt.lstrip("<"):
+        if char.isdigit():
+            count += char
+            continue
+        if char != "x":
+            codes.extend(char * int(count or 1))
+        count = ""
+    return tuple(codes)
+
+
+def _make_layout(fmt: str, fields: Tuple[str, ...]) -> Layout:
+    codes = _struct_codes(fmt)
+    assert len(codes) == len(fields)
+    unsupported = tuple((1 << (8 * struct.calcsize(code))) - 1 for code in codes)
+    return Layout(struct.Struct(fmt), fields, unsupported)
+
+
+# the header is unpacked separately, so is skipped here
+_v1_0 = _make_layout("<4x4xQ6H3HHI7H7HIHBB4x", _v1_0_fields)
+_v1_1 = _make_layout("<4x6H3HHQQ7H7HIHHHHII4H", _v1_1_fields)
+
+# (format_revision, content_revision) -> layout
+_layouts: Dict[Tuple[int, int], Layout] = {
+    (1, 0): _v1_0,
+    (1, 1): _v1_1,
+    (1, 2): _v1_1,
+    (1, 3): _v1_1,
+}
+
+# struct field -> rocm-smi field, and how to convert the raw value
+_field_map = {
+    "temperature_edge": ("Temperature (Sensor edge) (C)", float),
+    "temperature_hotspot": ("Temperature (Sensor junction) (C)", float),
+    "temperature_mem": ("Temperature (Sensor memory) (C)", float),
+    "average_gfx_activity": ("GPU use (%)", int),
+    "average_socket_power": ("Average Graphics Package Power (W)", float),
+    "current_gfxclk": ("sclk clock speed:", int),
+    "current_socclk": ("socclk clock speed:", int),
+    "current_uclk": ("mclk clock speed:", int),
+    # the same accumulators rocm-smi reports, see utilization.py
+    "gfx_activity_acc": ("GFX Activity", int),
+    "mem_activity_acc": ("Memory Activity", int),
+    "current_fan_speed": ("Fan RPM", int),
+    "throttle_status": ("Throttle status", int),
+    "energy_accumulator": ("Energy counter", int),
+    "system_clock_counter": ("Energy timestamp (ns)", int),
+}
+
+
+def layout_for(blob: Any) -> Optional[Layout]:
+    """
+    The layout of `blob`, or None if its revision isn't known or it's too
+    short for that layout
+    """
+    if len(blob) < _header.size:
+        return None
+    size, format_revision, content_revision = _header.unpack_from(blob, 0)
+    layout = _layouts.get((format_revision, content_revision))
+    if layout is None or min(size, len(blob)) < layout.struct.size:
+        return None
+    return layout
+
+
+def unpack(blob: Any, layout: Layout) -> Dict[str, int]:
+    """
+    The raw struct fields of `blob`, which can be any buffer, leaving out the
+    ones the ASIC doesn't support
+    """
+    return {
+        name: value
+        for name, value, unsupported in zip(
+            layout.fields, layout.struct.unpack_from(blob, 0), layout.unsupported
+        )
+        if value != unsupported
+    }
+
+
+def to_fields(raw: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Map raw struct fields to rocm-smi fields
+    """
+    values = {}
+    for name, (field, conversion) in _field_map.items():
+        value = raw.get(name)
+        if value is not None:
+            values[field] = conversion(value)
+
+    if "Energy counter" in values:
+        values["Energy counter resolution (uJ)"] = ENERGY_RESOLUTION_UJ
+        values["Accumulated Energy (uJ)"] = round(values["Energy counter"] * ENERGY_RESOLUTION_UJ, 2)
+    else:
+        # a timestamp is only useful alongside the counter
+        values.pop("Energy timestamp (ns)", None)
+    return values
+
+
+def parse_gpu_metrics(blob: Any) -> Optional[Dict[str, Any]]:
+    """
+    rocm-smi fields of a gpu_metrics blob, or None if its layout isn't known
+    """
+    layout = layout_for(blob)
+    if layout is None:
+        return None
+    return to_fields(unpack(blob, layout))
+
+
+def synthesize(format_revision: int, content_revision: int, **raw: int) -> bytes:
+    """
+    A gpu_metrics blob of a known revision, with every field not in `raw`
+    set to all ones (unsupported), e.g. to build a fake sysfs tree
+    """
+    layout = _layouts[(format_revision, content_revision)]
+    body = layout.struct.pack(
+        *(raw.get(name, unsupported) for name, unsupported in zip(layout.fields, layout.unsupported))
+    )
+    return _header.pack(len(body), format_revision, content_revision) + body[_header.size :]
+
+
+class GpuMetricsFile:
+    """
+    An open gpu_metrics file, re-read with a single `preadv` into a reused
+    buffer. `fields` is empty if the file's layout isn't known.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer = bytearray(_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._fd: Optional[int] = os.open(path, os.O_RDONLY)
+
+        try:
+            self._layout = layout_for(self._view[: self._read()])
+            self.fields = frozenset(self.read())
+        except BaseException:
+            self.close()
+            raise
+        if self._layout is None:
+            self.close()
+
+    def _read(self) -> int:
+        return os.preadv(self._fd, [self._buffer], 0)
+
+    def read(self) -> Dict[str, Any]:
+        if self._layout is None:
+            return {}
+        length = self._read()
+        if length < self._layout.struct.size:
+            return {}
+        return to_fields(unpack(self._view, self._layout))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as f:
+        blob = f.read()
+    size, format_revision, content_revision = _header.unpack_from(blob, 0)
+    print(f"format {format_revision}, content {content_revision}, {size} bytes")
+    layout = layout_for(blob)
+    if layout is None:
+        print("unknown layout")
+    else:
+        for name, value in unpack(blob, layout).items():
+            print(f"{name}: {value}")
+        print(to_fields(unpack(blob, layout)))
@@ -0,0 +1,78 @@
+"""
+Fan out per-device reads across a bounded thread pool.
+
+A device that doesn't answer within the timeout gets a
+`device_scrape_timeout` marker instead of holding up every other device, and
+one whose read raises gets a `device_scrape_error` marker.
+"""
+import logging
+import math
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Hashable, Iterable
+
+# number of threads used to read devices, 0 reads them serially
+COLLECTION_THREADS = int(os.environ.get("COLLECTION_THREADS", 0))
+
+# seconds a single device read may take before it is marked as timed out
+DEVICE_TIMEOUT = float(os.environ.get("DEVICE_TIMEOUT", 2))
+
+TIMEOUT_MARKER = "device_scrape_timeout"
+ERROR_MARKER = "device_scrape_error"
+
+logger = logging.getLogger(__name__)
+
+
+class DevicePool:
+    """
+    Reads devices in parallel and merges the results into one snapshot.
+
+    Threads can't be cancelled, so a read that is still running from an
+    earlier call (e.g. a hung GPU) is waited on again rather than a new read
+    being queued behind it.
+    """
+
+    def __init__(self, max_workers: int = COLLECTION_THREADS, timeout: float = DEVICE_TIMEOUT):
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="device")
+        self._pending: Dict[Hashable, Future] = {}
+
+    def _read(self, read_fn: Callable[[Any], Dict[str, Any]], device: Any) -> Dict[str, Any]:
+        try:
+            values = read_fn(device)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to read device %s", device)
+            return {TIMEOUT_MARKER: 0, ERROR_MARKER: 1}
+        return {TIMEOUT_MARKER: 0, ERROR_MARKER: 0, **values}
+
+    def map(
+        self, read_fn: Callable[[Any], Dict[str, Any]], devices: Iterable[Hashable]
+    ) -> Dict[Hashable, Dict[str, Any]]:
+        futures = {}
+        for device in devices:
+            future = self._pending.get(device)
+            if future is None or future.done():
+                future = self._executor.submit(self._read, read_fn, device)
+                self._pending[device] = future
+            futures[device] = future
+
+        # devices beyond max_workers queue behind the first batch, so give
+        # each batch the full timeout
+        batches = math.ceil(len(futures) / self._max_workers) if futures else 0
+        deadline = time.monotonic() + self._timeout * batches
+
+        results = {}
+        for device, future in futures.items():
+            try:
+                results[device] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning("Timed out reading device %s", device)
+                results[device] = {TIMEOUT_MARKER: 1}
+
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
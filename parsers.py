@@ -0,0 +1,138 @@
+"""
+Parsers turning raw rocm-smi values into numbers for gauges.
+
+rocm-smi reports values as strings such as "N/A", "(2270Mhz)" or
+"1 (8.0GT/s x8)". The in-process backends report native numbers. Every parser
+accepts both and raises ValueError for anything it can't make sense of.
+"""
+import re
+from typing import Any, Callable, Dict
+
+Parser = Callable[[Any], float]
+
+_mhz_re = re.compile(r"^\(?\s*([0-9.]+)\s*Mhz\s*\)?$", re.IGNORECASE)
+
+# e.g. "1 (8.0GT/s x8)"
+_pcie_re = re.compile(r"^(\d+)\s*\(\s*([0-9.]+)\s*GT/s\s+x(\d+)\s*\)$")
+
+
+def parse_hex(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(int(str(value).strip(), 16))
+
+
+def parse_float(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    if value[:2].lower() == "0x":
+        return parse_hex(value)
+    return float(value)
+
+
+def parse_int(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(int(value))
+    return float(int(str(value).strip()))
+
+
+def parse_mhz(value: Any) -> float:
+    """
+    "(2270Mhz)" -> 2270.0
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _mhz_re.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Not a clock speed: {value!r}")
+    return float(match.group(1))
+
+
+def _match_pcie(value: Any) -> "re.Match[str]":
+    match = _pcie_re.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Not a pcie clock level: {value!r}")
+    return match
+
+
+def parse_pcie_level(value: Any) -> float:
+    """
+    "1 (8.0GT/s x8)" -> 1.0
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(_match_pcie(value).group(1))
+
+
+def parse_pcie_speed(value: Any) -> float:
+    """
+    "1 (8.0GT/s x8)" -> 8.0 (GT/s)
+    """
+    return float(_match_pcie(value).group(2))
+
+
+def parse_pcie_width(value: Any) -> float:
+    """
+    "1 (8.0GT/s x8)" -> 8.0 (lanes)
+    """
+    return float(_match_pcie(value).group(3))
+
+
+def make_enum_parser(values: Dict[str, int]) -> Parser:
+    """
+    Returns a parser mapping each (case insensitive) string in `values` to its
+    number
+    """
+    lookup = {name.lower(): float(number) for name, number in values.items()}
+
+    def parse_enum(value: Any) -> float:
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            return lookup[str(value).strip().lower()]
+        except KeyError:
+            raise ValueError(f"Unknown value: {value!r}") from None
+
+    return parse_enum
+
+
+# rsmi_dev_perf_level_t
+parse_perf_level = make_enum_parser(
+    {
+        "auto": 0,
+        "low": 1,
+        "high": 2,
+        "manual": 3,
+        "stable_std": 4,
+        "stable_peak": 5,
+        "stable_min_mclk": 6,
+        "stable_min_sclk": 7,
+        "determinism": 8,
+    }
+)
+
+# raw rocm-smi key -> parser, anything not listed uses parse_float
+_field_parsers: Dict[str, Parser] = {
+    "GPU use (%)": parse_int,
+    "GPU OverDrive value (%)": parse_int,
+    "GPU Memory OverDrive value (%)": parse_int,
+    "PCIe Replay Count": parse_int,
+    "Energy counter": parse_int,
+    "dcefclk clock speed:": parse_mhz,
+    "dcefclk clock level:": parse_int,
+    "fclk clock speed:": parse_mhz,
+    "fclk clock level:": parse_int,
+    "mclk clock speed:": parse_mhz,
+    "mclk clock level:": parse_int,
+    "sclk clock speed:": parse_mhz,
+    "sclk clock level:": parse_int,
+    "socclk clock speed:": parse_mhz,
+    "socclk clock level:": parse_int,
+    "pcie clock level": parse_pcie_level,
+    "Performance Level": parse_perf_level,
+}
+
+
+def get_parser(field: str) -> Parser:
+    return _field_parsers.get(field, parse_float)
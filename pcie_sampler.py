@@ -0,0 +1,168 @@
+"""
+PCIe throughput measured on background threads.
+
+rsmi_dev_pci_throughput_get counts PCIe packets for a second inside the
+driver before returning, so calling it in the collection cycle would add a
+second per device. Instead each device gets a thread of its own that keeps
+measuring, and the latest measurement is exported when /metrics is rendered,
+along with its age.
+
+The library holds its per-device lock while measuring, so other calls for
+that device wait for the measurement to finish. PCIE_SAMPLE_INTERVAL spaces
+measurements out to leave most of the time free for those calls.
+"""
+import functools
+import os
+import threading
+import time
+from ctypes import byref, c_uint32, c_uint64
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+from prometheus_client.core import GaugeMetricFamily
+
+from rsmi_backend import RSMI_STATUS_SUCCESS, init_rocmsmi
+from scheduler import PeriodicThread
+
+# seconds from the start of one measurement of a device to the start of the
+# next, each measurement takes about a second
+PCIE_SAMPLE_INTERVAL = float(os.environ.get("PCIE_SAMPLE_INTERVAL", 5))
+
+
+class PcieThroughput(NamedTuple):
+    # packets x max packet size, an upper bound on the bytes actually moved
+    max_sent_bytes_per_second: float
+    max_received_bytes_per_second: float
+    max_packet_size: int
+    # time.monotonic() when the measurement finished
+    timestamp: float
+
+
+class PcieThroughputSampler:
+    """
+    Measures the PCIe throughput of every device on a daemon thread per
+    device, and is a custom collector exporting the latest measurements.
+
+    Threads are started for devices that appear when the device count is
+    checked on each collection, and stop once their device is gone.
+    """
+
+    def __init__(self, rocmsmi: Any = None, interval: float = PCIE_SAMPLE_INTERVAL):
+        self._lib = init_rocmsmi(rocmsmi)
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._latest: Dict[int, PcieThroughput] = {}
+        self._threads: Dict[int, PeriodicThread] = {}
+        self._num_devices = 0
+        self._stopped = False
+
+    def measure(self, device: int) -> Optional[PcieThroughput]:
+        """
+        Measure `device`, blocking for about a second
+        """
+        sent = c_uint64(0)
+        received = c_uint64(0)
+        max_packet_size = c_uint64(0)
+        ret = self._lib.rsmi_dev_pci_throughput_get(
+            device, byref(sent), byref(received), byref(max_packet_size)
+        )
+        if ret != RSMI_STATUS_SUCCESS:
+            return None
+        # the counts are packets over one second, multiplied by the max packet
+        # size as rocm-smi --showbw does for its "estimated maximum" bandwidth
+        return PcieThroughput(
+            sent.value * max_packet_size.value,
+            received.value * max_packet_size.value,
+            max_packet_size.value,
+            time.monotonic(),
+        )
+
+    def _sample(self, device: int) -> bool:
+        if device >= self._num_devices:
+            with self._lock:
+                # a replacement may already have been started for the device
+                if self._threads.get(device) is threading.current_thread():
+                    self._latest.pop(device, None)
+                    del self._threads[device]
+            return False
+
+        throughput = self.measure(device)
+        if throughput is not None:
+            with self._lock:
+                self._latest[device] = throughput
+        return True
+
+    def _update_devices(self):
+        count = c_uint32(0)
+        if self._lib.rsmi_num_monitor_devices(byref(count)) != RSMI_STATUS_SUCCESS:
+            return
+        self._num_devices = count.value
+
+        with self._lock:
+            if self._stopped:
+                return
+            for device in range(self._num_devices):
+                if device in self._threads:
+                    continue
+                thread = PeriodicThread(
+                    functools.partial(self._sample, device), self._interval, f"pcie-card{device}"
+                )
+                self._threads[device] = thread
+                thread.start()
+
+    def start(self):
+        self._update_devices()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            threads = list(self._threads.values())
+        # stop them all before waiting, each can be a second into a measurement
+        for thread in threads:
+            thread.stop(wait=False)
+        for thread in threads:
+            thread.join()
+
+    def describe(self):
+        # nothing to describe up front
+        return []
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        self._update_devices()
+        with self._lock:
+            latest = dict(self._latest)
+
+        sent = GaugeMetricFamily(
+            "rocm_pcie_estimated_max_sent_bytes_per_second",
+            "Estimated maximum PCIe bytes sent per second (packets x max packet size), "
+            "over the latest one second measurement",
+            labels=["gpu"],
+        )
+        received = GaugeMetricFamily(
+            "rocm_pcie_estimated_max_received_bytes_per_second",
+            "Estimated maximum PCIe bytes received per second (packets x max packet size), "
+            "over the latest one second measurement",
+            labels=["gpu"],
+        )
+        max_packet_size = GaugeMetricFamily(
+            "rocm_pcie_max_packet_size_bytes",
+            "Maximum PCIe packet size",
+            labels=["gpu"],
+        )
+        age = GaugeMetricFamily(
+            "rocm_pcie_throughput_age_seconds",
+            "Time since the latest PCIe throughput measurement finished",
+            labels=["gpu"],
+        )
+
+        now = time.monotonic()
+        for device, throughput in sorted(latest.items()):
+            label_values = [f"card{device}"]
+            sent.add_metric(label_values, throughput.max_sent_bytes_per_second)
+            received.add_metric(label_values, throughput.max_received_bytes_per_second)
+            max_packet_size.add_metric(label_values, throughput.max_packet_size)
+            age.add_metric(label_values, now - throughput.timestamp)
+
+        yield sent
+        yield received
+        yield max_packet_size
+        yield age
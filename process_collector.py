@@ -0,0 +1,215 @@
+"""
+Per-process GPU usage of KFD (compute) processes, the same data as
+`rocm-smi --showpids`.
+
+Every process is listed with one rsmi_compute_process_info_get call, which
+only fills in the PIDs, so as in rocm-smi's showPids each process's usage is
+then read with rsmi_compute_process_info_by_pid_get. Only the `top_n`
+processes using the most VRAM get per-GPU metrics, to bound label
+cardinality on busy nodes, and process names are read from /proc and cached
+rather than forking `ps` per process.
+"""
+import ctypes
+import logging
+import os
+from ctypes import byref, c_uint32, c_uint64
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import self_metrics
+from rsmi_backend import RSMI_STATUS_SUCCESS, init_rocmsmi
+
+# number of processes, by VRAM use, to export per-process metrics for
+PROCESS_TOP_N = int(os.environ.get("PROCESS_TOP_N", 20))
+
+# rsmi_compute_process_info_get can return more processes than it counted
+# a moment earlier, if processes start in between
+_SLACK = 10
+
+logger = logging.getLogger(__name__)
+
+
+class RsmiProcessInfo(ctypes.Structure):
+    """
+    rsmi_process_info_t
+    """
+
+    _fields_ = [
+        ("process_id", c_uint32),
+        ("pasid", c_uint32),
+        ("vram_usage", c_uint64),
+        ("sdma_usage", c_uint64),  # microseconds
+        ("cu_occupancy", c_uint32),
+    ]
+
+
+class ProcessNames:
+    """
+    PID -> /proc/<pid>/comm cache. A PID can be reused by a new process, so a
+    cached name is only used while the process start time matches.
+    """
+
+    def __init__(self, proc_root: str = "/proc"):
+        self._proc_root = proc_root
+        self._names: Dict[int, Tuple[int, str]] = {}
+
+    def _start_time(self, pid: int) -> Optional[int]:
+        try:
+            with open(os.path.join(self._proc_root, str(pid), "stat"), "r") as f:
+                # comm is in brackets and can contain spaces, starttime is the
+                # 22nd field
+                return int(f.read().rsplit(")", 1)[1].split()[19])
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def get(self, pid: int) -> str:
+        start_time = self._start_time(pid)
+        if start_time is None:
+            return "unknown"
+
+        cached = self._names.get(pid)
+        if cached is not None and cached[0] == start_time:
+            return cached[1]
+
+        try:
+            with open(os.path.join(self._proc_root, str(pid), "comm"), "r") as f:
+                name = f.read().rstrip("\n")
+        except OSError:
+            return "unknown"
+        self._names[pid] = (start_time, name)
+        return name
+
+    def prune(self, pids: List[int]):
+        """
+        Forget every PID not in `pids`
+        """
+        keep = set(pids)
+        for pid in list(self._names):
+            if pid not in keep:
+                del self._names[pid]
+
+
+class ProcessCollector:
+    """
+    Custom collector exporting the VRAM, CU occupancy and SDMA time of each
+    KFD process per GPU, read when /metrics is rendered.
+
+    Per-GPU values need rsmi_compute_process_info_by_device_get; with older
+    libraries a process's totals are reported once, with the GPUs it uses
+    joined in the gpu label.
+    """
+
+    def __init__(
+        self,
+        rocmsmi: Any = None,
+        top_n: int = PROCESS_TOP_N,
+        names: Optional[ProcessNames] = None,
+    ):
+        self._lib = init_rocmsmi(rocmsmi)
+        self._top_n = top_n
+        self._names = names if names is not None else ProcessNames()
+
+        try:
+            self._info_by_device = self._lib.rsmi_compute_process_info_by_device_get
+        except AttributeError:
+            logger.info("No per-device process info, reporting per-process totals")
+            self._info_by_device = None
+
+    def processes(self) -> List[RsmiProcessInfo]:
+        """
+        Every KFD process, from a single batched call. Only `process_id` and
+        `pasid` are filled in, see `info()` for the usage.
+        """
+        count = c_uint32(0)
+        if self._lib.rsmi_compute_process_info_get(None, byref(count)) != RSMI_STATUS_SUCCESS:
+            return []
+        if count.value == 0:
+            return []
+
+        count.value += _SLACK
+        procs = (RsmiProcessInfo * count.value)()
+        if self._lib.rsmi_compute_process_info_get(procs, byref(count)) != RSMI_STATUS_SUCCESS:
+            return []
+        return list(procs[: min(count.value, len(procs))])
+
+    def info(self, pid: int) -> Optional[RsmiProcessInfo]:
+        """
+        The usage of `pid` summed over its GPUs, or None if it has exited
+        """
+        info = RsmiProcessInfo()
+        if self._lib.rsmi_compute_process_info_by_pid_get(pid, byref(info)) != RSMI_STATUS_SUCCESS:
+            return None
+        return info
+
+    def gpus(self, pid: int) -> List[int]:
+        count = c_uint32(0)
+        if self._lib.rsmi_compute_process_gpus_get(pid, None, byref(count)) != RSMI_STATUS_SUCCESS:
+            return []
+        devices = (c_uint32 * count.value)()
+        if self._lib.rsmi_compute_process_gpus_get(pid, devices, byref(count)) != RSMI_STATUS_SUCCESS:
+            return []
+        return list(devices[: min(count.value, len(devices))])
+
+    def usage(self, proc: RsmiProcessInfo) -> Iterator[Tuple[str, RsmiProcessInfo]]:
+        """
+        Yields (gpu label, usage) for each GPU `proc` uses, `proc` being the
+        totals from `info()`
+        """
+        devices = self.gpus(proc.process_id)
+        if self._info_by_device is None:
+            yield ",".join(f"card{device}" for device in devices), proc
+            return
+
+        for device in devices:
+            info = RsmiProcessInfo()
+            if self._info_by_device(proc.process_id, device, byref(info)) == RSMI_STATUS_SUCCESS:
+                yield f"card{device}", info
+
+    def describe(self):
+        # nothing to describe up front, and describing would mean collecting
+        # at registration time
+        return []
+
+    def collect(self):
+        with self_metrics.process_collection_duration.time():
+            procs = self.processes()
+            self._names.prune([proc.process_id for proc in procs])
+
+            labels = ["pid", "comm", "gpu"]
+            processes = GaugeMetricFamily(
+                "rocm_processes", "Number of KFD (compute) processes", value=len(procs)
+            )
+            vram = GaugeMetricFamily(
+                "rocm_process_vram_bytes", "VRAM used by the process", labels=labels
+            )
+            cu_occupancy = GaugeMetricFamily(
+                "rocm_process_cu_occupancy",
+                "Number of compute units in use by the process",
+                labels=labels,
+            )
+            sdma = CounterMetricFamily(
+                "rocm_process_sdma_usage_seconds",
+                "Time the process has used the SDMA engines",
+                labels=labels,
+            )
+
+            totals = [self.info(proc.process_id) for proc in procs]
+            top = sorted(
+                (info for info in totals if info is not None),
+                key=lambda info: info.vram_usage,
+                reverse=True,
+            )[: self._top_n]
+            for proc in top:
+                pid = proc.process_id
+                comm = self._names.get(pid)
+                for gpu, info in self.usage(proc):
+                    label_values = [str(pid), comm, gpu]
+                    vram.add_metric(label_values, info.vram_usage)
+                    cu_occupancy.add_metric(label_values, info.cu_occupancy)
+                    sdma.add_metric(label_values, info.sdma_usage / 1000000)
+
+        yield processes
+        yield vram
+        yield cu_occupancy
+        yield sdma
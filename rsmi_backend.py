@@ -0,0 +1,552 @@
+"""
+In-process collection backend built on the librocm_smi64 ctypes bindings.
+
+Instead of forking the rocm-smi CLI every cycle, the library is loaded and
+initialised once, and the same calls rocm-smi makes (rsmi_dev_temp_metric_get,
+rsmi_dev_power_ave_get, rsmi_dev_busy_percent_get, ...) are made directly.
+The output has the same shape as `rocm-smi --json`, so server.py can use it
+as a drop in replacement for `get_smi_output()`.
+"""
+import ctypes
+import os
+import sys
+from ctypes import (
+    byref,
+    c_float,
+    c_int,
+    c_int64,
+    c_uint16,
+    c_uint32,
+    c_uint64,
+    create_string_buffer,
+)
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import self_metrics
+from parallel import COLLECTION_THREADS, DevicePool
+
+# where the rsmiBindings module that ships with rocm-smi lives
+RSMI_BINDINGS_PATH = os.environ.get("RSMI_BINDINGS_PATH", "/opt/rocm/libexec/rocm_smi/")
+
+# optional path to a shared library to load directly instead of going through
+# rsmiBindings (e.g. a stub library for testing)
+RSMI_LIB_PATH = os.environ.get("RSMI_LIB_PATH")
+
+# values from rocm_smi.h, duplicated here so a fake library can be used
+# without rsmiBindings being importable
+RSMI_STATUS_SUCCESS = 0
+RSMI_TEMP_CURRENT = 0
+RSMI_MEM_TYPE_VRAM = 0
+RSMI_VOLT_TYPE_VDDGFX = 0
+RSMI_VOLT_CURRENT = 0
+RSMI_SW_COMP_DRIVER = 0
+
+# RSMI_MAX_NUM_FREQUENCIES, as of the rocm-smi version in the README
+RSMI_MAX_NUM_FREQUENCIES = 32
+
+# RSMI_COARSE_GRAIN_MEM_ACTIVITY
+RSMI_COARSE_GRAIN_MEM_ACTIVITY = 1
+
+# RSMI_DEV_PERF_LEVEL_UNKNOWN, every level below it is known
+RSMI_DEV_PERF_LEVEL_UNKNOWN = 0x100
+
+# rocm-smi clock name -> rsmi_clk_type_t
+_clk_types = {
+    "sclk": 0,
+    "fclk": 1,
+    "dcefclk": 2,
+    "socclk": 3,
+    "mclk": 4,
+}
+
+_temp_sensors = {
+    "edge": 0,
+    "junction": 1,
+    "memory": 2,
+}
+
+# rsmi_fw_block_t, in enum order
+_fw_blocks = [
+    "ASD",
+    "CE",
+    "DMCU",
+    "MC",
+    "ME",
+    "MEC",
+    "MEC2",
+    "PFP",
+    "RLC",
+    "RLC SRLC",
+    "RLC SRLG",
+    "RLC SRLS",
+    "SDMA",
+    "SDMA2",
+    "SMC",
+    "SOS",
+    "TA RAS",
+    "TA XGMI",
+    "UVD",
+    "VCE",
+    "VCN",
+]
+
+_BUFFER_SIZE = 256
+
+DeviceReader = Callable[[Any, int], Dict[str, Any]]
+
+
+class RsmiFrequencies(ctypes.Structure):
+    """
+    rsmi_frequencies_t
+    """
+
+    _fields_ = [
+        ("num_supported", c_uint32),
+        ("current", c_uint32),
+        ("frequency", c_uint64 * RSMI_MAX_NUM_FREQUENCIES),
+    ]
+
+
+class RsmiPcieBandwidth(ctypes.Structure):
+    """
+    rsmi_pcie_bandwidth_t
+    """
+
+    _fields_ = [
+        ("transfer_rate", RsmiFrequencies),
+        ("lanes", c_uint32 * RSMI_MAX_NUM_FREQUENCIES),
+    ]
+
+
+class RsmiUtilizationCounter(ctypes.Structure):
+    """
+    rsmi_utilization_counter_t
+    """
+
+    _fields_ = [
+        ("type", c_int),
+        ("value", c_uint64),
+    ]
+
+
+def load_rocmsmi() -> Any:
+    """
+    Load librocm_smi64, either directly from RSMI_LIB_PATH or via the
+    rsmiBindings module used by rocm-smi
+    """
+    if RSMI_LIB_PATH:
+        return ctypes.CDLL(RSMI_LIB_PATH)
+
+    if RSMI_BINDINGS_PATH not in sys.path:
+        sys.path.append(RSMI_BINDINGS_PATH)
+
+    import rsmiBindings  # pylint: disable=import-error,import-outside-toplevel
+
+    return rsmiBindings.rocmsmi
+
+
+def _ok(ret: int) -> bool:
+    return ret == RSMI_STATUS_SUCCESS
+
+
+def init_rocmsmi(rocmsmi: Any = None) -> Any:
+    """
+    Initialise `rocmsmi`, or librocm_smi64 from load_rocmsmi() if it's None,
+    and return it. `rocmsmi` can be any object exposing the rsmi_* functions,
+    e.g. a stub shared library or a Python fake.
+    """
+    lib = rocmsmi if rocmsmi is not None else load_rocmsmi()
+    ret = lib.rsmi_init(0)
+    if not _ok(ret):
+        raise RuntimeError(f"rsmi_init failed with status {ret}")
+    return lib
+
+
+def _read_string(fn: Callable, device: int) -> Optional[str]:
+    buf = create_string_buffer(_BUFFER_SIZE)
+    if not _ok(fn(device, buf, _BUFFER_SIZE)):
+        return None
+    try:
+        return buf.value.decode()
+    except UnicodeDecodeError:
+        return None
+
+
+def _read_temps(lib: Any, device: int) -> Dict[str, Any]:
+    values = {}
+    temp = c_int64(0)
+    for sensor, index in _temp_sensors.items():
+        ret = lib.rsmi_dev_temp_metric_get(c_uint32(device), index, RSMI_TEMP_CURRENT, byref(temp))
+        if _ok(ret):
+            values[f"Temperature (Sensor {sensor}) (C)"] = temp.value / 1000
+    return values
+
+
+def _read_overdrive(lib: Any, device: int) -> Dict[str, Any]:
+    values = {}
+    od = c_uint32()
+    if _ok(lib.rsmi_dev_overdrive_level_get(device, byref(od))):
+        values["GPU OverDrive value (%)"] = od.value
+    if _ok(lib.rsmi_dev_mem_overdrive_level_get(device, byref(od))):
+        values["GPU Memory OverDrive value (%)"] = od.value
+    return values
+
+
+def _read_power(lib: Any, device: int) -> Dict[str, Any]:
+    values = {}
+    power = c_uint64()
+    if _ok(lib.rsmi_dev_power_cap_get(device, 0, byref(power))):
+        values["Max Graphics Package Power (W)"] = power.value / 1000000
+    if _ok(lib.rsmi_dev_power_ave_get(device, 0, byref(power))):
+        values["Average Graphics Package Power (W)"] = power.value / 1000000
+    return values
+
+
+def _read_gpu_use(lib: Any, device: int) -> Dict[str, Any]:
+    percent = c_uint32()
+    if _ok(lib.rsmi_dev_busy_percent_get(device, byref(percent))):
+        return {"GPU use (%)": percent.value}
+    return {}
+
+
+def _read_mem_use(lib: Any, device: int) -> Dict[str, Any]:
+    # same calculation as the patched rocm-smi (see README)
+    used = c_uint64()
+    total = c_uint64()
+    if not _ok(lib.rsmi_dev_memory_usage_get(device, RSMI_MEM_TYPE_VRAM, byref(used))):
+        return {}
+    if not _ok(lib.rsmi_dev_memory_total_get(device, RSMI_MEM_TYPE_VRAM, byref(total))):
+        return {"GPU memory use": used.value}
+    values = {
+        "GPU memory use": used.value,
+        "GPU memory available": total.value,
+    }
+    if total.value:
+        values["GPU memory use (%)"] = 100 * used.value / total.value
+    return values
+
+
+def _read_replay_count(lib: Any, device: int) -> Dict[str, Any]:
+    counter = c_uint64()
+    if _ok(lib.rsmi_dev_pci_replay_counter_get(device, byref(counter))):
+        return {"PCIe Replay Count": counter.value}
+    return {}
+
+
+def _read_voltage(lib: Any, device: int) -> Dict[str, Any]:
+    voltage = c_uint64()
+    ret = lib.rsmi_dev_volt_metric_get(
+        device, RSMI_VOLT_TYPE_VDDGFX, RSMI_VOLT_CURRENT, byref(voltage)
+    )
+    if _ok(ret):
+        return {"Voltage (mV)": voltage.value}
+    return {}
+
+
+def _read_energy(lib: Any, device: int) -> Dict[str, Any]:
+    counter = c_uint64()
+    resolution = c_float()
+    timestamp = c_uint64()
+    ret = lib.rsmi_dev_energy_count_get(device, byref(counter), byref(resolution), byref(timestamp))
+    if not _ok(ret):
+        return {}
+    return {
+        "Energy counter": counter.value,
+        "Accumulated Energy (uJ)": round(counter.value * resolution.value, 2),
+        "Energy counter resolution (uJ)": resolution.value,
+        "Energy timestamp (ns)": timestamp.value,
+    }
+
+
+def _read_fan(lib: Any, device: int) -> Dict[str, Any]:
+    level = c_int64()
+    level_max = c_int64()
+    if not _ok(lib.rsmi_dev_fan_speed_get(device, 0, byref(level))):
+        return {}
+    if not _ok(lib.rsmi_dev_fan_speed_max_get(device, 0, byref(level_max))) or not level_max.value:
+        return {"Fan speed (%)": 0}
+    return {"Fan speed (%)": round(100 * level.value / level_max.value)}
+
+
+def _read_clocks(lib: Any, device: int) -> Dict[str, Any]:
+    # the same fields rocm-smi --showclocks --json reports
+    values: Dict[str, Any] = {}
+    freq = RsmiFrequencies()
+    for clk_name, clk_type in _clk_types.items():
+        if not _ok(lib.rsmi_dev_gpu_clk_freq_get(device, clk_type, byref(freq))):
+            continue
+        if freq.current >= min(freq.num_supported, RSMI_MAX_NUM_FREQUENCIES):
+            continue
+        values[f"{clk_name} clock speed:"] = freq.frequency[freq.current] / 1000000
+        values[f"{clk_name} clock level:"] = freq.current
+
+    bandwidth = RsmiPcieBandwidth()
+    if _ok(lib.rsmi_dev_pci_bandwidth_get(device, byref(bandwidth))):
+        level = bandwidth.transfer_rate.current
+        if level < min(bandwidth.transfer_rate.num_supported, RSMI_MAX_NUM_FREQUENCIES):
+            # formatted as rocm-smi does, the link speed and width are parsed
+            # out of it
+            rate = bandwidth.transfer_rate.frequency[level] / 1000000000
+            values["pcie clock level"] = f"{level} ({rate:.1f}GT/s x{bandwidth.lanes[level]})"
+    return values
+
+
+def _read_perf_level(lib: Any, device: int) -> Dict[str, Any]:
+    level = c_int()
+    if _ok(lib.rsmi_dev_perf_level_get(device, byref(level))):
+        if level.value < RSMI_DEV_PERF_LEVEL_UNKNOWN:
+            return {"Performance Level": level.value}
+    return {}
+
+
+def _read_memory_activity(lib: Any, device: int) -> Dict[str, Any]:
+    counter = RsmiUtilizationCounter(RSMI_COARSE_GRAIN_MEM_ACTIVITY, 0)
+    timestamp = c_uint64()
+    if _ok(lib.rsmi_utilization_count_get(device, byref(counter), 1, byref(timestamp))):
+        return {"Memory Activity": counter.value}
+    return {}
+
+
+def _read_identity(lib: Any, device: int) -> Dict[str, Any]:
+    values = {}
+
+    serial = _read_string(lib.rsmi_dev_serial_number_get, device)
+    values["Serial Number"] = serial or "N/A"
+
+    dv_id = c_uint16()
+    if _ok(lib.rsmi_dev_id_get(device, byref(dv_id))):
+        values["GPU ID"] = hex(dv_id.value)
+
+    uid = c_uint64()
+    if _ok(lib.rsmi_dev_unique_id_get(device, byref(uid))):
+        values["Unique ID"] = hex(uid.value)
+    else:
+        values["Unique ID"] = "N/A"
+
+    bdfid = c_uint64()
+    if _ok(lib.rsmi_dev_pci_id_get(device, byref(bdfid))):
+        values["PCI Bus"] = "{:04X}:{:02X}:{:02X}.{:0X}".format(
+            (bdfid.value >> 32) & 0xFFFFFFFF,
+            (bdfid.value >> 8) & 0xFF,
+            (bdfid.value >> 3) & 0x1F,
+            bdfid.value & 0x7,
+        )
+
+    series = _read_string(lib.rsmi_dev_name_get, device)
+    if series is not None:
+        values["Card series"] = series
+    model = _read_string(lib.rsmi_dev_subsystem_name_get, device)
+    if model is not None:
+        values["Card model"] = model
+    vendor = _read_string(lib.rsmi_dev_vendor_name_get, device)
+    if vendor is not None:
+        values["Card vendor"] = vendor
+
+    vbios = _read_string(lib.rsmi_dev_vbios_version_get, device)
+    if vbios:
+        values["VBIOS version"] = vbios
+        # rocm-smi derives the SKU from the VBIOS version in the same way
+        if "-" in vbios:
+            values["Card SKU"] = vbios.split("-")[1][:6]
+
+    return values
+
+
+def _format_fw_version(fw_name: str, version: int) -> str:
+    # matches the formatting in rocm-smi's showFwInfo
+    if fw_name in ["VCN", "VCE", "UVD", "SOS", "ASD"]:
+        return "0x%08x" % version
+    if fw_name in ["TA XGMI", "TA RAS", "SMC"]:
+        return ".".join("%02d" % b for b in version.to_bytes(4, "big"))
+    return str(version)
+
+
+def _read_firmware(lib: Any, device: int) -> Dict[str, Any]:
+    values = {}
+    fw_ver = c_uint64()
+    for index, fw_name in enumerate(_fw_blocks):
+        if _ok(lib.rsmi_dev_firmware_version_get(device, index, byref(fw_ver))):
+            values[f"{fw_name} firmware version"] = _format_fw_version(fw_name, fw_ver.value)
+    return values
+
+
+# readers for the fields in server._metrics, read every cycle, along with the
+# fields each one provides
+_sensor_readers: List[Tuple[DeviceReader, FrozenSet[str]]] = [
+    (
+        _read_temps,
+        frozenset(f"Temperature (Sensor {sensor}) (C)" for sensor in _temp_sensors),
+    ),
+    (
+        _read_overdrive,
+        frozenset(["GPU OverDrive value (%)", "GPU Memory OverDrive value (%)"]),
+    ),
+    (
+        _read_power,
+        frozenset(["Max Graphics Package Power (W)", "Average Graphics Package Power (W)"]),
+    ),
+    (_read_gpu_use, frozenset(["GPU use (%)"])),
+    (
+        _read_mem_use,
+        frozenset(["GPU memory use", "GPU memory available", "GPU memory use (%)"]),
+    ),
+    (_read_replay_count, frozenset(["PCIe Replay Count"])),
+    (_read_voltage, frozenset(["Voltage (mV)"])),
+    (
+        _read_energy,
+        frozenset(
+            [
+                "Energy counter",
+                "Accumulated Energy (uJ)",
+                "Energy counter resolution (uJ)",
+                "Energy timestamp (ns)",
+            ]
+        ),
+    ),
+    (_read_fan, frozenset(["Fan speed (%)"])),
+    (
+        _read_clocks,
+        frozenset(
+            [
+                *(f"{clk_name} clock speed:" for clk_name in _clk_types),
+                *(f"{clk_name} clock level:" for clk_name in _clk_types),
+                "pcie clock level",
+            ]
+        ),
+    ),
+    (_read_perf_level, frozenset(["Performance Level"])),
+    (_read_memory_activity, frozenset(["Memory Activity"])),
+]
+
+# readers for the fields in server._labels and the firmware inventory, these
+# don't change while the process runs so are read once per device and cached
+_identity_readers: List[DeviceReader] = [
+    _read_identity,
+    _read_firmware,
+]
+
+
+class RsmiBackend:
+    """
+    Collects GPU metrics through librocm_smi64 without leaving the process.
+
+    The library is initialised once in the constructor, by init_rocmsmi(),
+    and kept initialised until `close()` is called.
+
+    Identity and firmware fields are read the first time a device is seen and
+    cached, after that only the sensors are read each cycle. The cache is
+    dropped when the number of devices changes or `reload()` is called.
+
+    If `pool` is given (by default when COLLECTION_THREADS > 0) devices are
+    read in parallel on it.
+    """
+
+    name = "rsmi"
+
+    def __init__(self, rocmsmi: Any = None, pool: Optional[DevicePool] = None):
+        self._lib = init_rocmsmi(rocmsmi)
+        if pool is None and COLLECTION_THREADS > 0:
+            pool = DevicePool()
+        self._pool = pool
+        self._static: Dict[int, Dict[str, Any]] = {}
+        self._driver_version: Optional[str] = None
+        self._num_devices = 0
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._lib.rsmi_shut_down()
+
+    def devices(self) -> List[int]:
+        count = c_uint32(0)
+        if not _ok(self._lib.rsmi_num_monitor_devices(byref(count))):
+            return []
+        return list(range(count.value))
+
+    def driver_version(self) -> Optional[str]:
+        buf = create_string_buffer(_BUFFER_SIZE)
+        if not _ok(self._lib.rsmi_version_str_get(RSMI_SW_COMP_DRIVER, buf, _BUFFER_SIZE)):
+            return None
+        return buf.value.decode()
+
+    def reload(self, device: Optional[int] = None):
+        """
+        Forget cached identity/firmware info for `device`, or all devices if
+        not given, so it is re-read on the next collection
+        """
+        if device is None:
+            self._static.clear()
+            self._driver_version = None
+        else:
+            self._static.pop(device, None)
+
+    def read_static(self, device: int) -> Dict[str, Any]:
+        if device not in self._static:
+            values: Dict[str, Any] = {}
+            for reader in _identity_readers:
+                values.update(reader(self._lib, device))
+            self._static[device] = values
+        return self._static[device]
+
+    def read_device(
+        self, device: int, covered: FrozenSet[str] = frozenset()
+    ) -> Dict[str, Any]:
+        with self_metrics.device_collection_duration.labels(self.name, f"card{device}").time():
+            values = dict(self.read_static(device))
+            for reader, fields in _sensor_readers:
+                if not fields <= covered:
+                    values.update(reader(self._lib, device))
+        return values
+
+    def read_fields(self, device: int, fields: FrozenSet[str]) -> Dict[str, Any]:
+        """
+        Read only the sensors providing any of `fields`, for sampling them
+        more often than a full collection
+        """
+        values: Dict[str, Any] = {}
+        for reader, reader_fields in _sensor_readers:
+            if reader_fields & fields:
+                values.update(reader(self._lib, device))
+        return values
+
+    def read_energy(self, device: int) -> Dict[str, Any]:
+        """
+        Read only the energy counter of `device`, for sampling it more often
+        than a full collection
+        """
+        return _read_energy(self._lib, device)
+
+    def collect(self, covered: FrozenSet[str] = frozenset()) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the same structure as `server.get_smi_output()`, skipping
+        readers whose fields are all in `covered`
+        """
+        devices = self.devices()
+
+        # treat a change in device count as a hotplug and re-read everything
+        if len(devices) != self._num_devices:
+            self.reload()
+            self._num_devices = len(devices)
+
+        if self._pool is None:
+            results = {device: self.read_device(device, covered) for device in devices}
+        else:
+            # a device that timed out still gets its cached identity fields
+            results = {
+                device: {**self._static.get(device, {}), **values}
+                for device, values in self._pool.map(
+                    lambda device: self.read_device(device, covered), devices
+                ).items()
+            }
+
+        output: Dict[str, Dict[str, Any]] = {
+            f"card{device}": values for device, values in results.items()
+        }
+
+        if self._driver_version is None:
+            self._driver_version = self.driver_version()
+        if self._driver_version is not None:
+            output["system"] = {"Driver version": self._driver_version}
+
+        return output
+
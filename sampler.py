@@ -0,0 +1,156 @@
+"""
+High frequency sampling of the fast moving sensors (GPU use, power,
+temperatures), summarised per scrape.
+
+Utilisation and power spike within a training step, which a 1s point sample
+aliases badly. HighFrequencySampler reads those sensors at SAMPLE_RATE Hz on
+a background thread into fixed size per-card ring buffers, and each time
+/metrics is rendered exports the min/max/mean/p95 and count of the samples
+taken since the previous render.
+"""
+import math
+import os
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Tuple
+
+from prometheus_client.core import GaugeMetricFamily
+
+from scheduler import PeriodicThread
+
+# samples per second, 0 disables the sampler
+SAMPLE_RATE = float(os.environ.get("SAMPLE_RATE", 0))
+
+# seconds of samples kept, scrapes further apart than this only summarise the
+# last SAMPLE_WINDOW seconds
+SAMPLE_WINDOW = float(os.environ.get("SAMPLE_WINDOW", 60))
+
+# raw field -> prometheus name, exported as rocm_sampled_<name>{gpu,stat}
+_sampled_fields = {
+    "GPU use (%)": "gpu_use_percent",
+    "Average Graphics Package Power (W)": "power_watts",
+    "Temperature (Sensor edge) (C)": "temperature_edge_celsius",
+    "Temperature (Sensor junction) (C)": "temperature_junction_celsius",
+    "Temperature (Sensor memory) (C)": "temperature_memory_celsius",
+}
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of floats. Appending overwrites the oldest value once
+    full and never allocates.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._values = array("d", bytes(8 * capacity))
+        # total number of values ever appended
+        self.written = 0
+
+    def append(self, value: float):
+        self._values[self.written % self._capacity] = value
+        self.written += 1
+
+    def since(self, start: int) -> List[float]:
+        """
+        The values appended since `written` was `start`, as far as they're
+        still in the buffer
+        """
+        start = max(start, self.written - self._capacity)
+        return [self._values[i % self._capacity] for i in range(start, self.written)]
+
+
+def summarise(values: List[float]) -> Dict[str, float]:
+    """
+    min/max/mean/p95 (nearest rank) and count of `values`
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+        "p95": ordered[math.ceil(0.95 * len(ordered)) - 1],
+        "count": len(ordered),
+    }
+
+
+class HighFrequencySampler:
+    """
+    Samples `_sampled_fields` of every device at `rate` Hz on a daemon thread,
+    and is a custom collector summarising the samples since its last
+    collection.
+
+    `backend` needs `devices()` and `read_fields(device, fields)`, i.e. an
+    rsmi_backend.RsmiBackend. With several scrapers (e.g. a HA pair) each
+    scrape summarises the samples since whichever scrape came before it.
+    """
+
+    def __init__(self, backend: Any, rate: float = SAMPLE_RATE, window: float = SAMPLE_WINDOW):
+        self._backend = backend
+        self._interval = 1 / rate
+        self._capacity = max(1, math.ceil(rate * window))
+        self._fields = frozenset(_sampled_fields)
+        self._lock = threading.Lock()
+        # (card, field) -> buffer, and how much of it the last collection saw
+        self._buffers: Dict[Tuple[str, str], RingBuffer] = {}
+        self._collected: Dict[Tuple[str, str], int] = {}
+        self._thread = None
+
+    def sample(self):
+        devices = self._backend.devices()
+        readings = [
+            (f"card{device}", self._backend.read_fields(device, self._fields)) for device in devices
+        ]
+
+        with self._lock:
+            for card_name, values in readings:
+                for field in _sampled_fields:
+                    value = values.get(field)
+                    if value is None:
+                        continue
+                    key = (card_name, field)
+                    buffer = self._buffers.get(key)
+                    if buffer is None:
+                        buffer = self._buffers[key] = RingBuffer(self._capacity)
+                    buffer.append(float(value))
+
+            # drop cards that have gone away
+            card_names = {card_name for card_name, _ in readings}
+            for key in [key for key in self._buffers if key[0] not in card_names]:
+                del self._buffers[key]
+                self._collected.pop(key, None)
+
+    def start(self):
+        self._thread = PeriodicThread(self.sample, self._interval, "sampler")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+
+    def describe(self):
+        # nothing to describe up front
+        return []
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        with self._lock:
+            windows = {}
+            for key, buffer in self._buffers.items():
+                windows[key] = buffer.since(self._collected.get(key, 0))
+                self._collected[key] = buffer.written
+
+        families = {
+            field: GaugeMetricFamily(
+                f"rocm_sampled_{name}",
+                f"{field} sampled at {1 / self._interval:g} Hz since the previous scrape",
+                labels=["gpu", "stat"],
+            )
+            for field, name in _sampled_fields.items()
+        }
+        for (card_name, field), values in windows.items():
+            for stat, value in summarise(values).items():
+                families[field].add_metric([card_name, stat], value)
+
+        yield from families.values()
@@ -0,0 +1,115 @@
+"""
+Per-group collection intervals on a drift-free monotonic timer.
+
+Each group of fields has its own interval. Groups falling due at the same
+time are collected together in one pass over the devices. Deadlines are
+multiples of each interval from the start time, rather than "interval after
+the last collection finished", so a slow cycle doesn't push the cadence out.
+PeriodicThread does the same for a single function on a background thread.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MetricGroup(NamedTuple):
+    interval: float
+    fields: FrozenSet[str]
+
+
+class Scheduler:
+    """
+    Tracks when each group in `groups` is next due
+    """
+
+    def __init__(self, groups: Dict[str, MetricGroup], start: Optional[float] = None):
+        self._groups = groups
+        start = time.monotonic() if start is None else start
+        # every group is due straight away
+        self._start = start
+        self._next_due = {name: start for name in groups}
+
+    def groups(self) -> List[str]:
+        return list(self._groups)
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """
+        Names of the groups due at `now`
+        """
+        now = time.monotonic() if now is None else now
+        return [name for name, next_due in self._next_due.items() if next_due <= now]
+
+    def covered(self, due: List[str]) -> FrozenSet[str]:
+        """
+        Fields of the groups that aren't due, i.e. what a backend can skip
+        """
+        due_fields = frozenset().union(*(self._groups[name].fields for name in due))
+        return (
+            frozenset().union(
+                *(group.fields for name, group in self._groups.items() if name not in due)
+            )
+            - due_fields
+        )
+
+    def advance(self, due: List[str], now: Optional[float] = None):
+        """
+        Move each group in `due` on to its next deadline after `now`, skipping
+        any deadlines that have already been missed
+        """
+        now = time.monotonic() if now is None else now
+        for name in due:
+            interval = self._groups[name].interval
+            elapsed = math.floor((now - self._start) / interval) + 1
+            self._next_due[name] = self._start + elapsed * interval
+
+    def next_deadline(self) -> float:
+        return min(self._next_due.values())
+
+    def sleep(self, wake: Optional[threading.Event] = None):
+        """
+        Sleep until the next group is due, or until `wake` is set
+        """
+        timeout = max(0.0, self.next_deadline() - time.monotonic())
+        if wake is None:
+            time.sleep(timeout)
+        else:
+            wake.wait(timeout)
+
+
+class PeriodicThread(threading.Thread):
+    """
+    Daemon thread calling `fn` every `interval` seconds until `stop()` is
+    called or `fn` returns False. Exceptions from `fn` are logged, and don't
+    stop the thread.
+    """
+
+    def __init__(self, fn: Callable[[], Any], interval: float, name: str):
+        super().__init__(name=name, daemon=True)
+        self._fn = fn
+        self._interval = interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        next_run = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                if self._fn() is False:
+                    return
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("%s failed", self.name)
+            # schedule from the previous deadline so runs don't drift, unless
+            # they have fallen behind
+            next_run = max(next_run + self._interval, time.monotonic())
+            self._stopping.wait(max(0.0, next_run - time.monotonic()))
+
+    def stop(self, wait: bool = True):
+        """
+        Stop after the current call, waiting for it to finish if `wait`
+        """
+        self._stopping.set()
+        if wait and self.is_alive():
+            self.join()
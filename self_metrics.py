@@ -0,0 +1,92 @@
+"""
+Metrics about the exporter itself, so exporter degradation can be alerted on
+before it shows up as gaps in GPU dashboards.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# collection is expected to take well under a second, but a hung rocm-smi or
+# GPU can take much longer
+_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+collection_duration = Histogram(
+    "rocm_exporter_collection_duration_seconds",
+    "Time taken to collect from all devices",
+    labelnames=["backend"],
+    buckets=_buckets,
+)
+
+device_collection_duration = Histogram(
+    "rocm_exporter_device_collection_duration_seconds",
+    "Time taken to collect from a single device",
+    labelnames=["backend", "gpu"],
+    buckets=_buckets,
+)
+
+collection_errors = Counter(
+    "rocm_exporter_collection_errors",
+    "Number of collections that raised an error",
+    labelnames=["backend"],
+)
+
+smi_duration = Histogram(
+    "rocm_exporter_smi_subprocess_duration_seconds",
+    "Wall time of rocm-smi subprocess calls",
+    buckets=_buckets,
+)
+
+smi_exit_codes = Counter(
+    "rocm_exporter_smi_exit_codes",
+    "Exit codes of rocm-smi subprocess calls",
+    labelnames=["code"],
+)
+
+smi_worker_restarts = Counter(
+    "rocm_exporter_smi_worker_restarts",
+    "Number of times the rocm-smi daemon worker was restarted after exiting or hanging",
+)
+
+json_parse_duration = Histogram(
+    "rocm_exporter_json_parse_duration_seconds",
+    "Time taken to parse rocm-smi JSON output",
+    buckets=_buckets,
+)
+
+gauge_update_duration = Histogram(
+    "rocm_exporter_gauge_update_duration_seconds",
+    "Time taken to update gauges from collected values",
+    buckets=_buckets,
+)
+
+gauge_updates = Counter(
+    "rocm_exporter_gauge_updates",
+    "Number of collected values that did or didn't change the value of their gauge",
+    labelnames=["result"],
+)
+
+cycle_overruns = Counter(
+    "rocm_exporter_cycle_overruns",
+    "Number of collection cycles that took longer than the collection interval",
+)
+
+cycle_lag = Gauge(
+    "rocm_exporter_cycle_lag_seconds",
+    "How far the last collection cycle ran past the collection interval",
+)
+
+last_success = Gauge(
+    "rocm_exporter_last_success_timestamp_seconds",
+    "Unix time of the last successful collection from a device",
+    labelnames=["gpu"],
+)
+
+process_collection_duration = Histogram(
+    "rocm_exporter_process_collection_duration_seconds",
+    "Time taken to collect per-process GPU usage",
+    buckets=_buckets,
+)
+
+parse_failures = Counter(
+    "rocm_exporter_parse_failures",
+    "Number of rocm-smi values that couldn't be parsed as a number",
+    labelnames=["field"],
+)
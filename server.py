@@ -1,16 +1,99 @@
 import subprocess
 import json
+import logging
 import re
 import os
+import queue
+import signal
+import threading
 import time
-from typing import Dict, Union
-from prometheus_client import start_http_server, Gauge
+from typing import Any, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Set, Tuple
+from prometheus_client import start_http_server, CollectorRegistry, Gauge, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+import self_metrics
+from config import env_flag
+from energy import ENERGY_SAMPLE_INTERVAL, EnergySampler, EnergyTracker
+from exposition import PayloadCache, start_async_http_server
+from parallel import (
+    COLLECTION_THREADS,
+    DEVICE_TIMEOUT,
+    ERROR_MARKER,
+    TIMEOUT_MARKER,
+    DevicePool,
+)
+from parsers import Parser, get_parser, parse_pcie_speed, parse_pcie_width
+from scheduler import MetricGroup, Scheduler
+from sampler import SAMPLE_RATE, HighFrequencySampler
+from smi_worker import SmiWorker
 
 
 # get development flag
-DEV = os.environ.get("DEV", False)
-PORT = os.environ.get("PORT", 9101)
+DEV = env_flag("DEV")
+PORT = int(os.environ.get("PORT", 9101))
 
+# where to collect from: "cli" forks rocm-smi each cycle, "rsmi" keeps
+# librocm_smi64 loaded in-process (see rsmi_backend.py)
+BACKEND = os.environ.get("BACKEND", "cli")
+
+# read the sensors that amdgpu exposes in sysfs directly, using BACKEND for
+# everything else (see sysfs_backend.py)
+SYSFS_FAST_PATH = env_flag("SYSFS_FAST_PATH")
+
+# keep one `rocm-smi --daemon` process running and query it, rather than
+# running rocm-smi for every collection (needs the patched rocm-smi, see
+# smi_worker.py). The worker answers one query at a time, so it replaces the
+# per card rocm-smi calls of COLLECTION_THREADS rather than being combined
+# with them
+SMI_WORKER = env_flag("SMI_WORKER")
+
+# seconds a rocm-smi call for all cards may take, per card calls get
+# DEVICE_TIMEOUT
+SMI_TIMEOUT = float(os.environ.get("SMI_TIMEOUT", 30))
+
+# export per-process VRAM/CU occupancy/SDMA metrics for the PROCESS_TOP_N
+# processes using the most VRAM (see process_collector.py)
+PROCESS_METRICS = env_flag("PROCESS_METRICS")
+
+# export the accumulated GFX/memory activity counters (see utilization.py)
+UTILIZATION_COUNTERS = env_flag("UTILIZATION_COUNTERS")
+
+# export the link type, hops, weight, bandwidth and P2P access between every
+# pair of GPUs, read once and again on hotplug (see topology.py)
+TOPOLOGY_METRICS = env_flag("TOPOLOGY_METRICS")
+
+# count GPU events (VM faults, thermal throttling, resets) and re-read the
+# affected device as soon as it's throttled or reset (see events.py)
+EVENT_LISTENER = env_flag("EVENT_LISTENER")
+
+# measure PCIe throughput on a background thread per device (see
+# pcie_sampler.py)
+PCIE_THROUGHPUT = env_flag("PCIE_THROUGHPUT")
+
+# "poll" updates gauges every second, "scrape" collects when /metrics is hit
+COLLECTION_MODE = os.environ.get("COLLECTION_MODE", "poll")
+
+# seconds between collections of temperatures, use, power and energy in
+# "poll" mode, a cycle taking longer than this counts as an overrun
+COLLECTION_INTERVAL = float(os.environ.get("COLLECTION_INTERVAL", 1))
+
+# seconds between collections of fan speed, voltage, clocks and performance
+# level in "poll" mode
+MEDIUM_COLLECTION_INTERVAL = float(os.environ.get("MEDIUM_COLLECTION_INTERVAL", 5))
+
+# seconds between collections of power cap, overdrive and PCIe replay count in
+# "poll" mode
+SLOW_COLLECTION_INTERVAL = float(os.environ.get("SLOW_COLLECTION_INTERVAL", 60))
+
+# serve /metrics from an asyncio server with a payload pre-rendered once per
+# collection (see exposition.py), rather than prometheus_client's http server
+ASYNC_EXPOSITION = env_flag("ASYNC_EXPOSITION")
+
+# in "scrape" mode, scrapes within this many seconds of the last collection
+# are served from it rather than collecting again
+MIN_COLLECTION_AGE = float(os.environ.get("MIN_COLLECTION_AGE", 1))
+
+# read every cycle
 _flags = [
     # HW related
     "--showfan",
@@ -19,11 +102,106 @@ _flags = [
     "--showuse",
     "--showmemuse",
     "--showvoltage",
-    # This hopefully covers everything
-    "--showallinfo",
+    "--showenergycounter",
+    "--showmaxpower",
+    "--showoverdrive",
+    "--showmemoverdrive",
+    "--showreplaycount",
+    "--showclocks",
+    "--showperflevel",
     # See ./other_rocm_smi_options.txt for more options
 ]
 
+# fields provided by each of `_flags`, a flag is skipped when another source
+# (e.g. sysfs) already covers all of them or they aren't due yet
+_flag_fields = {
+    "--showfan": {"Fan speed (%)", "Fan RPM"},
+    "--showpower": {"Average Graphics Package Power (W)"},
+    "--showtemp": {
+        "Temperature (Sensor edge) (C)",
+        "Temperature (Sensor junction) (C)",
+        "Temperature (Sensor memory) (C)",
+    },
+    "--showuse": {"GPU use (%)"},
+    "--showmemuse": {
+        "GPU memory use (%)",
+        "GPU memory use",
+        "GPU memory available",
+        "Memory Activity",
+    },
+    "--showvoltage": {"Voltage (mV)"},
+    "--showenergycounter": {
+        "Energy counter",
+        "Accumulated Energy (uJ)",
+        "Energy counter resolution (uJ)",
+        "Energy timestamp (ns)",
+    },
+    "--showmaxpower": {"Max Graphics Package Power (W)"},
+    "--showoverdrive": {"GPU OverDrive value (%)"},
+    "--showmemoverdrive": {"GPU Memory OverDrive value (%)"},
+    "--showreplaycount": {"PCIe Replay Count"},
+    "--showclocks": {
+        "dcefclk clock speed:",
+        "dcefclk clock level:",
+        "fclk clock speed:",
+        "fclk clock level:",
+        "mclk clock speed:",
+        "mclk clock level:",
+        "sclk clock speed:",
+        "sclk clock level:",
+        "socclk clock speed:",
+        "socclk clock level:",
+        "pcie clock level",
+    },
+    "--showperflevel": {"Performance Level"},
+}
+
+# (interval, `_flags`) of each group collected on its own interval in "poll"
+# mode
+_flag_groups = {
+    "fast": (
+        COLLECTION_INTERVAL,
+        [
+            "--showtemp",
+            "--showuse",
+            "--showmemuse",
+            "--showpower",
+            "--showenergycounter",
+        ],
+    ),
+    "medium": (
+        MEDIUM_COLLECTION_INTERVAL,
+        [
+            "--showfan",
+            "--showvoltage",
+            "--showclocks",
+            "--showperflevel",
+        ],
+    ),
+    "slow": (
+        SLOW_COLLECTION_INTERVAL,
+        [
+            "--showmaxpower",
+            "--showoverdrive",
+            "--showmemoverdrive",
+            "--showreplaycount",
+        ],
+    ),
+}
+
+# identity and firmware info, read once at startup (and on reload/hotplug)
+_static_flags = [
+    "--showid",
+    "--showuniqueid",
+    "--showserial",
+    "--showbus",
+    "--showproductname",
+    "--showvbios",
+    "--showfwinfo",
+    "--showmemvendor",
+    "--showdriverversion",
+]
+
 _metrics = [
     "Temperature (Sensor edge) (C)",  # "52.0",
     "Temperature (Sensor junction) (C)",  # "56.0",
@@ -40,11 +218,42 @@ _metrics = [
     "Energy counter",  # "3436801806",
     "Accumulated Energy (uJ)",  # "52583068287.32"
     "Fan speed (%)",
+    "Fan RPM",
     "GPU memory available",
+    "Memory Activity",  # "N/A",
+    "Performance Level",  # "auto",
+    "dcefclk clock speed:",  # "(417Mhz)",
+    "dcefclk clock level:",  # "0",
+    "fclk clock speed:",  # "(1251Mhz)",
+    "fclk clock level:",  # "1",
+    "mclk clock speed:",  # "(96Mhz)",
+    "mclk clock level:",  # "0",
+    "sclk clock speed:",  # "(2270Mhz)",
+    "sclk clock level:",  # "1",
+    "socclk clock speed:",  # "(800Mhz)",
+    "socclk clock level:",  # "1",
+    "pcie clock level",  # "1 (8.0GT/s x8)",
+    "Throttle status",  # 0, only from gpu_metrics (see gpu_metrics.py)
+    TIMEOUT_MARKER,  # only when COLLECTION_THREADS > 0
+    ERROR_MARKER,  # only when COLLECTION_THREADS > 0
 ]
 
+# extra metrics parsed out of another field's value, see parsers.py for how
+# each field is parsed
+_derived_metrics = {
+    "pcie clock level": {
+        "PCIe link speed (GT/s)": parse_pcie_speed,
+        "PCIe link width": parse_pcie_width,
+    },
+}
+
 _metrics_aliases = {
     "GPU memory use": "GPU_memory_use_bytes",
+    "dcefclk clock speed:": "dcefclk_clock_speed_mhz",
+    "fclk clock speed:": "fclk_clock_speed_mhz",
+    "mclk clock speed:": "mclk_clock_speed_mhz",
+    "sclk clock speed:": "sclk_clock_speed_mhz",
+    "socclk clock speed:": "socclk_clock_speed_mhz",
 }
 
 _labels = [
@@ -56,20 +265,7 @@ _labels = [
     "Card model",  # "0x2407",
     "Card vendor",  # "Advanced Micro Devices, Inc. [AMD/ATI]",
     "Card SKU",  # "D4140E",
-    # "Memory Activity", # "N/A",
     # "GPU memory vendor", # "samsung",
-    # "pcie clock level", # "1 (8.0GT/s x8)",
-    # "Performance Level", # "auto",
-    # "dcefclk clock speed:", # "(417Mhz)",
-    # "dcefclk clock level:", # "0",
-    # "fclk clock speed:", # "(1251Mhz)",
-    # "fclk clock level:", # "1",
-    # "mclk clock speed:", # "(96Mhz)",
-    # "mclk clock level:", # "0",
-    # "sclk clock speed:", # "(2270Mhz)",
-    # "sclk clock level:", # "1",
-    # "socclk clock speed:", # "(800Mhz)",
-    # "socclk clock level:", # "1",
     # "VBIOS version", # "113-D4140EXL-XL",
     # "ASD firmware version", # "0x21000095",
     # "CE firmware version", # "37",
@@ -95,8 +291,22 @@ _labels = [
 ]
 
 
-def get_smi_output() -> Dict[str, Dict[str, str]]:
+_smi_worker = SmiWorker() if SMI_WORKER and not DEV else None
+
+
+def _metric_groups() -> Dict[str, MetricGroup]:
+    return {
+        name: MetricGroup(interval, frozenset().union(*(_flag_fields[flag] for flag in flags)))
+        for name, (interval, flags) in _flag_groups.items()
+    }
+
+
+def get_smi_output(
+    flags: Optional[List[str]] = None, device: Optional[int] = None
+) -> Dict[str, Dict[str, str]]:
     """
+    Run rocm-smi with `flags` (defaults to `_flags`), for only `device` if given
+
     Example output:
     {
         "card0": {
@@ -116,21 +326,138 @@ def get_smi_output() -> Dict[str, Dict[str, str]]:
     }
     """
     if not DEV:
-        output_str = subprocess.check_output(
-            [
-                "rocm-smi",
-                "--alldevices",
-                "--json",
-                *_flags,
-            ]
-        )
-        return json.loads(output_str)
+        start = time.perf_counter()
+        try:
+            if _smi_worker is not None:
+                output = _smi_worker.query(
+                    ["--alldevices", *(_flags if flags is None else flags)],
+                    devices=[device] if device is not None else None,
+                    timeout=DEVICE_TIMEOUT if device is not None else SMI_TIMEOUT,
+                )
+                self_metrics.smi_exit_codes.labels("0").inc()
+                return output
+            output_str = subprocess.check_output(
+                [
+                    "rocm-smi",
+                    "--alldevices",
+                    "--json",
+                    *(_flags if flags is None else flags),
+                    *(["--device", str(device)] if device is not None else []),
+                ],
+                timeout=DEVICE_TIMEOUT if device is not None else SMI_TIMEOUT,
+            )
+        except subprocess.CalledProcessError as e:
+            self_metrics.smi_exit_codes.labels(str(e.returncode)).inc()
+            raise
+        except subprocess.TimeoutExpired:
+            self_metrics.smi_exit_codes.labels("timeout").inc()
+            raise
+        finally:
+            self_metrics.smi_duration.observe(time.perf_counter() - start)
+        self_metrics.smi_exit_codes.labels("0").inc()
+
+        with self_metrics.json_parse_duration.time():
+            return json.loads(output_str)
 
     # for dev read in example.json
     with open("example.json", "r") as f:
         return json.load(f)
 
 
+class SmiCliBackend:
+    """
+    Collects from the rocm-smi cli, only asking for the `_static_flags` fields
+    at startup and when the set of cards changes or `reload()` is called.
+
+    With a `pool` (by default when COLLECTION_THREADS > 0) rocm-smi is run
+    once per card in parallel, rather than once for all cards. The SMI_WORKER
+    answers one query at a time, so with it there is no default pool and all
+    cards are read with one query.
+    """
+
+    name = "cli"
+
+    def __init__(self, pool: Optional[DevicePool] = None):
+        self._static: Optional[Dict[str, Dict[str, str]]] = None
+        if pool is None and COLLECTION_THREADS > 0:
+            if _smi_worker is not None:
+                logging.warning("COLLECTION_THREADS is ignored with SMI_WORKER")
+            else:
+                pool = DevicePool()
+        self._pool = pool
+
+    def reload(self, device: Optional[int] = None):
+        # rocm-smi reads the static info of every card at once, so `device`
+        # makes no difference
+        self._static = None
+
+    def _collect_per_device(self, flags: List[str]) -> Dict[str, Dict[str, Any]]:
+        if self._static is None:
+            self._static = get_smi_output(_static_flags)
+
+        def read_card(card_name: str) -> Dict[str, Any]:
+            try:
+                with self_metrics.device_collection_duration.labels(self.name, card_name).time():
+                    output = get_smi_output(flags, device=int(card_name[len("card") :]))
+            except subprocess.TimeoutExpired:
+                return {TIMEOUT_MARKER: 1}
+            return output[card_name]
+
+        cards = [card_name for card_name in self._static if card_name != "system"]
+        output = self._pool.map(read_card, cards)
+
+        # a card that failed may have gone away, check on the next cycle
+        if any(values.get(ERROR_MARKER) for values in output.values()):
+            self.reload()
+
+        return output
+
+    def collect(self, covered: FrozenSet[str] = frozenset()) -> Dict[str, Dict[str, Any]]:
+        """
+        Collect from rocm-smi, skipping flags whose fields are all in `covered`
+        """
+        flags = [flag for flag in _flags if not _flag_fields[flag] <= covered]
+
+        if not flags:
+            # rocm-smi would print nothing, only the static info is needed
+            if self._static is None:
+                self._static = get_smi_output(_static_flags)
+            output = {card_name: {} for card_name in self._static}
+        elif self._pool is not None:
+            output = self._collect_per_device(flags)
+        else:
+            output = get_smi_output(flags)
+
+        # a different set of cards means a hotplug, re-read the static info
+        if self._static is None or self._static.keys() - {"system"} != output.keys() - {"system"}:
+            self._static = get_smi_output(_static_flags)
+
+        for card_name, static_values in (self._static or {}).items():
+            output[card_name] = {**static_values, **output.get(card_name, {})}
+
+        return output
+
+
+def get_backend():
+    """
+    Returns the configured backend, anything with `collect()` returning output
+    in the same shape as `get_smi_output()` and `reload()`
+    """
+    if BACKEND == "rsmi" and not DEV:
+        from rsmi_backend import RsmiBackend
+
+        backend = RsmiBackend()
+    else:
+        backend = SmiCliBackend()
+
+    if SYSFS_FAST_PATH:
+        from sysfs_backend import SysfsBackend
+
+        backend = SysfsBackend(backend)
+
+    return backend
+
+
 def _get_prom_friendly_metric_name(metric_name: str) -> str:
     """
     Convert metric names to prometheus friendly names
@@ -151,77 +478,463 @@ def _get_prom_friendly_metric_name(metric_name: str) -> str:
     return metric_name
 
 
-def _try_cast_float(value: str) -> Union[float, str]:
+def _get_label_dict() -> Dict[str, str]:
+    return {label: _get_prom_friendly_metric_name(label) for label in _labels}
+
+
+# raw label key -> prometheus label name, fixed for the lifetime of the process
+_label_names = _get_label_dict()
+
+
+class MetricSpec(NamedTuple):
     """
-    Try to cast value to float, if not return original value
+    Everything needed to export one value parsed from a raw rocm-smi field
     """
-    try:
-        return float(value)
-    except ValueError:
-        return value
 
+    name: str
+    documentation: str
+    gauge: Gauge
+    parser: Parser
 
-def _get_label_dict() -> Dict[str, str]:
-    return {label: _get_prom_friendly_metric_name(label) for label in _labels}
 
-
-def _define_gauges(output: dict) -> Union[Dict[str, Gauge], Dict[str, str]]:
+def _compile_metric_table(
+    registry: Optional[CollectorRegistry] = REGISTRY,
+) -> Dict[str, Tuple[MetricSpec, ...]]:
+    """
+    Map each raw rocm-smi key in `_metrics` to the prometheus name, gauge and
+    value parser of each metric it feeds, so updating a value is a single dict
+    lookup with no regex work. Pass `registry=None` to get gauges that aren't
+    registered anywhere.
+    """
     # TODO(j.swannack): need to make guages+labels adhere
     #   to prometheus naming conventions
 
     # card will be a label, so get unqiue metrics across all cards
-    labels = _get_label_dict()
+    labelnames = ["gpu", *_label_names.values()]
+
+    def spec(metric_name: str, parser: Parser) -> MetricSpec:
+        prom_name = _get_prom_friendly_metric_name(metric_name)
+        gauge = Gauge(prom_name, metric_name, labelnames=labelnames, registry=registry)
+        return MetricSpec(prom_name, metric_name, gauge, parser)
 
-    # define gauges from metric_info
     return {
-        metric_name: Gauge(
-            _get_prom_friendly_metric_name(metric_name),
-            metric_name,
-            labelnames=["gpu", *labels.values()],
+        metric_name: (
+            spec(metric_name, get_parser(metric_name)),
+            *(
+                spec(derived_name, parser)
+                for derived_name, parser in _derived_metrics.get(metric_name, {}).items()
+            ),
         )
         for metric_name in _metrics
     }
 
 
-def main():
-    # get output dict
-    output = get_smi_output()
-
-    # start prometheus server
-    start_http_server(PORT)
+def _parse(spec: MetricSpec, metric_name: str, metric_value: Any) -> Optional[float]:
+    # rocm-smi reports unsupported values as "N/A", sometimes with a reason
+    # (e.g. "N/A (Secondary die)"), and the worker reports them as None.
+    # Neither is a parse failure.
+    if metric_value is None or (isinstance(metric_value, str) and metric_value.startswith("N/A")):
+        return None
+    try:
+        return spec.parser(metric_value)
+    except (TypeError, ValueError):
+        self_metrics.parse_failures.labels(metric_name).inc()
+        return None
 
-    # define gauges
-    gauges = _define_gauges(output)
 
-    labels = _get_label_dict()
+class GaugeUpdater:
+    """
+    Updates the gauges in a metric table from collected output, touching only
+    the gauges whose value changed since the previous update.
+
+    Every (card, metric) pair has a slot in flat lists holding its labelled
+    child and the raw value it was last set from. A card's slots start at a
+    base offset assigned when the card is first seen, and each metric's
+    offset from it is precomputed, so finding a slot is two dict lookups and
+    an add. A raw value equal to the previous one is skipped without being
+    parsed.
+
+    Children are resolved once per card and reused until the card's identity
+    labels change. Children for cards that are no longer in the output, or
+    whose labels changed, are removed from the gauge. Values that fail to
+    parse are counted in rocm_exporter_parse_failures_total and skipped.
+    """
 
-    while True:
-        # get new output
-        output = get_smi_output()
+    def __init__(self, table: Dict[str, Tuple[MetricSpec, ...]]):
+        # raw metric name -> ((slot offset, spec), ...)
+        self._table: Dict[str, Tuple[Tuple[int, MetricSpec], ...]] = {}
+        offset = 0
+        for metric_name, specs in table.items():
+            self._table[metric_name] = tuple(zip(range(offset, offset + len(specs)), specs))
+            offset += len(specs)
+        self._num_specs = offset
+        # card name -> (label values, base slot)
+        self._cards: Dict[str, Tuple[Tuple[str, ...], int]] = {}
+        self._free_bases: List[int] = []
+        self._children: List[Optional[Gauge]] = []
+        self._values: List[Any] = []
+
+    def _add_card(self, card_name: str, label_values: Tuple[str, ...]) -> int:
+        if self._free_bases:
+            base = self._free_bases.pop()
+        else:
+            base = len(self._children)
+            self._children.extend([None] * self._num_specs)
+            self._values.extend([None] * self._num_specs)
+        self._cards[card_name] = (label_values, base)
+        return base
+
+    def _remove_card(self, card_name: str):
+        label_values, base = self._cards.pop(card_name)
+        for specs in self._table.values():
+            for offset, spec in specs:
+                if self._children[base + offset] is not None:
+                    spec.gauge.remove(card_name, *label_values)
+                self._children[base + offset] = None
+                self._values[base + offset] = None
+        self._free_bases.append(base)
+
+    def update(self, output: Dict[str, Dict[str, Any]]):
+        changed = 0
+        unchanged = 0
+        children = self._children
+        values = self._values
 
-        # update gauges
         for card_name, card_metrics in output.items():
             # ignore system
             if card_name == "system":
                 continue
 
             # get label values
-            label_values = {label: card_metrics[label_raw] for label_raw, label in labels.items()}
+            label_values = tuple(_get_label_values(card_metrics, _label_names).values())
+
+            cached = self._cards.get(card_name)
+            if cached is None or cached[0] != label_values:
+                if cached is not None:
+                    self._remove_card(card_name)
+                base = self._add_card(card_name, label_values)
+            else:
+                base = cached[1]
 
             for metric_name, metric_value in card_metrics.items():
-                if metric_name not in _metrics:
-                    continue
+                for offset, spec in self._table.get(metric_name, ()):
+                    slot = base + offset
+                    if children[slot] is not None and values[slot] == metric_value:
+                        unchanged += 1
+                        continue
 
-                prom_metric_name = _get_prom_friendly_metric_name(metric_name)
-                gauges[metric_name].labels(gpu=card_name, **label_values).set(metric_value)
+                    value = _parse(spec, metric_name, metric_value)
+                    if value is None:
+                        continue
 
-        # sleep for 1 second
-        time.sleep(1)
+                    child = children[slot]
+                    if child is None:
+                        child = children[slot] = spec.gauge.labels(card_name, *label_values)
+                    child.set(value)
+                    values[slot] = metric_value
+                    changed += 1
 
+        # cards that have disappeared
+        for card_name in self._cards.keys() - output.keys():
+            self._remove_card(card_name)
 
-if __name__ == "__main__":
-    import logging
+        self_metrics.gauge_updates.labels("changed").inc(changed)
+        self_metrics.gauge_updates.labels("unchanged").inc(unchanged)
+
+
+class PendingReloads:
+    """
+    Reloads asked for from other threads (or a signal handler), applied by
+    whichever thread collects just before it next collects, so a backend is
+    never reloaded in the middle of a collection
+    """
+
+    def __init__(self):
+        # SimpleQueue.put is reentrant, so a SIGHUP landing on the main
+        # thread while it is in apply() can't deadlock, as a lock could
+        self._devices: "queue.SimpleQueue[Optional[int]]" = queue.SimpleQueue()
+
+    def request(self, device: Optional[int] = None):
+        """
+        Reload `device`, or every device if not given
+        """
+        self._devices.put(device)
+
+    def apply(self, backend):
+        devices: Set[Optional[int]] = set()
+        while True:
+            try:
+                devices.add(self._devices.get_nowait())
+            except queue.Empty:
+                break
+        if None in devices:
+            backend.reload()
+            return
+        for device in devices:
+            backend.reload(device)
+
+
+def collect_instrumented(
+    backend,
+    energy_tracker: Optional[EnergyTracker] = None,
+    covered: FrozenSet[str] = frozenset(),
+) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Collect from `backend`, skipping the fields in `covered`, recording how
+    long it took and which cards answered, and passing the energy counters to
+    `energy_tracker` if given. Returns None if the collection failed.
+    """
+    try:
+        with self_metrics.collection_duration.labels(backend.name).time():
+            output = backend.collect(covered)
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("Collection failed")
+        self_metrics.collection_errors.labels(backend.name).inc()
+        return None
+
+    for card_name, card_metrics in output.items():
+        # a card whose read failed still has its cached identity fields, so
+        # go by the markers rather than by whether it has values
+        if card_name != "system" and not (
+            card_metrics.get(TIMEOUT_MARKER) or card_metrics.get(ERROR_MARKER)
+        ):
+            self_metrics.last_success.labels(card_name).set_to_current_time()
+
+    if energy_tracker is not None:
+        energy_tracker.update(output)
+
+    return output
+
+
+def _get_label_values(card_metrics: Dict[str, Any], labels: Dict[str, str]) -> Dict[str, str]:
+    # the rocm-smi worker reports N/A as None
+    return {
+        label: "N/A" if card_metrics.get(label_raw) is None else str(card_metrics[label_raw])
+        for label_raw, label in labels.items()
+    }
+
+
+class RocmCollector:
+    """
+    Custom collector that collects from the backend when /metrics is scraped
+    rather than on a timer.
+
+    A collection younger than `min_age` seconds is reused, so concurrent or
+    back to back scrapes (e.g. from a HA pair of Prometheus servers) share one
+    collection.
+    """
+
+    def __init__(
+        self,
+        backend,
+        min_age: float = MIN_COLLECTION_AGE,
+        energy_tracker: Optional[EnergyTracker] = None,
+        pending_reloads: Optional[PendingReloads] = None,
+    ):
+        self._backend = backend
+        self._min_age = min_age
+        self._energy_tracker = energy_tracker
+        self._pending_reloads = pending_reloads
+        self._lock = threading.Lock()
+        self._output: Optional[Dict[str, Dict[str, Any]]] = None
+        self._collected_at = 0.0
+        self._table = _compile_metric_table(registry=None)
+
+    def get_output(self) -> Dict[str, Dict[str, Any]]:
+        # scrapes arriving while a collection is running wait for it and use
+        # its result
+        with self._lock:
+            if self._output is None or time.monotonic() - self._collected_at >= self._min_age:
+                if self._pending_reloads is not None:
+                    self._pending_reloads.apply(self._backend)
+                # on failure keep serving the last good output
+                self._output = (
+                    collect_instrumented(self._backend, self._energy_tracker)
+                    or self._output
+                    or {}
+                )
+                self._collected_at = time.monotonic()
+            return self._output
+
+    def describe(self) -> List[GaugeMetricFamily]:
+        # avoid a collection when registering
+        return []
+
+    def _build_families(self, output: Dict[str, Dict[str, Any]]) -> List[GaugeMetricFamily]:
+        families = {
+            spec.name: GaugeMetricFamily(
+                spec.name, spec.documentation, labels=["gpu", *_label_names.values()]
+            )
+            for specs in self._table.values()
+            for spec in specs
+        }
+
+        for card_name, card_metrics in output.items():
+            if card_name == "system":
+                continue
+
+            label_values = _get_label_values(card_metrics, _label_names)
+
+            for metric_name, metric_value in card_metrics.items():
+                for spec in self._table.get(metric_name, ()):
+                    value = _parse(spec, metric_name, metric_value)
+                    if value is not None:
+                        families[spec.name].add_metric([card_name, *label_values.values()], value)
+
+        return list(families.values())
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        output = self.get_output()
+
+        with self_metrics.gauge_update_duration.time():
+            families = self._build_families(output)
+
+        yield from families
+
+
+def run_scrape_driven(
+    backend,
+    energy_tracker: Optional[EnergyTracker] = None,
+    pending_reloads: Optional[PendingReloads] = None,
+    per_scrape: Optional[CollectorRegistry] = None,
+):
+    REGISTRY.register(
+        RocmCollector(backend, energy_tracker=energy_tracker, pending_reloads=pending_reloads)
+    )
+
+    if ASYNC_EXPOSITION:
+        # collection happens while rendering, so render on demand
+        start_async_http_server(
+            PORT, PayloadCache(max_age=MIN_COLLECTION_AGE, per_scrape=per_scrape)
+        )
+    else:
+        start_http_server(PORT)
+
+    # the http server runs in a daemon thread, so just wait forever
+    threading.Event().wait()
+
+
+def main():
+    backend = get_backend()
 
+    # backend reloads are applied before the next collection, rather than
+    # from the signal handler or event listener thread mid-collection
+    pending_reloads = PendingReloads()
+
+    # re-read identity and firmware info (and the topology) on SIGHUP
+    reloadables = [pending_reloads.request]
+    signal.signal(signal.SIGHUP, lambda *_: [reload() for reload in reloadables])
+
+    # collectors rendered on every scrape with ASYNC_EXPOSITION
+    per_scrape: Optional[CollectorRegistry] = None
+
+    if SAMPLE_RATE > 0 and not DEV:
+        from rsmi_backend import RsmiBackend
+
+        sampler = HighFrequencySampler(RsmiBackend())
+        sampler.start()
+        # summarises the samples since it was last rendered, so it has to be
+        # rendered by scrapes rather than into the pre-rendered payload
+        if ASYNC_EXPOSITION:
+            per_scrape = CollectorRegistry()
+            per_scrape.register(sampler)
+        else:
+            REGISTRY.register(sampler)
+
+    if PROCESS_METRICS and not DEV:
+        from process_collector import ProcessCollector
+
+        REGISTRY.register(ProcessCollector())
+
+    if UTILIZATION_COUNTERS and not DEV:
+        from utilization import UtilizationCollector
+
+        REGISTRY.register(UtilizationCollector())
+
+    if PCIE_THROUGHPUT and not DEV:
+        from pcie_sampler import PcieThroughputSampler
+
+        pcie_sampler = PcieThroughputSampler()
+        pcie_sampler.start()
+        REGISTRY.register(pcie_sampler)
+
+    # set to collect everything straight away rather than at the next deadline
+    refresh = threading.Event()
+
+    if TOPOLOGY_METRICS and not DEV:
+        from topology import TopologyCollector
+
+        topology = TopologyCollector()
+        reloadables.append(topology.reload)
+        REGISTRY.register(topology)
+
+    if EVENT_LISTENER and not DEV:
+        from events import REFRESH_EVENTS, RELOAD_EVENTS, EventListener
+
+        def on_event(device: int, event_type: str):
+            if event_type in RELOAD_EVENTS:
+                pending_reloads.request(device)
+            if event_type in REFRESH_EVENTS:
+                refresh.set()
+
+        EventListener(on_event).start()
+
+    # power is derived from the energy counters of each collection, unless
+    # they're sampled more often on their own
+    energy_tracker: Optional[EnergyTracker] = EnergyTracker()
+    if ENERGY_SAMPLE_INTERVAL > 0 and not DEV:
+        from rsmi_backend import RsmiBackend
+
+        EnergySampler(RsmiBackend(), energy_tracker).start()
+        energy_tracker = None
+
+    if COLLECTION_MODE == "scrape":
+        run_scrape_driven(backend, energy_tracker, pending_reloads, per_scrape)
+        return
+
+    # start prometheus server
+    payload_cache = PayloadCache(per_scrape=per_scrape)
+    if ASYNC_EXPOSITION:
+        start_async_http_server(PORT, payload_cache)
+    else:
+        start_http_server(PORT)
+
+    # define gauges
+    updater = GaugeUpdater(_compile_metric_table())
+
+    scheduler = Scheduler(_metric_groups())
+
+    while True:
+        start = time.monotonic()
+        due = scheduler.due(start)
+        if refresh.is_set():
+            refresh.clear()
+            due = scheduler.groups()
+        pending_reloads.apply(backend)
+
+        # get new output, skipping groups that aren't due
+        output = collect_instrumented(backend, energy_tracker, scheduler.covered(due))
+
+        # update gauges
+        if output is not None:
+            with self_metrics.gauge_update_duration.time():
+                updater.update(output)
+
+        if ASYNC_EXPOSITION:
+            payload_cache.render()
+
+        lag = time.monotonic() - start - COLLECTION_INTERVAL
+        self_metrics.cycle_lag.set(max(lag, 0))
+        if lag > 0:
+            self_metrics.cycle_overruns.inc()
+
+        # sleep until the next group is due, deadlines are fixed multiples of
+        # each interval so a slow cycle doesn't delay the ones after it
+        scheduler.advance(due)
+        scheduler.sleep(refresh)
+
+
+if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
     if DEV:
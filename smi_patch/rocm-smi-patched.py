@@ -15,11 +15,10 @@ import json
 import logging
 import os
 import sys
-import subprocess
+import threading
 import _thread
 import time
 from time import ctime
-from subprocess import check_output
 
 # Hack because I accidentally broke something (jerome)
 sys.path.append("/opt/rocm/libexec/rocm_smi/")
@@ -40,6 +39,11 @@ RETCODE = 0
 # If we want JSON format output instead
 PRINT_JSON = False
 JSON_DATA = {}
+# PID -> (start time, process name), see getProcessName
+PROCESS_NAMES = {}
+# Output of the collect() running on this thread, if any. It is used instead of
+# PRINT_JSON and JSON_DATA so that collect() can run on several threads at once
+_collection = threading.local()
 # Version of the JSON output used to save clocks
 CLOCK_JSON_VERSION = 1
 
@@ -64,17 +68,27 @@ validClockNames.append('pcie')
 validClockNames.sort()
 
 
+def jsonOutput():
+    """ Returns true if output goes to JSON, either because of --json or from within collect() """
+    return PRINT_JSON or getattr(_collection, 'data', None) is not None
+
+
+def jsonOutputData():
+    """ Returns the dictionary that JSON output is written to on this thread """
+    data = getattr(_collection, 'data', None)
+    if data is None:
+        return JSON_DATA
+    return data
+
+
 def driverInitialized():
     """ Returns true if amdgpu is found in the list of initialized modules
     """
-    driverInitialized = ''
     try:
-        driverInitialized = str(subprocess.check_output("cat /sys/module/amdgpu/initstate |grep live", shell=True))
-    except subprocess.CalledProcessError:
-        pass
-    if len(driverInitialized) > 0:
-        return True
-    return False
+        with open('/sys/module/amdgpu/initstate', 'r') as initState:
+            return 'live' in initState.read()
+    except (IOError, OSError):
+        return False
 
 
 def formatJson(device, log):
@@ -83,16 +97,41 @@ def formatJson(device, log):
     @param device: DRM device identifier
     @param log: String to parse and output into JSON format
     """
-    global JSON_DATA
+    data = jsonOutputData()
     for line in log.splitlines():
         # Drop any invalid or improperly-formatted data
         if ':' not in line:
             continue
         logTuple = line.split(': ')
         if str(device) != 'system':
-            JSON_DATA['card' + str(device)][logTuple[0]] = logTuple[1].strip()
+            data['card' + str(device)][logTuple[0]] = logTuple[1].strip()
         else:
-            JSON_DATA['system'][logTuple[0]] = logTuple[1].strip()
+            data['system'][logTuple[0]] = logTuple[1].strip()
+
+
+def storeJson(device, metricName, value):
+    """ Store a single value in the JSON output, without formatting and re-parsing it
+
+    Values collected through collect() keep their type (int/float/str, or None for
+    N/A and its variants such as 'N/A (Secondary die)'). For --json/--csv they are
+    stored as strings, as formatJson does. Strings are stripped either way.
+
+    @param device: DRM device identifier, or 'system'
+    @param metricName: Name of the value
+    @param value: The value to store
+    """
+    if str(device) == 'system':
+        key = 'system'
+    else:
+        key = 'card' + str(device)
+    if getattr(_collection, 'data', None) is not None:
+        if isinstance(value, str):
+            value = value.strip()
+            if value.startswith('N/A'):
+                value = None
+    else:
+        value = str(value).strip()
+    jsonOutputData()[key][str(metricName)] = value
 
 
 def formatCsv(deviceList):
@@ -295,21 +334,44 @@ def getProcessName(pid):
     if int(pid) < 1:
         logging.debug('PID must be greater than 0')
         return 'UNKNOWN'
+    # PIDs get reused, so a cached name is only valid for the same process start time
+    startTime = getProcessStartTime(pid)
+    if startTime is None:
+        return 'UNKNOWN'
+    cached = PROCESS_NAMES.get(int(pid))
+    if cached is not None and cached[0] == startTime:
+        return cached[1]
     try:
-        pName = str(subprocess.check_output("ps -p %d -o comm=" % (int(pid)), shell=True))
-    except subprocess.CalledProcessError as e:
-        pName = 'UNKNOWN'
+        with open('/proc/%d/comm' % (int(pid)), 'r') as comm:
+            pName = comm.read().rstrip('\n')
+    except (IOError, OSError):
+        return 'UNKNOWN'
+    PROCESS_NAMES[int(pid)] = (startTime, pName)
+    return pName
 
-    if pName == None:
-        pName = 'UNKNOWN'
 
-    # Remove the substrings surrounding from process name (b' and \n')
-    if str(pName).startswith('b\''):
-        pName = pName[2:]
-    if str(pName).endswith('\\n\''):
-        pName = pName[:-3]
+def pruneProcessNames(pidList):
+    """ Forget the cached names of every PID not in pidList
 
-    return pName
+    @param pidList: List of the PIDs currently running, as returned by getPidList
+    """
+    keep = set(int(pid) for pid in pidList)
+    for pid in list(PROCESS_NAMES):
+        if pid not in keep:
+            PROCESS_NAMES.pop(pid, None)
+
+
+def getProcessStartTime(pid):
+    """ Get the start time of a specific pid, in clock ticks since boot, or None if it isn't running
+
+    @param pid: Process ID of a program to be parsed
+    """
+    try:
+        with open('/proc/%d/stat' % (int(pid)), 'r') as stat:
+            # The name in brackets can contain spaces, starttime is the 22nd field
+            return int(stat.read().rsplit(')', 1)[1].split()[19])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
 
 
 def getPerfLevel(device):
@@ -324,14 +386,6 @@ def getPerfLevel(device):
     return -1
 
 
-def getPid(name):
-    """ Get the process id of a specific application
-
-    @param name: Process name of a program to be parsed
-    """
-    return check_output(['pidof', name])
-
-
 def getPidList():
     """ Return a list of KFD process IDs """
     num_items = c_uint32()
@@ -343,6 +397,7 @@ def getPidList():
         ret = rocmsmi.rsmi_compute_process_info_get(byref(procs), byref(num_items))
         for i in range(num_items.value):
             procList.append('%s' % (procs[i].process_id))
+        pruneProcessNames(procList)
         return procList
     return
 
@@ -413,7 +468,6 @@ def getVersion(deviceList, component):
 
 def print2DArray(dataArray):
     """ Print 2D Array with uniform spacing """
-    global PRINT_JSON
     dataArrayLength = []
     isPid = False
     if str(dataArray[0][0]) == 'PID':
@@ -428,7 +482,7 @@ def print2DArray(dataArray):
         printString = ''
         for cell in range(len(dataArray[0])):
             printString += str(dataArray[position][cell]).ljust(dataArrayLength[cell], ' ') + '\t'
-        if PRINT_JSON:
+        if jsonOutput():
             printString = ' '.join(printString.split()).lower()
             firstElement = printString.split(' ', 1)[0]
             printString = printString.split(' ', 1)[1]
@@ -444,8 +498,7 @@ def print2DArray(dataArray):
 
 def printEmptyLine():
     """ Print out a single empty line """
-    global PRINT_JSON
-    if not PRINT_JSON:
+    if not jsonOutput():
         print()
 
 
@@ -455,11 +508,10 @@ def printErrLog(device, err):
     @param device: DRM device identifier
     @param err: Error string to print
     """
-    global PRINT_JSON
     devName = device
     for line in err.split('\n'):
         errstr = 'GPU[%s]\t: %s' % (devName, line)
-        if not PRINT_JSON:
+        if not jsonOutput():
             logging.error(errstr)
         else:
             logging.debug(errstr)
@@ -472,9 +524,8 @@ def printInfoLog(device, metricName, value):
     @param metricName: Title of the item to print to the log
     @param value: The item's value to print to the log
     """
-    global PRINT_JSON
 
-    if not PRINT_JSON:
+    if not jsonOutput():
         if value is not None:
             logstr = 'GPU[%s]\t: %s: %s' % (device, metricName, value)
         else:
@@ -519,10 +570,9 @@ def printLog(device, metricName, value):
     @param metricName: Title of the item to print to the log
     @param value: The item's value to print to the log
     """
-    global PRINT_JSON
-    if PRINT_JSON:
+    if jsonOutput():
         if value is not None and device is not None:
-            formatJson(device, str(metricName) + ': ' + str(value))
+            storeJson(device, metricName, value)
         elif device is not None:
             formatJson(device, str(metricName))
         return
@@ -542,7 +592,6 @@ def printListLog(metricName, valuesList):
     @param metricName: Title of the item to print to the log
     @param valuesList: The item's list of values to print to the log
     """
-    global PRINT_JSON
     listStr = ''
     line = metricName + ':\n'
     if not valuesList:
@@ -555,7 +604,7 @@ def printListLog(metricName, valuesList):
             else:
                 listStr = listStr + line + '\n'
                 line = value
-    if not PRINT_JSON:
+    if not jsonOutput():
         print(listStr + line)
 
 
@@ -567,8 +616,8 @@ def printLogSpacer(displayString=None, fill='='):
     @param displayString: name of item to be displayed inside of the log spacer
     @param fill: padding string which surrounds the given display string
     """
-    global appWidth, PRINT_JSON
-    if not PRINT_JSON:
+    global appWidth
+    if not jsonOutput():
         if displayString:
             if len(displayString) % 2:
                 displayString += fill
@@ -585,11 +634,10 @@ def printSysLog(SysComponentName, value):
     @param SysComponentName: Title of the item to print to the log
     @param value: The item's value to print to the log
     """
-    global PRINT_JSON, JSON_DATA
-    if PRINT_JSON:
-        if 'system' not in JSON_DATA:
-            JSON_DATA['system'] = {}
-        formatJson('system', str(SysComponentName) + ': ' + str(value))
+    if jsonOutput():
+        if 'system' not in jsonOutputData():
+            jsonOutputData()['system'] = {}
+        storeJson('system', SysComponentName, value)
         return
 
     logstr = '{}: {}'.format(SysComponentName, value)
@@ -611,8 +659,8 @@ def printTableLog(column_headers, data_matrix, device=None, tableName=None, anch
     # If additional space is needed, please pad corresponding column name with spaces
     # If table should print tabulated, pad name of column one with leading zeroes
     # Use anchor '<' to to align columns to the right
-    global OUTPUT_SERIALIZATION, PRINT_JSON
-    if OUTPUT_SERIALIZATION or PRINT_JSON:
+    global OUTPUT_SERIALIZATION
+    if OUTPUT_SERIALIZATION or jsonOutput():
         return
 
     if (device is not None) or tableName:
@@ -796,18 +844,17 @@ def setClockRange(deviceList, clkType, minvalue, maxvalue, autoRespond):
     maxvalue -- Maximum value to apply to the clock range
     autoRespond -- Response to automatically provide for all prompts
     """
-    global RETCODE
     if clkType not in {'sclk', 'mclk'}:
         printLog(None, 'Invalid range identifier %s' % (clkType), None)
         logging.error('Unsupported range type %s', clkType)
-        RETCODE = 1
+        setRetcode(1)
         return
     try:
         int(minvalue) & int(maxvalue)
     except ValueError:
         printErrLog(device, 'Unable to set %s range' % (clkType))
         logging.error('%s or %s is not an integer', minvalue, maxvalue)
-        RETCODE = 1
+        setRetcode(1)
         return
     confirmOutOfSpecWarning(autoRespond)
     printLogSpacer(' Set Valid %s Range ' % (clkType))
@@ -817,7 +864,7 @@ def setClockRange(deviceList, clkType, minvalue, maxvalue, autoRespond):
             printLog(device, 'Successfully set %s from %s(MHz) to %s(MHz)' % (clkType, minvalue, maxvalue), None)
         else:
             printErrLog(device, 'Unable to set %s from %s(MHz) to %s(MHz)' % (clkType, minvalue, maxvalue))
-            RETCODE = 1
+            setRetcode(1)
             if ret == rsmi_status_t.RSMI_STATUS_NOT_SUPPORTED:
                 printLog(device, 'Setting %s range is not supported for this device.' % (clkType), None)
 
@@ -832,14 +879,13 @@ def setVoltageCurve(deviceList, point, clk, volt, autoRespond):
     volt -- Voltage specified for this curve point
     autoRespond -- Response to automatically provide for all prompts
     """
-    global RETCODE
     value = '%s %s %s' % (point, clk, volt)
     try:
         any(int(item) for item in value)
     except ValueError:
         printLogNoDev('Unable to set Voltage curve')
         logging.error('Non-integer characters are present in %s', value)
-        RETCODE = 1
+        setRetcode(1)
         return
     confirmOutOfSpecWarning(autoRespond)
     for device in deviceList:
@@ -848,7 +894,7 @@ def setVoltageCurve(deviceList, point, clk, volt, autoRespond):
             printLog(device, 'Successfully set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt), None)
         else:
             printErrLog(device, 'Unable to set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt))
-            RETCODE = 1
+            setRetcode(1)
 
 
 def setPowerPlayTableLevel(deviceList, clkType, point, clk, volt, autoRespond):
@@ -862,14 +908,13 @@ def setPowerPlayTableLevel(deviceList, clkType, point, clk, volt, autoRespond):
     volt -- Voltage specified for this curve point
     autoRespond -- Response to automatically provide for all prompts
     """
-    global RETCODE
     value = '%s %s %s' % (point, clk, volt)
     try:
         any(int(item) for item in value.split())
     except ValueError:
         printLogNoDev('Unable to set PowerPlay table level')
         logging.error('Non-integer characters are present in %s', value)
-        RETCODE = 1
+        setRetcode(1)
         return
     confirmOutOfSpecWarning(autoRespond)
     for device in deviceList:
@@ -880,7 +925,7 @@ def setPowerPlayTableLevel(deviceList, clkType, point, clk, volt, autoRespond):
                 printLog(device, 'Successfully set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt), None)
             else:
                 printErrLog(device, 'Unable to set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt))
-                RETCODE = 1
+                setRetcode(1)
         elif clkType == 'mclk':
             ret = rocmsmi.rsmi_dev_od_clk_info_set(device, rsmi_freq_ind_t(int(point)), int(clk),
                                                    rsmi_clk_names_dict[clkType])
@@ -888,11 +933,11 @@ def setPowerPlayTableLevel(deviceList, clkType, point, clk, volt, autoRespond):
                 printLog(device, 'Successfully set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt), None)
             else:
                 printErrLog(device, 'Unable to set voltage point %s to %s(MHz) %s(mV)' % (point, clk, volt))
-                RETCODE = 1
+                setRetcode(1)
         else:
             printErrLog(device, 'Unable to set %s range' % (clkType))
             logging.error('Unsupported range type %s', clkType)
-            RETCODE = 1
+            setRetcode(1)
 
 
 def setClockOverDrive(deviceList, clktype, value, autoRespond):
@@ -904,20 +949,19 @@ def setClockOverDrive(deviceList, clktype, value, autoRespond):
     @param autoRespond: Response to automatically provide for all prompts
     """
     printLogSpacer(' Set Clock OverDrive (Range: 0% to 20%) ')
-    global RETCODE
     try:
         int(value)
     except ValueError:
         printLog(None, 'Unable to set OverDrive level', None)
         logging.error('%s it is not an integer', value)
-        RETCODE = 1
+        setRetcode(1)
         return
     confirmOutOfSpecWarning(autoRespond)
     for device in deviceList:
         if int(value) < 0:
             printErrLog(device, 'Unable to set OverDrive')
             logging.debug('Overdrive cannot be less than 0%')
-            RETCODE = 1
+            setRetcode(1)
             return
         if int(value) > 20:
             printLog(device, 'Setting OverDrive to 20%', None)
@@ -942,7 +986,7 @@ def setClockOverDrive(deviceList, clktype, value, autoRespond):
             except (IOError, OSError):
                 printLog(None, 'Unable to write to sysfs file %s' % fsFile, None)
                 logging.warning('IO or OS error')
-                RETCODE = 1
+                setRetcode(1)
                 continue
             printLog(device, 'Successfully set %s OverDrive to %s%%' % (clktype, value), None)
         elif clktype == 'sclk':
@@ -954,7 +998,7 @@ def setClockOverDrive(deviceList, clktype, value, autoRespond):
         else:
             printErrLog(device, 'Unable to set OverDrive')
             logging.error('Unsupported clock type %s', clktype)
-            RETCODE = 1
+            setRetcode(1)
 
 
 def setClocks(deviceList, clktype, clk):
@@ -964,15 +1008,14 @@ def setClocks(deviceList, clktype, clk):
     @param clktype: [validClockNames] Clock type to set
     @param clk: Clock frequency level to set
     """
-    global RETCODE
     if not clk:
         printLog(None, 'Invalid clock frequency', None)
-        RETCODE = 1
+        setRetcode(1)
         return
     if clktype not in validClockNames:
         printErrLog(None, 'Unable to set clock level')
         logging.error('Invalid clock type %s', clktype)
-        RETCODE = 1
+        setRetcode(1)
         return
     check_value = ''.join(map(str, clk))
     try:
@@ -980,7 +1023,7 @@ def setClocks(deviceList, clktype, clk):
     except ValueError:
         printLog(None, 'Unable to set clock level', None)
         logging.error('Non-integer characters are present in value %s', value)
-        RETCODE = 1
+        setRetcode(1)
         return
     # Generate a frequency bitmask from user input value
     freq_bitmask = 0
@@ -988,7 +1031,7 @@ def setClocks(deviceList, clktype, clk):
         if bit > 63:
             printErrLog(None, 'Invalid clock frequency')
             logging.error('Invalid frequency: %s', bit)
-            RETCODE = 1
+            setRetcode(1)
             return
 
         freq_bitmask |= (1 << bit)
@@ -1002,7 +1045,7 @@ def setClocks(deviceList, clktype, clk):
                 printLog(device, 'Performance level was set to manual', None)
             else:
                 printErrLog(device, 'Unable to set performance level to manual')
-                RETCODE = 1
+                setRetcode(1)
                 return
         if clktype != 'pcie':
             ret = rocmsmi.rsmi_dev_gpu_clk_freq_set(device, rsmi_clk_names_dict[clktype], freq_bitmask)
@@ -1010,14 +1053,14 @@ def setClocks(deviceList, clktype, clk):
                 printLog(device, 'Successfully set %s bitmask to' % (clktype), hex(freq_bitmask))
             else:
                 printErrLog(device, 'Unable to set %s bitmask to: %s' % (clktype, hex(freq_bitmask)))
-                RETCODE = 1
+                setRetcode(1)
         else:
             ret = rocmsmi.rsmi_dev_pci_bandwidth_set(device, freq_bitmask)
             if rsmi_ret_ok(ret, device):
                 printLog(device, 'Successfully set %s to level bitmask' % (clktype), hex(freq_bitmask))
             else:
                 printErrLog(device, 'Unable to set %s bitmask to: %s' % (clktype, hex(freq_bitmask)))
-                RETCODE = 1
+                setRetcode(1)
     printLogSpacer()
 
 
@@ -1028,13 +1071,12 @@ def setPerfDeterminism(deviceList, clkvalue):
     @param deviceList: List of DRM devices (can be a single-item list)
     @param value: Clock frequency level to set
     """
-    global RETCODE
     try:
         int(clkvalue)
     except ValueError:
         printErrLog(device, 'Unable to set Performance Determinism')
         logging.error('%s is not an integer', clkvalue)
-        RETCODE = 1
+        setRetcode(1)
         return
     for device in deviceList:
         ret = rocmsmi.rsmi_perf_determinism_mode_set(device, int(clkvalue))
@@ -1042,7 +1084,7 @@ def setPerfDeterminism(deviceList, clkvalue):
             printLog(device, 'Successfully enabled performance determinism and set GFX clock frequency', str(clkvalue))
         else:
             printErrLog(device, 'Unable to set performance determinism and clock frequency to %s' % (str(clkvalue)))
-            RETCODE = 1
+            setRetcode(1)
 
 
 def resetGpu(device):
@@ -1051,15 +1093,14 @@ def resetGpu(device):
     @param device: DRM device identifier
     """
     printLogSpacer(' Reset GPU ')
-    global RETCODE
     if len(device) > 1:
         logging.error('GPU Reset can only be performed on one GPU per call')
-        RETCODE = 1
+        setRetcode(1)
         return
     resetDev = int(device[0])
     if not isAmdDevice(resetDev):
         logging.error('GPU Reset can only be performed on an AMD GPU')
-        RETCODE = 1
+        setRetcode(1)
         return
     ret = rocmsmi.rsmi_dev_gpu_reset(resetDev)
     if rsmi_ret_ok(ret, resetDev):
@@ -1098,7 +1139,6 @@ def setRas(deviceList, rasAction, rasBlock, rasType):
 
 
     """
-    global RETCODE
     printLog(None, "This is experimental feature, use 'amdgpuras' tool for ras error manipulations for newer vbios")
 
     if rasAction not in validRasActions:
@@ -1137,7 +1177,7 @@ def setRas(deviceList, rasAction, rasBlock, rasType):
             except (IOError, OSError):
                 printLog(None, 'Unable to write to sysfs file %s' % rasFilePath, None)
                 logging.warning('IO or OS error')
-                RETCODE = 1
+                setRetcode(1)
 
     printLogSpacer()
 
@@ -1194,13 +1234,12 @@ def setPowerOverDrive(deviceList, value, autoRespond):
     @param value: New maximum power to assign to the target device, in Watts
     @param autoRespond: Response to automatically provide for all prompts
     """
-    global RETCODE, PRINT_JSON
     try:
         int(value)
     except ValueError:
         printLog(None, 'Unable to set Power OverDrive', None)
         logging.error('%s is not an integer', value)
-        RETCODE = 1
+        setRetcode(1)
         return
     # Wattage input value converted to microWatt for ROCm SMI Lib
 
@@ -1241,17 +1280,17 @@ def setPowerOverDrive(deviceList, value, autoRespond):
         ret = rocmsmi.rsmi_dev_power_cap_range_get(device, 0, byref(power_cap_max), byref(power_cap_min))
         if rsmi_ret_ok(ret, device) == False:
             printErrLog(device, 'Unable to parse Power OverDrive range')
-            RETCODE = 1
+            setRetcode(1)
             continue
         if int(strValue) > (power_cap_max.value / 1000000):
             printErrLog(device, 'Unable to set Power OverDrive')
             logging.error('GPU[%s]\t\t: Value cannot be greater than: %dW ', device, power_cap_max.value / 1000000)
-            RETCODE = 1
+            setRetcode(1)
             continue
         if int(strValue) < (power_cap_min.value / 1000000):
             printErrLog(device, 'Unable to set Power OverDrive')
             logging.error('GPU[%s]\t\t: Value cannot be less than: %dW ', device, power_cap_min.value / 1000000)
-            RETCODE = 1
+            setRetcode(1)
             continue
         if new_power_cap.value == current_power_cap.value:
             printErrLog(device,'Max power was already at: {}W'.format(new_power_cap.value / 1000000))
@@ -1268,11 +1307,11 @@ def setPowerOverDrive(deviceList, value, autoRespond):
                 power_cap = c_uint64()
                 ret = rocmsmi.rsmi_dev_power_cap_get(device, 0, byref(power_cap))
                 if rsmi_ret_ok(ret, device):
-                    if not PRINT_JSON:
+                    if not jsonOutput():
                         printLog(device,
                                  'Successfully reset Power OverDrive to: %sW' % (int(power_cap.value / 1000000)), None)
             else:
-                if not PRINT_JSON:
+                if not jsonOutput():
                     ret = rocmsmi.rsmi_dev_power_cap_get(device, 0, byref(current_power_cap))
                     if current_power_cap.value == new_power_cap.value:
                         printLog(device, 'Successfully set power to: %sW' % (strValue), None)
@@ -1332,8 +1371,7 @@ def showAllConcise(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
-    if PRINT_JSON:
+    if jsonOutput():
         print('ERROR: Cannot print JSON/CSV output for concise output')
         sys.exit(1)
     printLogSpacer(' Concise Info ')
@@ -1392,8 +1430,7 @@ def showAllConciseHw(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
-    if PRINT_JSON:
+    if jsonOutput():
         print('ERROR: Cannot print JSON/CSV output for concise hardware output')
         sys.exit(1)
     printLogSpacer(' Concise Hardware Info ')
@@ -1487,7 +1524,6 @@ def showCurrentClocks(deviceList, clk_defined=None, concise=False):
     @param deviceList: List of DRM devices (can be a single-item list)
     @param clk-type: Clock type to display
     """
-    global PRINT_JSON
     freq = rsmi_frequencies_t()
     bw = rsmi_pcie_bandwidth_t()
     currentString = ''
@@ -1520,7 +1556,7 @@ def showCurrentClocks(deviceList, clk_defined=None, concise=False):
                             printLog(device, '%s current clock frequency not found' % (clk_type), None)
                             continue
                         fr = freq.frequency[levl] / 1000000
-                        if PRINT_JSON:
+                        if jsonOutput():
                             printLog(device, '%s clock speed:' % (clk_type), '(%sMhz)' % (str(fr)[:-2]))
                             printLog(device, '%s clock level:' % (clk_type), levl)
                         else:
@@ -1548,7 +1584,6 @@ def showCurrentFans(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
     printLogSpacer(' Current Fan Metric ')
     rpmSpeed = c_int64()
     sensor_ind = c_uint32(0)
@@ -1558,14 +1593,14 @@ def showCurrentFans(deviceList):
         fanSpeed = round(fanSpeed)
         if fanLevel == 0 or fanSpeed == 0:
             # printLog(device, 'Unable to detect fan speed for GPU %d' % (device), None)
-            printLog(device, 'Fan speed (%)', str(fanSpeed))
+            printLog(device, 'Fan speed (%)', fanSpeed)
             logging.debug('Current fan speed is: %d\n' % (fanSpeed) + \
                           '       Current fan level is: %d\n' % (fanLevel) + \
                           '       (GPU might be cooled with a non-PWM fan)')
             continue
-        if PRINT_JSON:
-            printLog(device, 'Fan speed (level)', str(fanLevel))
-            printLog(device, 'Fan speed (%)', str(fanSpeed))
+        if jsonOutput():
+            printLog(device, 'Fan speed (level)', fanLevel)
+            printLog(device, 'Fan speed (%)', fanSpeed)
         else:
             printLog(device, 'Fan Level', str(fanLevel) + ' (%s%%)' % (str(fanSpeed)))
         ret = rocmsmi.rsmi_dev_fan_rpms_get(device, sensor_ind, byref(rpmSpeed))
@@ -1812,7 +1847,7 @@ def showMemUse(deviceList):
         if memInfo[0] == None or memInfo[1] == None:
             ret = 'N/A'
         else:
-            ret = str((100 * (float(memInfo[0]) / float(memInfo[1]))))
+            ret = 100 * (float(memInfo[0]) / float(memInfo[1]))
 
         printLog(device, 'GPU memory use (%)', ret)
         printLog(device, 'GPU memory use', memInfo[0])
@@ -1986,8 +2021,7 @@ def showPowerPlayTable(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
-    if PRINT_JSON:
+    if jsonOutput():
         return
     printLogSpacer(' GPU Memory clock frequencies and voltages ')
     odvf = rsmi_od_volt_freq_data_t()
@@ -2079,8 +2113,7 @@ def showProfile(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
-    if PRINT_JSON:
+    if jsonOutput():
         return
     printLogSpacer(' Show Power Profiles ')
     status = rsmi_power_profile_status_t()
@@ -2109,10 +2142,9 @@ def showRange(deviceList, rangeType):
     @param deviceList: List of DRM devices (can be a single-item list)
     @param rangeType: [sclk|voltage] Type of range to return
     """
-    global RETCODE
     if rangeType not in {'sclk', 'mclk', 'voltage'}:
         printLog(None, 'Invalid range identifier %s' % (rangeType), None)
-        RETCODE = 1
+        setRetcode(1)
         return
     printLogSpacer(' Show Valid %s Range ' % (rangeType))
     odvf = rsmi_od_volt_freq_data_t()
@@ -2343,7 +2375,7 @@ def showVoltage(deviceList):
         voltage = c_uint64()
         ret = rocmsmi.rsmi_dev_volt_metric_get(device, vtype, met, byref(voltage))
         if rsmi_ret_ok(ret, device) and str(voltage.value):
-            printLog(device, 'Voltage (mV)', str(voltage.value))
+            printLog(device, 'Voltage (mV)', voltage.value)
         else:
             logging.debug('GPU voltage not supported')
     printLogSpacer()
@@ -2392,7 +2424,7 @@ def showXgmiErr(deviceList):
             else:
                 printErrLog(device, 'Invalid return value from xgmi_error')
                 continue
-            if PRINT_JSON is True:
+            if jsonOutput():
                 printLog(device, 'XGMI Error count', err)
             else:
                 printLog(device, 'XGMI Error count', '%s (%s)' % (err, desc))
@@ -2417,7 +2449,7 @@ def showAccessibleTopology(deviceList):
                 gpu_links_type[srcdevice][destdevice] = accessible.value
             else:
                 printErrLog(srcdevice, 'Cannot read link accessibility: Unsupported on this machine')
-    if PRINT_JSON:
+    if jsonOutput():
         formatMatrixToJSON(deviceList, gpu_links_type, "(Topology) Link accessibility between DRM devices {} and {}")
         return
 
@@ -2441,7 +2473,6 @@ def showWeightTopology(deviceList):
 
     @param deviceList: List of DRM devices (can be a single-item list)
     """
-    global PRINT_JSON
     devices_ind = range(len(deviceList))
     gpu_links_weight = [[0 for x in devices_ind] for y in devices_ind]
     printLogSpacer(' Weight between two GPUs ')
@@ -2459,7 +2490,7 @@ def showWeightTopology(deviceList):
                 gpu_links_weight[srcdevice][destdevice] = None
 
 
-    if PRINT_JSON:
+    if jsonOutput():
         formatMatrixToJSON(deviceList, gpu_links_weight, "(Topology) Weight between DRM devices {} and {}")
         return
 
@@ -2505,7 +2536,7 @@ def showHopsTopology(deviceList):
                 printErrLog(srcdevice, 'Cannot read Link Hops: Not supported on this machine')
                 gpu_links_hops[srcdevice][destdevice] = None
 
-    if PRINT_JSON:
+    if jsonOutput():
         formatMatrixToJSON(deviceList, gpu_links_hops, "(Topology) Hops between DRM devices {} and {}")
         return
 
@@ -2556,7 +2587,7 @@ def showTypeTopology(deviceList):
                 printErrLog(srcdevice, 'Cannot read Link Type: Not supported on this machine')
                 gpu_links_type[srcdevice][destdevice] = "XXXX"
 
-    if PRINT_JSON:
+    if jsonOutput():
         formatMatrixToJSON(deviceList, gpu_links_type, "(Topology) Link type between DRM devices {} and {}")
         return
 
@@ -2646,7 +2677,7 @@ def showNodesBw(deviceList):
                     gpu_links_type[srcdevice][destdevice] = "{}-{}".format(minBW.value, maxBW.value)
             else:
                 gpu_links_type[srcdevice][destdevice] = "N/A"
-    if PRINT_JSON:
+    if jsonOutput():
         formatMatrixToJSON(deviceList, "{}-{}".format(minBW.value, maxBW.value),  " min-max bandwidth between DRM devices {} and {}".format(srcdevice, destdevice))
         return
     printTableRow(None, '      ')
@@ -2840,6 +2871,18 @@ def relaunchAsSudo():
         os.execvp('sudo', ['sudo'] + sys.argv)
 
 
+def setRetcode(value):
+    """ Set the exit code, except within collect(), which mustn't touch module state
+
+    collect() callers see a failed value as left out (or None) in its output instead
+
+    @param value: Exit code
+    """
+    global RETCODE
+    if getattr(_collection, 'data', None) is None:
+        RETCODE = value
+
+
 def rsmi_ret_ok(my_ret, device=None, metric=None, silent=False):
     """ Returns true if RSMI call status is 0 (success)
 
@@ -2849,8 +2892,6 @@ def rsmi_ret_ok(my_ret, device=None, metric=None, silent=False):
     @param my_ret: Return of RSMI call (rocm_smi_lib API)
     @param metric: Parameter of GPU currently being analyzed
     """
-    global RETCODE
-    global PRINT_JSON
     if my_ret != rsmi_status_t.RSMI_STATUS_SUCCESS:
         err_str = c_char_p()
         rocmsmi.rsmi_status_string(my_ret, byref(err_str))
@@ -2860,12 +2901,12 @@ def rsmi_ret_ok(my_ret, device=None, metric=None, silent=False):
         if metric is not None:
             returnString += ' %s: ' % (metric)
         returnString += '%s\t' % (err_str.value.decode())
-        if not PRINT_JSON:
+        if not jsonOutput():
             logging.debug('%s', returnString)
             if not silent:
                 if my_ret in rsmi_status_verbose_err_out:
                     printLog(device, rsmi_status_verbose_err_out[my_ret], None)
-        RETCODE = my_ret
+        setRetcode(my_ret)
         return False
     return True
 
@@ -2926,6 +2967,243 @@ def save(deviceList, savefilepath):
     printLogSpacer()
 
 
+def applyShowAllInfo(args):
+    """ Expand --showallinfo into the individual show options it covers
+
+    @param args: Parsed command line arguments
+    """
+    if args.showallinfo:
+        args.list = True
+        args.showid = True
+        args.showvbios = True
+        args.showdriverversion = True
+        args.showfwinfo = 'all'
+        args.showmclkrange = True
+        args.showmemvendor = True
+        args.showsclkrange = True
+        args.showproductname = True
+        args.showserial = True
+        args.showuniqueid = True
+        args.showvoltagerange = True
+        args.showbus = True
+        args.showpagesinfo = True
+        args.showfan = True
+        args.showpower = True
+        args.showtemp = True
+        args.showuse = True
+        args.showenergycounter = True
+        args.showmemuse = True
+        args.showvoltage = True
+        args.showclocks = True
+        args.showmaxpower = True
+        args.showmemoverdrive = True
+        args.showoverdrive = True
+        args.showperflevel = True
+        args.showpids = True
+        args.showpidgpus = []
+        args.showreplaycount = True
+        args.showvc = True
+
+        if not jsonOutput():
+            args.showprofile = True
+            args.showclkfrq = True
+            args.showclkvolt = True
+
+
+def showRequested(args, deviceList):
+    """ Run every non-interactive show option requested in args
+
+    @param args: Parsed command line arguments
+    @param deviceList: List of DRM devices (can be a single-item list)
+    """
+    if args.showhw:
+        showAllConciseHw(deviceList)
+    if args.showdriverversion:
+        showVersion(deviceList, rsmi_sw_component_t.RSMI_SW_COMP_DRIVER)
+    if args.showid:
+        showId(deviceList)
+    if args.showuniqueid:
+        showUId(deviceList)
+    if args.showvbios:
+        showVbiosVersion(deviceList)
+    if args.showtemp:
+        showCurrentTemps(deviceList)
+    if args.showclocks:
+        showCurrentClocks(deviceList)
+    if args.showgpuclocks:
+        showCurrentClocks(deviceList, 'sclk')
+    if args.showfan:
+        showCurrentFans(deviceList)
+    if args.showperflevel:
+        showPerformanceLevel(deviceList)
+    if args.showoverdrive:
+        showOverDrive(deviceList, 'sclk')
+    if args.showmemoverdrive:
+        showOverDrive(deviceList, 'mclk')
+    if args.showmaxpower:
+        showMaxPower(deviceList)
+    if args.showprofile:
+        showProfile(deviceList)
+    if args.showpower:
+        showPower(deviceList)
+    if args.showclkfrq:
+        showClocks(deviceList)
+    if args.showuse:
+        showGpuUse(deviceList)
+    if args.showmemuse:
+        showMemUse(deviceList)
+    if args.showmemvendor:
+        showMemVendor(deviceList)
+    if args.showbw:
+        showPcieBw(deviceList)
+    if args.showreplaycount:
+        showPcieReplayCount(deviceList)
+    if args.showserial:
+        showSerialNumber(deviceList)
+    if args.showpids:
+        showPids()
+    if args.showpidgpus or str(args.showpidgpus) == '[]':
+        showGpusByPid(args.showpidgpus)
+    if args.showclkvolt:
+        showPowerPlayTable(deviceList)
+    if args.showvoltage:
+        showVoltage(deviceList)
+    if args.showbus:
+        showBus(deviceList)
+    if args.showmeminfo:
+        showMemInfo(deviceList, args.showmeminfo)
+    if args.showrasinfo or str(args.showrasinfo) == '[]':
+        showRasInfo(deviceList, args.showrasinfo)
+    # The second condition in the below 'if' statement checks whether showfwinfo was given arguments.
+    # It compares itself to the string representation of the empty list and prints all firmwares.
+    # This allows the user to call --showfwinfo without the 'all' argument and still print all.
+    if args.showfwinfo or str(args.showfwinfo) == '[]':
+        showFwInfo(deviceList, args.showfwinfo)
+    if args.showproductname:
+        showProductName(deviceList)
+    if args.showxgmierr:
+        showXgmiErr(deviceList)
+    if args.shownodesbw:
+        showNodesBw(deviceList)
+    if args.showtopo:
+        showHwTopology(deviceList)
+    if args.showtopoaccess:
+        showAccessibleTopology(deviceList)
+    if args.showtopoweight:
+        showWeightTopology(deviceList)
+    if args.showtopohops:
+        showHopsTopology(deviceList)
+    if args.showtopotype:
+        showTypeTopology(deviceList)
+    if args.showtoponuma:
+        showNumaTopology(deviceList)
+    if args.showpagesinfo:
+        showRetiredPages(deviceList)
+    if args.showretiredpages:
+        showRetiredPages(deviceList, 'reserved')
+    if args.showpendingpages:
+        showRetiredPages(deviceList, 'pending')
+    if args.showunreservablepages:
+        showRetiredPages(deviceList, 'unreservable')
+    if args.showsclkrange:
+        showRange(deviceList, 'sclk')
+    if args.showmclkrange:
+        showRange(deviceList, 'mclk')
+    if args.showvoltagerange:
+        showRange(deviceList, 'voltage')
+    if args.showvc:
+        showVoltageCurve(deviceList)
+    if args.showenergycounter:
+        showEnergy(deviceList)
+
+
+class ShowOptions(argparse.Namespace):
+    """ Show options for collect(), every option not given is off """
+
+    def __init__(self, fields=()):
+        # showfwinfo takes a list of firmware blocks rather than being a switch
+        super(ShowOptions, self).__init__(
+            **dict((field, ['all'] if field == 'showfwinfo' else True) for field in fields))
+
+    def __getattr__(self, name):
+        # Only called for attributes that haven't been set
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+
+def collectArgs(args, deviceList):
+    """ Returns the JSON output of the show options in args for deviceList, without printing it
+
+    @param args: Parsed command line arguments, or ShowOptions
+    @param deviceList: List of DRM devices (can be a single-item list)
+    """
+    if args.showhw:
+        raise ValueError('Cannot collect JSON output for concise hardware output')
+    data = dict(('card' + str(device), {}) for device in deviceList)
+    _collection.data = data
+    try:
+        applyShowAllInfo(args)
+        showRequested(args, deviceList)
+    finally:
+        _collection.data = None
+    return dict((name, values) for name, values in data.items() if values)
+
+
+def collect(deviceList, fields):
+    """ Returns the JSON output of the show options in fields for deviceList, without printing it
+
+    Output goes into a new dictionary for every call rather than JSON_DATA, so this
+    can be called repeatedly and from several threads at once. initializeRsmi() must
+    have been called first.
+
+    Raises ValueError for options that can't be output as JSON (showhw).
+
+    @param deviceList: List of DRM devices (can be a single-item list)
+    @param fields: Names of the show options to collect, e.g. ['showtemp', 'showpower']
+    """
+    return collectArgs(ShowOptions(fields), deviceList)
+
+
+def runDaemon(parser):
+    """ Answer queries from stdin until it is closed, without re-initializing
+
+    Each query is a line of JSON: {"flags": ["--showtemp", ...], "devices": [0, 1]}
+    where devices is optional (all devices if left out). Each answer is the
+    same JSON as --json would print, on a single line of stdout.
+
+    @param parser: Argument parser used to parse each query's flags
+    """
+    # Anything the show functions print must not end up in the answers
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    # readline rather than iterating, which can read ahead and wait for more queries
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            args = parser.parse_args(list(request.get('flags', [])))
+        except (AttributeError, ValueError, SystemExit):
+            # argparse has already logged why the flags are invalid
+            out.write(json.dumps({'error': 'Invalid query: %s' % (line.strip())}) + '\n')
+            out.flush()
+            continue
+        # Same device selection as --device, or all devices without it
+        queryDevices = request.get('devices')
+        if queryDevices is None:
+            queryDevices = listDevices()
+        else:
+            queryDevices = [device for device in queryDevices
+                            if doesDeviceExist(device) and (isAmdDevice(device) or args.alldevices)]
+        try:
+            answer = collectArgs(args, queryDevices)
+        except ValueError as e:
+            answer = {'error': str(e)}
+        out.write(json.dumps(answer) + '\n')
+        out.flush()
+
+
 # The code below is for when this script is run as an executable instead of when imported as a module
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -3075,6 +3353,8 @@ if __name__ == '__main__':
                                    metavar='LEVEL')
     groupActionOutput.add_argument('--json', help='Print output in JSON format', action='store_true')
     groupActionOutput.add_argument('--csv', help='Print output in CSV format', action='store_true')
+    groupActionOutput.add_argument('--daemon', help='Stay running, answering JSON queries read from stdin',
+                                   action='store_true')
 
     args = parser.parse_args()
 
@@ -3086,6 +3366,11 @@ if __name__ == '__main__':
         numericLogLevel = getattr(logging, args.loglevel.upper(), logging.WARNING)
         logging.getLogger().setLevel(numericLogLevel)
 
+    if args.daemon:
+        runDaemon(parser)
+        rsmi_ret_ok(rocmsmi.rsmi_shut_down())
+        sys.exit(0)
+
     if args.setsclk or args.setmclk or args.setpcie or args.resetfans or args.setfan or args.setperflevel or args.load \
             or args.resetclocks or args.setprofile or args.resetprofile or args.setoverdrive or args.setmemoverdrive \
             or args.setpoweroverdrive or args.resetpoweroverdrive or args.rasenable or args.rasdisable or \
@@ -3121,42 +3406,7 @@ if __name__ == '__main__':
         print('\n')
     printLogSpacer(headerString)
 
-    if args.showallinfo:
-        args.list = True
-        args.showid = True
-        args.showvbios = True
-        args.showdriverversion = True
-        args.showfwinfo = 'all'
-        args.showmclkrange = True
-        args.showmemvendor = True
-        args.showsclkrange = True
-        args.showproductname = True
-        args.showserial = True
-        args.showuniqueid = True
-        args.showvoltagerange = True
-        args.showbus = True
-        args.showpagesinfo = True
-        args.showfan = True
-        args.showpower = True
-        args.showtemp = True
-        args.showuse = True
-        args.showenergycounter = True
-        args.showmemuse = True
-        args.showvoltage = True
-        args.showclocks = True
-        args.showmaxpower = True
-        args.showmemoverdrive = True
-        args.showoverdrive = True
-        args.showperflevel = True
-        args.showpids = True
-        args.showpidgpus = []
-        args.showreplaycount = True
-        args.showvc = True
-
-        if not PRINT_JSON:
-            args.showprofile = True
-            args.showclkfrq = True
-            args.showclkvolt = True
+    applyShowAllInfo(args)
 
     # Don't do reset in combination with any other command
     if args.gpureset:
@@ -3175,109 +3425,11 @@ if __name__ == '__main__':
             len(sys.argv) == 2 and (args.alldevices or (args.json or args.csv)) or \
             len(sys.argv) == 3 and (args.alldevices and (args.json or args.csv)):
         showAllConcise(deviceList)
-    if args.showhw:
-        showAllConciseHw(deviceList)
-    if args.showdriverversion:
-        showVersion(deviceList, rsmi_sw_component_t.RSMI_SW_COMP_DRIVER)
-    if args.showid:
-        showId(deviceList)
-    if args.showuniqueid:
-        showUId(deviceList)
-    if args.showvbios:
-        showVbiosVersion(deviceList)
     if args.showevents or str(args.showevents) == '[]':
         showEvents(deviceList, args.showevents)
     if args.resetclocks:
         resetClocks(deviceList)
-    if args.showtemp:
-        showCurrentTemps(deviceList)
-    if args.showclocks:
-        showCurrentClocks(deviceList)
-    if args.showgpuclocks:
-        showCurrentClocks(deviceList, 'sclk')
-    if args.showfan:
-        showCurrentFans(deviceList)
-    if args.showperflevel:
-        showPerformanceLevel(deviceList)
-    if args.showoverdrive:
-        showOverDrive(deviceList, 'sclk')
-    if args.showmemoverdrive:
-        showOverDrive(deviceList, 'mclk')
-    if args.showmaxpower:
-        showMaxPower(deviceList)
-    if args.showprofile:
-        showProfile(deviceList)
-    if args.showpower:
-        showPower(deviceList)
-    if args.showclkfrq:
-        showClocks(deviceList)
-    if args.showuse:
-        showGpuUse(deviceList)
-    if args.showmemuse:
-        showMemUse(deviceList)
-    if args.showmemvendor:
-        showMemVendor(deviceList)
-    if args.showbw:
-        showPcieBw(deviceList)
-    if args.showreplaycount:
-        showPcieReplayCount(deviceList)
-    if args.showserial:
-        showSerialNumber(deviceList)
-    if args.showpids:
-        showPids()
-    if args.showpidgpus or str(args.showpidgpus) == '[]':
-        showGpusByPid(args.showpidgpus)
-    if args.showclkvolt:
-        showPowerPlayTable(deviceList)
-    if args.showvoltage:
-        showVoltage(deviceList)
-    if args.showbus:
-        showBus(deviceList)
-    if args.showmeminfo:
-        showMemInfo(deviceList, args.showmeminfo)
-    if args.showrasinfo or str(args.showrasinfo) == '[]':
-        showRasInfo(deviceList, args.showrasinfo)
-    # The second condition in the below 'if' statement checks whether showfwinfo was given arguments.
-    # It compares itself to the string representation of the empty list and prints all firmwares.
-    # This allows the user to call --showfwinfo without the 'all' argument and still print all.
-    if args.showfwinfo or str(args.showfwinfo) == '[]':
-        showFwInfo(deviceList, args.showfwinfo)
-    if args.showproductname:
-        showProductName(deviceList)
-    if args.showxgmierr:
-        showXgmiErr(deviceList)
-    if args.shownodesbw:
-        showNodesBw(deviceList)
-    if args.showtopo:
-        showHwTopology(deviceList)
-    if args.showtopoaccess:
-        showAccessibleTopology(deviceList)
-    if args.showtopoweight:
-        showWeightTopology(deviceList)
-    if args.showtopohops:
-        showHopsTopology(deviceList)
-    if args.showtopotype:
-        showTypeTopology(deviceList)
-    if args.showtoponuma:
-        showNumaTopology(deviceList)
-    if args.showpagesinfo:
-        showRetiredPages(deviceList)
-    if args.showretiredpages:
-        showRetiredPages(deviceList, 'reserved')
-    if args.showpendingpages:
-        showRetiredPages(deviceList, 'pending')
-    if args.showunreservablepages:
-        showRetiredPages(deviceList, 'unreservable')
-    if args.showsclkrange:
-        showRange(deviceList, 'sclk')
-    if args.showmclkrange:
-        showRange(deviceList, 'mclk')
-    if args.showvoltagerange:
-        showRange(deviceList, 'voltage')
-    if args.showvc:
-        showVoltageCurve(deviceList)
-    if args.showenergycounter:
-        showEnergy(deviceList)
+    showRequested(args, deviceList)
     if args.setclock:
         setClocks(deviceList, args.setclock[0], [int(args.setclock[1])])
     if args.setsclk:
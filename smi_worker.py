@@ -0,0 +1,110 @@
+"""
+Long-lived `rocm-smi --daemon` worker (see smi_patch/rocm-smi-patched.py).
+
+The worker initialises rocm_smi once, then answers one query per line: a
+JSON request `{"flags": [...], "devices": [...]}` on stdin gets the fields
+`rocm-smi --json` would print back as a single line on stdout, typed rather
+than as strings and with N/A as null. This takes interpreter startup and
+`rsmi_init` out of every collection.
+"""
+import json
+import logging
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+import self_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SmiWorker:
+    """
+    Keeps one `rocm-smi --daemon` process alive, starting a new one if it
+    exits or hangs. Queries are answered one at a time.
+    """
+
+    def __init__(self, command: Optional[List[str]] = None):
+        self._command = command or ["rocm-smi", "--daemon"]
+        self._lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None
+        self._started = False
+
+    def _start(self) -> subprocess.Popen:
+        if self._started:
+            self_metrics.smi_worker_restarts.inc()
+        self._started = True
+        self._stop()
+        logger.info("Starting %s", " ".join(self._command))
+        self._process = subprocess.Popen(
+            self._command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        return self._process
+
+    def _stop(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        process.kill()
+        process.wait()
+
+    def query(
+        self, flags: List[str], devices: Optional[List[int]] = None, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Returns the worker's answer to `flags` for `devices` (all devices if
+        None). Raises subprocess.TimeoutExpired if no answer comes within
+        `timeout` seconds and subprocess.CalledProcessError if the worker
+        exits, either way the worker is restarted on the next query.
+        """
+        request = json.dumps({"flags": flags, "devices": devices}) + "\n"
+
+        with self._lock:
+            process = self._process
+            if process is None or process.poll() is not None:
+                process = self._start()
+
+            # a blocked readline can't be given a timeout, so kill the worker
+            # instead, which ends the readline with EOF
+            timed_out = threading.Event()
+
+            def kill():
+                timed_out.set()
+                process.kill()
+
+            watchdog = threading.Timer(timeout, kill) if timeout is not None else None
+            if watchdog is not None:
+                watchdog.start()
+            try:
+                process.stdin.write(request)
+                process.stdin.flush()
+                line = process.stdout.readline()
+            except (BrokenPipeError, ValueError):
+                line = ""
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+
+            if timed_out.is_set():
+                self._stop()
+                raise subprocess.TimeoutExpired(self._command, timeout)
+            if not line:
+                returncode = process.wait()
+                self._process = None
+                raise subprocess.CalledProcessError(returncode, self._command)
+
+        with self_metrics.json_parse_duration.time():
+            output = json.loads(line)
+        if "error" in output:
+            raise ValueError(output["error"])
+        return output
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
@@ -0,0 +1,238 @@
+"""
+Fast path reading hot sensors straight from amdgpu sysfs/hwmon files.
+
+Most of the per-cycle sensors are plain sysfs files, so rather than going
+through rocm-smi or librocm_smi the files are found once, kept open, and
+re-read each cycle with `os.pread`. Where the card's gpu_metrics file has a
+known layout (see gpu_metrics.py) the sensors in it come from that one read
+instead. Any field that can't be found in sysfs is left to a fallback
+backend.
+"""
+import glob
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import self_metrics
+from config import env_flag
+from gpu_metrics import GpuMetricsFile
+
+DRM_ROOT = os.environ.get("DRM_ROOT", "/sys/class/drm")
+
+# read the sensors in gpu_metrics from it rather than from their own files
+GPU_METRICS = env_flag("GPU_METRICS", default=True)
+
+_card_re = re.compile(r"^card(\d+)$")
+
+# hwmon temp*_label -> rocm-smi sensor name
+_temp_labels = {
+    "edge": "edge",
+    "junction": "junction",
+    "mem": "memory",
+}
+
+_READ_SIZE = 64
+
+logger = logging.getLogger(__name__)
+
+Conversion = Callable[[int], Any]
+
+
+class SysfsCard:
+    """
+    Open file descriptors for the sensors of one card
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        device_path = os.path.join(path, "device")
+        # the device symlink points at the PCI device, e.g. .../0000:03:00.0
+        self.pci_bus = os.path.basename(os.path.realpath(device_path)).upper()
+
+        self._fds: List[Tuple[str, int, Conversion]] = []
+
+        self._gpu_metrics: Optional[GpuMetricsFile] = None
+        if GPU_METRICS:
+            try:
+                self._gpu_metrics = GpuMetricsFile(os.path.join(device_path, "gpu_metrics"))
+            except OSError:
+                pass
+        # empty if there's no gpu_metrics or its layout isn't known
+        gpu_metrics_fields = self._gpu_metrics.fields if self._gpu_metrics else frozenset()
+        if self._gpu_metrics is not None and not gpu_metrics_fields:
+            logger.info("Unknown gpu_metrics layout for %s, reading sensor files", path)
+            self._gpu_metrics = None
+        self._gpu_metrics_fields = gpu_metrics_fields
+
+        hwmon_paths = sorted(glob.glob(os.path.join(device_path, "hwmon", "hwmon*")))
+        hwmon = hwmon_paths[0] if hwmon_paths else None
+
+        if hwmon is not None:
+            for label_path in sorted(glob.glob(os.path.join(hwmon, "temp*_label"))):
+                sensor = _temp_labels.get(_read_text(label_path))
+                if sensor is None:
+                    continue
+                self._open(
+                    f"Temperature (Sensor {sensor}) (C)",
+                    label_path[: -len("_label")] + "_input",
+                    lambda v: v / 1000,
+                )
+
+            # newer kernels only have power1_input
+            self._open_first(
+                "Average Graphics Package Power (W)",
+                [os.path.join(hwmon, "power1_average"), os.path.join(hwmon, "power1_input")],
+                lambda v: v / 1000000,
+            )
+            self._open(
+                "Max Graphics Package Power (W)",
+                os.path.join(hwmon, "power1_cap"),
+                lambda v: v / 1000000,
+            )
+            self._open("Voltage (mV)", os.path.join(hwmon, "in0_input"), int)
+            self._open("Fan RPM", os.path.join(hwmon, "fan1_input"), int)
+
+            pwm_max = _read_text(os.path.join(hwmon, "pwm1_max"))
+            if pwm_max is not None and int(pwm_max):
+                self._open(
+                    "Fan speed (%)",
+                    os.path.join(hwmon, "pwm1"),
+                    lambda v, pwm_max=int(pwm_max): round(100 * v / pwm_max),
+                )
+
+        self._open("GPU use (%)", os.path.join(device_path, "gpu_busy_percent"), int)
+        self._open("GPU memory use", os.path.join(device_path, "mem_info_vram_used"), int)
+        self._open("GPU memory available", os.path.join(device_path, "mem_info_vram_total"), int)
+        self._open("PCIe Replay Count", os.path.join(device_path, "pcie_replay_count"), int)
+
+        self.fields: FrozenSet[str] = gpu_metrics_fields | {field for field, _, _ in self._fds}
+        if {"GPU memory use", "GPU memory available"} <= self.fields:
+            self.fields |= {"GPU memory use (%)"}
+
+    def _open(self, field: str, path: str, conversion: Conversion) -> bool:
+        if field in self._gpu_metrics_fields:
+            return True
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+        self._fds.append((field, fd, conversion))
+        return True
+
+    def _open_first(self, field: str, paths: List[str], conversion: Conversion):
+        for path in paths:
+            if self._open(field, path, conversion):
+                return
+
+    def read(self) -> Dict[str, Any]:
+        values = {}
+        if self._gpu_metrics is not None:
+            try:
+                values.update(self._gpu_metrics.read())
+            except OSError:
+                # as for the files below, e.g. while the GPU is resetting
+                pass
+        for field, fd, conversion in self._fds:
+            try:
+                values[field] = conversion(int(os.pread(fd, _READ_SIZE, 0)))
+            except (OSError, ValueError):
+                # e.g. EBUSY/ENODATA while the GPU is resetting
+                continue
+
+        used = values.get("GPU memory use")
+        total = values.get("GPU memory available")
+        if used is not None and total:
+            values["GPU memory use (%)"] = 100 * used / total
+
+        return values
+
+    def close(self):
+        if self._gpu_metrics is not None:
+            self._gpu_metrics.close()
+        for _, fd, _ in self._fds:
+            os.close(fd)
+        self._fds = []
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def discover_cards(root: str = DRM_ROOT) -> List[SysfsCard]:
+    """
+    Find the amdgpu cards under `root` (normally /sys/class/drm)
+    """
+    cards = []
+    for name in sorted(os.listdir(root), key=lambda n: (len(n), n)):
+        if not _card_re.match(name):
+            continue
+        path = os.path.join(root, name)
+        if _read_text(os.path.join(path, "device", "vendor")) != "0x1002":
+            continue
+        cards.append(SysfsCard(path))
+    return cards
+
+
+class SysfsBackend:
+    """
+    Reads what it can from sysfs and the rest from `fallback`.
+
+    Cards are matched to the fallback's output by PCI bus, as DRM card numbers
+    don't necessarily match rocm-smi's device indices. The fallback is told
+    which fields sysfs already covers for every card so it can skip reading
+    them.
+    """
+
+    name = "sysfs"
+
+    def __init__(self, fallback, root: str = DRM_ROOT):
+        self._fallback = fallback
+        self._root = root
+        self._cards: List[SysfsCard] = []
+        self._covered: FrozenSet[str] = frozenset()
+        self._num_fallback_cards = 0
+        self._discover()
+
+    def _discover(self):
+        for card in self._cards:
+            card.close()
+        self._cards = discover_cards(self._root)
+        self._covered = (
+            frozenset.intersection(*(card.fields for card in self._cards))
+            if self._cards
+            else frozenset()
+        )
+        logger.info("Reading %s from sysfs", ", ".join(sorted(self._covered)) or "nothing")
+
+    def reload(self, device: Optional[int] = None):
+        self._discover()
+        self._fallback.reload(device)
+
+    def collect(self, covered: FrozenSet[str] = frozenset()) -> Dict[str, Dict[str, Any]]:
+        output = self._fallback.collect(covered | self._covered)
+
+        cards_by_bus = {
+            str(values.get("PCI Bus", "")).upper(): (card_name, values)
+            for card_name, values in output.items()
+            if card_name != "system"
+        }
+
+        for card in self._cards:
+            if card.pci_bus not in cards_by_bus:
+                continue
+            card_name, values = cards_by_bus[card.pci_bus]
+            with self_metrics.device_collection_duration.labels(self.name, card_name).time():
+                values.update(card.read())
+
+        # a card has been added or removed
+        if len(cards_by_bus) != self._num_fallback_cards:
+            self._num_fallback_cards = len(cards_by_bus)
+            if len(cards_by_bus) != len(self._cards):
+                self._discover()
+
+        return output
@@ -0,0 +1,214 @@
+"""
+A Python stand-in for librocm_smi64, for passing as `rocmsmi`.
+
+Functions fill their `byref` out-params from the per-device values in
+`devices` and the per-process values in `processes`, and functions it
+doesn't implement return RSMI_STATUS_NOT_SUPPORTED. Functions named in
+`missing` aren't there at all, as with an older library. Every call is
+counted by function name and device (or PID) in `calls`.
+"""
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+RSMI_STATUS_SUCCESS = 0
+RSMI_STATUS_NOT_SUPPORTED = 2
+RSMI_STATUS_NOT_FOUND = 10
+
+DEVICE = {
+    # millidegrees per rsmi_temperature_type_t
+    "temperature": {0: 45000, 1: 50000, 2: 40000},
+    "busy_percent": 87,
+    # microwatts
+    "power_ave": 150000000,
+    "power_cap": 300000000,
+    "memory_usage": 1 << 30,
+    "memory_total": 4 << 30,
+    # counter, resolution (uJ), timestamp (ns)
+    "energy": (1000, 15.3, 123456789),
+    # current level, supported frequencies (Hz), per rsmi_clk_type_t
+    "clocks": {0: (1, [800000000, 1700000000]), 4: (0, [96000000])},
+    "perf_level": 0,
+    "id": 0x73BF,
+    "unique_id": 0xAC1B58F8C066790F,
+    # 0000:03:00.0
+    "pci_id": 0x300,
+    "serial": "ac1b58f8c066790f",
+    "name": "0x73bf",
+    "vbios": "113-D4140EXL-XL",
+}
+
+
+# pid -> device -> (VRAM bytes, SDMA microseconds, CU occupancy)
+Processes = Dict[int, Dict[int, Tuple[int, int, int]]]
+
+
+class FakeRocmSmi:
+    def __init__(
+        self,
+        devices: Optional[List[Dict[str, Any]]] = None,
+        driver: str = "6.1.5",
+        processes: Optional[Processes] = None,
+        missing: Iterable[str] = (),
+    ):
+        self.devices = devices if devices is not None else [dict(DEVICE), dict(DEVICE)]
+        self.driver = driver
+        self.processes = processes if processes is not None else {}
+        self.missing = frozenset(missing)
+        self.calls: Counter = Counter()
+
+    def __getattribute__(self, name: str):
+        if name.startswith("rsmi_") and name in object.__getattribute__(self, "missing"):
+            raise AttributeError(name)
+        return object.__getattribute__(self, name)
+
+    def __getattr__(self, name: str):
+        # also reached when __getattribute__ raises for a missing function
+        if not name.startswith("rsmi_") or name in self.missing:
+            raise AttributeError(name)
+
+        def not_supported(*args):
+            self.calls[name, _device(args)] += 1
+            return RSMI_STATUS_NOT_SUPPORTED
+
+        return not_supported
+
+    def _get(self, name: str, device: Any, key: str) -> Any:
+        device = int(getattr(device, "value", device))
+        self.calls[name, device] += 1
+        return self.devices[device].get(key)
+
+    def rsmi_init(self, flags):
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_shut_down(self):
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_num_monitor_devices(self, count):
+        count._obj.value = len(self.devices)
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_version_str_get(self, component, buf, length):
+        buf.value = self.driver.encode()
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_dev_temp_metric_get(self, device, sensor, metric, temp):
+        temps = self._get("rsmi_dev_temp_metric_get", device, "temperature") or {}
+        return _fill(temp, temps.get(sensor))
+
+    def rsmi_dev_busy_percent_get(self, device, percent):
+        return _fill(percent, self._get("rsmi_dev_busy_percent_get", device, "busy_percent"))
+
+    def rsmi_dev_power_ave_get(self, device, sensor, power):
+        return _fill(power, self._get("rsmi_dev_power_ave_get", device, "power_ave"))
+
+    def rsmi_dev_power_cap_get(self, device, sensor, power):
+        return _fill(power, self._get("rsmi_dev_power_cap_get", device, "power_cap"))
+
+    def rsmi_dev_memory_usage_get(self, device, mem_type, used):
+        return _fill(used, self._get("rsmi_dev_memory_usage_get", device, "memory_usage"))
+
+    def rsmi_dev_memory_total_get(self, device, mem_type, total):
+        return _fill(total, self._get("rsmi_dev_memory_total_get", device, "memory_total"))
+
+    def rsmi_dev_energy_count_get(self, device, counter, resolution, timestamp):
+        energy = self._get("rsmi_dev_energy_count_get", device, "energy")
+        if energy is None:
+            return RSMI_STATUS_NOT_SUPPORTED
+        for param, value in zip((counter, resolution, timestamp), energy):
+            _fill(param, value)
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_dev_gpu_clk_freq_get(self, device, clk_type, freq):
+        clocks = self._get("rsmi_dev_gpu_clk_freq_get", device, "clocks") or {}
+        if clk_type not in clocks:
+            return RSMI_STATUS_NOT_SUPPORTED
+        current, frequencies = clocks[clk_type]
+        freq._obj.current = current
+        freq._obj.num_supported = len(frequencies)
+        for i, frequency in enumerate(frequencies):
+            freq._obj.frequency[i] = frequency
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_dev_perf_level_get(self, device, level):
+        return _fill(level, self._get("rsmi_dev_perf_level_get", device, "perf_level"))
+
+    def rsmi_dev_id_get(self, device, dv_id):
+        return _fill(dv_id, self._get("rsmi_dev_id_get", device, "id"))
+
+    def rsmi_dev_unique_id_get(self, device, uid):
+        return _fill(uid, self._get("rsmi_dev_unique_id_get", device, "unique_id"))
+
+    def rsmi_dev_pci_id_get(self, device, bdfid):
+        return _fill(bdfid, self._get("rsmi_dev_pci_id_get", device, "pci_id"))
+
+    def rsmi_dev_serial_number_get(self, device, buf, length):
+        return _fill_string(buf, self._get("rsmi_dev_serial_number_get", device, "serial"))
+
+    def rsmi_dev_name_get(self, device, buf, length):
+        return _fill_string(buf, self._get("rsmi_dev_name_get", device, "name"))
+
+    def rsmi_dev_vbios_version_get(self, device, buf, length):
+        return _fill_string(buf, self._get("rsmi_dev_vbios_version_get", device, "vbios"))
+
+    def rsmi_compute_process_info_get(self, procs, num_items):
+        self.calls["rsmi_compute_process_info_get", None] += 1
+        if procs is not None:
+            # as the library does, only the PID and PASID are filled in
+            for proc, pid in zip(procs, sorted(self.processes)[: num_items._obj.value]):
+                proc.process_id = pid
+                proc.pasid = pid
+        num_items._obj.value = len(self.processes)
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_compute_process_gpus_get(self, pid, devices, num_devices):
+        self.calls["rsmi_compute_process_gpus_get", pid] += 1
+        if pid not in self.processes:
+            return RSMI_STATUS_NOT_FOUND
+        gpus = sorted(self.processes[pid])
+        if devices is not None:
+            for i, device in enumerate(gpus[: num_devices._obj.value]):
+                devices[i] = device
+        num_devices._obj.value = len(gpus)
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_compute_process_info_by_pid_get(self, pid, proc):
+        self.calls["rsmi_compute_process_info_by_pid_get", pid] += 1
+        if pid not in self.processes:
+            return RSMI_STATUS_NOT_FOUND
+        usage = self.processes[pid].values()
+        _fill_process(proc._obj, pid, [sum(values) for values in zip(*usage)])
+        return RSMI_STATUS_SUCCESS
+
+    def rsmi_compute_process_info_by_device_get(self, pid, device, proc):
+        self.calls["rsmi_compute_process_info_by_device_get", pid] += 1
+        usage = self.processes.get(pid, {}).get(device)
+        if usage is None:
+            return RSMI_STATUS_NOT_FOUND
+        _fill_process(proc._obj, pid, usage)
+        return RSMI_STATUS_SUCCESS
+
+
+def _fill_process(proc: Any, pid: int, usage: Iterable[int]):
+    proc.process_id = pid
+    proc.pasid = pid
+    proc.vram_usage, proc.sdma_usage, proc.cu_occupancy = usage
+
+
+def _device(args) -> Optional[int]:
+    if not args or not isinstance(getattr(args[0], "value", args[0]), int):
+        return None
+    return int(getattr(args[0], "value", args[0]))
+
+
+def _fill(param: Any, value: Any) -> int:
+    if value is None:
+        return RSMI_STATUS_NOT_SUPPORTED
+    param._obj.value = value
+    return RSMI_STATUS_SUCCESS
+
+
+def _fill_string(buf: Any, value: Optional[str]) -> int:
+    if value is None:
+        return RSMI_STATUS_NOT_SUPPORTED
+    buf.value = value.encode()
+    return RSMI_STATUS_SUCCESS
@@ -0,0 +1,22 @@
+import pytest
+
+from config import env_flag
+
+
+@pytest.mark.parametrize("value", ["", "0", "false", "False", "no", "NO "])
+def test_off_values(monkeypatch, value):
+    monkeypatch.setenv("ROCM_TEST_FLAG", value)
+    assert not env_flag("ROCM_TEST_FLAG")
+    assert not env_flag("ROCM_TEST_FLAG", default=True)
+
+
+@pytest.mark.parametrize("value", ["1", "true", "yes", "on"])
+def test_on_values(monkeypatch, value):
+    monkeypatch.setenv("ROCM_TEST_FLAG", value)
+    assert env_flag("ROCM_TEST_FLAG")
+
+
+def test_unset_is_the_default(monkeypatch):
+    monkeypatch.delenv("ROCM_TEST_FLAG", raising=False)
+    assert not env_flag("ROCM_TEST_FLAG")
+    assert env_flag("ROCM_TEST_FLAG", default=True)
@@ -0,0 +1,104 @@
+from prometheus_client import REGISTRY
+
+from energy import EnergySample, EnergyTracker, counter_delta
+
+_WRAP_32 = 1 << 32
+_WRAP_64 = 1 << 64
+
+
+def _joules(card_name):
+    return REGISTRY.get_sample_value("rocm_energy_joules_total", {"gpu": card_name})
+
+
+def _watts(card_name):
+    return REGISTRY.get_sample_value("rocm_energy_power_watts", {"gpu": card_name})
+
+
+def _values(counter, timestamp_s):
+    # as read by rsmi_backend, 1 J per count keeps the numbers simple
+    return {
+        "Energy counter": counter,
+        "Energy counter resolution (uJ)": 1e6,
+        "Energy timestamp (ns)": timestamp_s * 1e9,
+    }
+
+
+def test_counter_delta():
+    assert counter_delta(100, 250) == 150
+    assert counter_delta(100, 100) == 0
+    # wraps at 32 bits
+    assert counter_delta(_WRAP_32 - 10, 5) == 15
+    # a 64 bit counter that has gone past 32 bits wraps at 64
+    assert counter_delta(_WRAP_64 - 10, 5) == 15
+    assert counter_delta(_WRAP_32 + 10, 5) == 5
+    # nowhere near the top of the range, so a reset: counts since the reset
+    assert counter_delta(1000, 10) == 10
+    assert counter_delta(_WRAP_32 // 2 - 1, 10) == 10
+
+
+def test_first_sample_exports_nothing():
+    tracker = EnergyTracker()
+
+    assert tracker.observe("first", EnergySample(1000, 1e6, 1.0)) is None
+    assert _joules("first") is None
+    assert _watts("first") is None
+
+
+def test_joules_and_watts_between_samples():
+    tracker = EnergyTracker()
+
+    tracker.update({"watts": _values(1000, 1.0), "system": {}})
+    tracker.update({"watts": _values(1300, 3.0), "system": {}})
+    assert _joules("watts") == 300
+    assert _watts("watts") == 150
+
+    # an unchanged counter is no energy used, rather than no reading
+    tracker.update({"watts": _values(1300, 4.0), "system": {}})
+    assert _joules("watts") == 300
+    assert _watts("watts") == 0
+
+
+def test_wrap_and_reset_keep_the_total_increasing():
+    tracker = EnergyTracker()
+
+    tracker.observe("wrap", EnergySample(_WRAP_32 - 100, 1e6, 1.0))
+    tracker.observe("wrap", EnergySample(50, 1e6, 2.0))
+    assert _joules("wrap") == 150
+
+    # e.g. a GPU reset
+    tracker.observe("wrap", EnergySample(20, 1e6, 3.0))
+    assert _joules("wrap") == 170
+    assert _watts("wrap") == 20
+
+
+def test_same_timestamp_is_not_a_power_reading():
+    tracker = EnergyTracker()
+
+    tracker.observe("stale", EnergySample(1000, 1e6, 1.0))
+    assert tracker.observe("stale", EnergySample(1000, 1e6, 1.0)) is None
+    assert _watts("stale") is None
+
+
+def test_missing_card_is_forgotten():
+    tracker = EnergyTracker()
+
+    tracker.update({"kept": _values(0, 1.0), "gone": _values(0, 1.0)})
+    tracker.update({"kept": _values(10, 2.0), "gone": _values(10, 2.0)})
+    assert _joules("gone") == 10
+
+    tracker.update({"kept": _values(20, 3.0)})
+    assert _joules("gone") is None
+    assert _watts("gone") is None
+    assert _joules("kept") == 20
+
+    # back again, it starts over from a first sample
+    tracker.update({"kept": _values(30, 4.0), "gone": _values(500, 4.0)})
+    assert _joules("gone") is None
+
+
+def test_card_without_an_energy_counter_is_skipped():
+    tracker = EnergyTracker()
+
+    tracker.update({"noenergy": {"GPU use (%)": 5}}, timestamp=1.0)
+    tracker.update({"noenergy": {"GPU use (%)": 5}}, timestamp=2.0)
+    assert _joules("noenergy") is None
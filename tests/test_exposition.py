@@ -0,0 +1,62 @@
+import asyncio
+import gzip
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from exposition import PayloadCache, _handle
+
+
+class _Writer:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _get(cache, headers=""):
+    async def request():
+        reader = asyncio.StreamReader()
+        reader.feed_data(f"GET /metrics HTTP/1.1\r\nConnection: close\r\n{headers}\r\n".encode())
+        reader.feed_eof()
+        writer = _Writer()
+        await _handle(cache, reader, writer)
+        return writer.data
+
+    head, _, body = asyncio.run(request()).partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0].decode(), body
+
+
+def test_unavailable_until_rendered():
+    registry = CollectorRegistry()
+    Gauge("rocm_test", "test", registry=registry).set(1)
+    cache = PayloadCache(registry)
+
+    assert _get(cache) == ("HTTP/1.1 503 Service Unavailable", b"")
+
+    cache.render()
+    status, body = _get(cache)
+    assert status == "HTTP/1.1 200 OK"
+    assert b"rocm_test 1.0" in body
+
+    status, body = _get(cache, "Accept-Encoding: gzip\r\n")
+    assert b"rocm_test 1.0" in gzip.decompress(body)
+
+
+def test_render_failure_is_a_server_error():
+    class _Broken:
+        def collect(self):
+            raise RuntimeError("broken collector")
+
+    registry = CollectorRegistry()
+    registry.register(_Broken())
+    # scrape driven, so rendering happens in the request
+    cache = PayloadCache(registry, max_age=1)
+
+    assert _get(cache) == ("HTTP/1.1 500 Internal Server Error", b"")
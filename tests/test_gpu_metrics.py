@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import gpu_metrics
+from gpu_metrics import GpuMetricsFile, parse_gpu_metrics, synthesize
+
+
+def test_struct_sizes():
+    # the header is included in the struct size, as in the kernel's structs
+    assert gpu_metrics._v1_0.struct.size == 80
+    assert gpu_metrics._v1_1.struct.size == 96
+
+
+@pytest.mark.parametrize("revision", sorted(gpu_metrics._layouts))
+def test_round_trip(revision):
+    blob = synthesize(
+        *revision,
+        temperature_edge=45,
+        average_gfx_activity=87,
+        current_gfxclk=1700,
+        throttle_status=0,
+        energy_accumulator=1000,
+        system_clock_counter=123456789,
+    )
+    assert len(blob) == gpu_metrics._layouts[revision].struct.size
+
+    values = parse_gpu_metrics(blob)
+    assert values["Temperature (Sensor edge) (C)"] == 45.0
+    assert values["GPU use (%)"] == 87
+    assert values["sclk clock speed:"] == 1700
+    assert values["Throttle status"] == 0
+    assert values["Energy counter"] == 1000
+    assert values["Accumulated Energy (uJ)"] == 15300.0
+    assert values["Energy timestamp (ns)"] == 123456789
+    # left at all ones, so unsupported
+    assert "Fan RPM" not in values
+
+
+def test_unknown_revision():
+    blob = bytearray(synthesize(1, 1))
+    blob[2] = 2
+    assert parse_gpu_metrics(bytes(blob)) is None
+
+
+def test_file(tmp_path):
+    path = tmp_path / "gpu_metrics"
+    path.write_bytes(synthesize(1, 3, current_fan_speed=1200))
+    metrics = GpuMetricsFile(str(path))
+    try:
+        assert metrics.fields == frozenset(["Fan RPM"])
+        path.write_bytes(synthesize(1, 3, current_fan_speed=1500))
+        assert metrics.read() == {"Fan RPM": 1500}
+    finally:
+        metrics.close()
+
+
+def test_file_closed_when_read_fails(tmp_path, monkeypatch):
+    path = tmp_path / "gpu_metrics"
+    path.write_bytes(synthesize(1, 0))
+    opened = []
+    real_open = os.open
+
+    def record_open(*args, **kwargs):
+        fd = real_open(*args, **kwargs)
+        opened.append(fd)
+        return fd
+
+    def fail(*args):
+        raise OSError("read failed")
+
+    monkeypatch.setattr(gpu_metrics.os, "open", record_open)
+    monkeypatch.setattr(gpu_metrics.os, "preadv", fail)
+    with pytest.raises(OSError):
+        GpuMetricsFile(str(path))
+    with pytest.raises(OSError):
+        os.fstat(opened[0])
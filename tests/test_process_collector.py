@@ -0,0 +1,58 @@
+from prometheus_client import CollectorRegistry
+
+from fake_rocmsmi import FakeRocmSmi
+from process_collector import ProcessCollector, ProcessNames
+
+# pid -> device -> (VRAM bytes, SDMA microseconds, CU occupancy)
+_PROCESSES = {
+    100: {0: (1 << 20, 0, 1)},
+    200: {0: (4 << 30, 2000000, 30), 1: (4 << 30, 1000000, 20)},
+    300: {1: (1 << 30, 0, 10)},
+}
+
+
+def _samples(collector, name):
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return {
+        (sample.labels["pid"], sample.labels["gpu"]): sample.value
+        for metric in registry.collect()
+        for sample in metric.samples
+        if sample.name == name
+    }
+
+
+def _collector(tmp_path, **kwargs):
+    # no /proc entries, so every name is "unknown"
+    return ProcessCollector(names=ProcessNames(str(tmp_path)), **kwargs)
+
+
+def test_top_n_ranked_by_per_pid_usage(tmp_path):
+    # the list call only fills in PIDs, so ranking by it would keep 100
+    lib = FakeRocmSmi(processes=_PROCESSES)
+    collector = _collector(tmp_path, rocmsmi=lib, top_n=2)
+
+    vram = _samples(collector, "rocm_process_vram_bytes")
+    assert vram == {
+        ("200", "card0"): 4 << 30,
+        ("200", "card1"): 4 << 30,
+        ("300", "card1"): 1 << 30,
+    }
+    assert _samples(collector, "rocm_process_sdma_usage_seconds_total")[("200", "card0")] == 2.0
+    assert lib.calls["rsmi_compute_process_info_by_pid_get", 100] == 2
+
+
+def test_per_process_totals_without_per_device_info(tmp_path):
+    lib = FakeRocmSmi(
+        processes=_PROCESSES, missing=["rsmi_compute_process_info_by_device_get"]
+    )
+    collector = _collector(tmp_path, rocmsmi=lib, top_n=2)
+
+    assert _samples(collector, "rocm_process_vram_bytes") == {
+        ("200", "card0,card1"): 8 << 30,
+        ("300", "card1"): 1 << 30,
+    }
+    assert _samples(collector, "rocm_process_cu_occupancy") == {
+        ("200", "card0,card1"): 50,
+        ("300", "card1"): 10,
+    }
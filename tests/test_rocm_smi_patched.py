@@ -0,0 +1,101 @@
+import ctypes
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+_SCRIPT = os.path.join(os.path.dirname(__file__), "..", "smi_patch", "rocm-smi-patched.py")
+
+# firmware block -> version, and microwatts, per device. card1 is the
+# secondary die of an MCM, which reports no power at all.
+_FIRMWARE = {"ME": 64, "MEC": 104}
+_POWER = [(203000000, 35000000), (0, 0)]
+# KFD processes running
+_PIDS = [4242]
+
+
+class _ProcessInfo(ctypes.Structure):
+    _fields_ = [("process_id", ctypes.c_uint32)]
+
+
+class _Lib:
+    def rsmi_status_string(self, status, string):
+        string._obj.value = b"not supported"
+        return 0
+
+    def rsmi_compute_process_info_get(self, procs, num_items):
+        if procs is not None:
+            for i, pid in enumerate(_PIDS):
+                procs._obj[i].process_id = pid
+        num_items._obj.value = len(_PIDS)
+        return 0
+
+    def rsmi_dev_firmware_version_get(self, device, block, version):
+        version._obj.value = _FIRMWARE[list(_FIRMWARE)[block]]
+        return 0
+
+    def rsmi_dev_power_cap_get(self, device, sensor, power):
+        power._obj.value = _POWER[device][0]
+        return 0
+
+    def rsmi_dev_power_cap_default_get(self, device, power):
+        power._obj.value = _POWER[device][0]
+        return 0
+
+    def rsmi_dev_power_ave_get(self, device, sensor, power):
+        power._obj.value = _POWER[device][1]
+        return 0
+
+
+@pytest.fixture
+def rocm_smi(monkeypatch):
+    # just what the script needs from rsmiBindings to import, and for the
+    # show options below
+    bindings = types.ModuleType("rsmiBindings")
+    bindings.__dict__.update(
+        {name: getattr(ctypes, name) for name in dir(ctypes) if not name.startswith("_")}
+    )
+    bindings.rocmsmi = _Lib()
+    bindings.clk_type_names = [
+        "sclk", "sclk", "fclk", "dcefclk", "socclk", "mclk", "mclk", "invalid"
+    ]
+    bindings.fw_block_names_l = list(_FIRMWARE)
+    bindings.rsmi_process_info_t = _ProcessInfo
+    bindings.rsmi_status_t = types.SimpleNamespace(RSMI_STATUS_SUCCESS=0)
+    bindings.rsmi_status_verbose_err_out = {}
+    monkeypatch.setitem(sys.modules, "rsmiBindings", bindings)
+
+    spec = importlib.util.spec_from_file_location("rocm_smi_patched", _SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_collect_normalises_values(rocm_smi):
+    output = rocm_smi.collect([0, 1], ["showfwinfo", "showpower"])
+
+    # printed with leading tabs, which --json strips too
+    assert output["card0"]["ME firmware version"] == "64"
+    assert output["card0"]["MEC firmware version"] == "104"
+    assert output["card0"]["Average Graphics Package Power (W)"] == 35.0
+    # "N/A (Secondary die)"
+    assert output["card1"]["Average Graphics Package Power (W)"] is None
+
+
+def test_collect_leaves_the_exit_code_alone(rocm_smi, monkeypatch):
+    monkeypatch.setattr(_Lib, "rsmi_dev_power_ave_get", lambda *args: 2)
+
+    output = rocm_smi.collect([0], ["showpower"])
+
+    assert output["card0"]["Average Graphics Package Power (W)"] is None
+    assert rocm_smi.RETCODE == 0
+
+
+def test_pid_list_forgets_exited_processes(rocm_smi):
+    rocm_smi.PROCESS_NAMES.update({4242: (100, "python"), 1717: (200, "exited")})
+
+    assert rocm_smi.getPidList() == ["4242"]
+
+    assert rocm_smi.PROCESS_NAMES == {4242: (100, "python")}
@@ -0,0 +1,76 @@
+import json
+import os
+
+from fake_rocmsmi import FakeRocmSmi
+from rsmi_backend import RsmiBackend
+
+_TEMPERATURES = frozenset(
+    f"Temperature (Sensor {sensor}) (C)" for sensor in ["edge", "junction", "memory"]
+)
+
+
+def _example_fields():
+    path = os.path.join(os.path.dirname(__file__), "..", "example.json")
+    with open(path) as f:
+        return set(json.load(f)["card0"])
+
+
+def test_collect_shape():
+    output = RsmiBackend(FakeRocmSmi()).collect()
+
+    assert set(output) == {"card0", "card1", "system"}
+    assert output["system"] == {"Driver version": "6.1.5"}
+
+    card = output["card0"]
+    assert card["Temperature (Sensor edge) (C)"] == 45.0
+    assert card["GPU use (%)"] == 87
+    assert card["Average Graphics Package Power (W)"] == 150.0
+    assert card["GPU memory use (%)"] == 25.0
+    assert card["sclk clock speed:"] == 1700
+    assert card["sclk clock level:"] == 1
+    assert card["mclk clock speed:"] == 96
+    assert card["Accumulated Energy (uJ)"] == 15300.0
+    assert card["Unique ID"] == "0xac1b58f8c066790f"
+    assert card["PCI Bus"] == "0000:03:00.0"
+    assert card["Card SKU"] == "D4140E"
+    # unsupported sensors are left out rather than reported as N/A
+    assert "Voltage (mV)" not in card
+
+    # the fields rocm-smi --json also reports are named the same, the rest
+    # are extras the rsmi backend reads alongside them
+    extras = {
+        "GPU memory use",
+        "GPU memory available",
+        "Energy counter resolution (uJ)",
+        "Energy timestamp (ns)",
+    }
+    assert set(card) - _example_fields() <= extras
+
+
+def test_collect_skips_covered_readers():
+    lib = FakeRocmSmi()
+    output = RsmiBackend(lib).collect(covered=_TEMPERATURES)
+
+    assert not _TEMPERATURES & set(output["card0"])
+    assert lib.calls["rsmi_dev_temp_metric_get", 0] == 0
+    assert output["card0"]["GPU use (%)"] == 87
+
+
+def test_identity_cache():
+    lib = FakeRocmSmi()
+    backend = RsmiBackend(lib)
+
+    backend.collect()
+    backend.collect()
+    assert lib.calls["rsmi_dev_serial_number_get", 0] == 1
+    assert lib.calls["rsmi_dev_busy_percent_get", 0] == 2
+
+    backend.reload(0)
+    backend.collect()
+    assert lib.calls["rsmi_dev_serial_number_get", 0] == 2
+    assert lib.calls["rsmi_dev_serial_number_get", 1] == 1
+
+    # a change in device count re-reads every device
+    lib.devices.pop()
+    backend.collect()
+    assert lib.calls["rsmi_dev_serial_number_get", 0] == 3
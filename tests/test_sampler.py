@@ -0,0 +1,108 @@
+from prometheus_client import CollectorRegistry
+
+from sampler import HighFrequencySampler, RingBuffer, summarise
+
+
+class _Backend:
+    """
+    Reports GPU use of `use` for each of `cards` devices
+    """
+
+    def __init__(self, cards=1):
+        self.cards = cards
+        self.use = 0.0
+
+    def devices(self):
+        return list(range(self.cards))
+
+    def read_fields(self, device, fields):
+        return {"GPU use (%)": self.use}
+
+
+def _all_stats(sampler):
+    # rendering resets the window, so render once for every card
+    registry = CollectorRegistry()
+    registry.register(sampler)
+    stats = {}
+    for metric in registry.collect():
+        for sample in metric.samples:
+            if sample.name == "rocm_sampled_gpu_use_percent":
+                stats.setdefault(sample.labels["gpu"], {})[sample.labels["stat"]] = sample.value
+    return stats
+
+
+def _stats(sampler):
+    return _all_stats(sampler)["card0"]
+
+
+def _sample(sampler, backend, values):
+    for value in values:
+        backend.use = value
+        sampler.sample()
+
+
+def test_ring_buffer_wraps():
+    buffer = RingBuffer(3)
+    for value in range(1, 6):
+        buffer.append(value)
+
+    assert buffer.written == 5
+    # only the last 3 are still there, oldest first
+    assert buffer.since(0) == [3, 4, 5]
+    assert buffer.since(3) == [4, 5]
+    assert buffer.since(5) == []
+
+
+def test_ring_buffer_partially_filled():
+    buffer = RingBuffer(10)
+    for value in (4, 5, 6):
+        buffer.append(value)
+
+    # the unwritten slots are never read back
+    assert buffer.since(0) == [4, 5, 6]
+    assert summarise(buffer.since(1)) == {"min": 5, "max": 6, "mean": 5.5, "p95": 6, "count": 2}
+
+
+def test_summarise():
+    assert summarise([]) == {"count": 0}
+    # nearest rank: the 19th of 20
+    assert summarise([float(value) for value in range(20, 0, -1)])["p95"] == 19
+
+
+def test_each_render_summarises_the_samples_since_the_last():
+    backend = _Backend()
+    sampler = HighFrequencySampler(backend, rate=10, window=1)
+
+    _sample(sampler, backend, [10, 30, 20])
+    assert _stats(sampler) == {"min": 10, "max": 30, "mean": 20, "p95": 30, "count": 3}
+
+    # nothing sampled since
+    assert _stats(sampler) == {"count": 0}
+
+    _sample(sampler, backend, [50])
+    assert _stats(sampler) == {"min": 50, "max": 50, "mean": 50, "p95": 50, "count": 1}
+
+
+def test_render_after_more_than_a_window_of_samples():
+    backend = _Backend()
+    # 10 samples kept
+    sampler = HighFrequencySampler(backend, rate=10, window=1)
+
+    _sample(sampler, backend, range(15))
+    stats = _stats(sampler)
+    assert stats["count"] == 10
+    assert stats["min"] == 5
+    assert stats["max"] == 14
+
+
+def test_gone_card_is_dropped():
+    backend = _Backend(cards=2)
+    sampler = HighFrequencySampler(backend, rate=10, window=1)
+
+    _sample(sampler, backend, [10])
+    backend.cards = 1
+    _sample(sampler, backend, [20])
+
+    stats = _all_stats(sampler)
+    assert "card1" not in stats
+    assert stats["card0"]["count"] == 2
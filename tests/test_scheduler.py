@@ -0,0 +1,45 @@
+import threading
+
+from scheduler import MetricGroup, PeriodicThread, Scheduler
+
+
+def test_due_and_covered():
+    scheduler = Scheduler(
+        {
+            "fast": MetricGroup(1, frozenset(["a"])),
+            "slow": MetricGroup(10, frozenset(["b", "c"])),
+        },
+        start=0,
+    )
+    assert sorted(scheduler.due(0)) == ["fast", "slow"]
+    scheduler.advance(["fast", "slow"], now=0)
+    assert scheduler.due(1) == ["fast"]
+    assert scheduler.covered(["fast"]) == frozenset(["b", "c"])
+    # missed deadlines are skipped rather than caught up
+    scheduler.advance(["fast"], now=3.5)
+    assert scheduler.next_deadline() == 4
+
+
+def test_periodic_thread_stops_when_fn_returns_false():
+    calls = []
+
+    def fn():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("logged, not fatal")
+        return len(calls) < 3
+
+    thread = PeriodicThread(fn, 0.001, "test")
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(calls) == 3
+
+
+def test_periodic_thread_stop():
+    called = threading.Event()
+    thread = PeriodicThread(called.set, 60, "test")
+    thread.start()
+    assert called.wait(5)
+    thread.stop()
+    assert not thread.is_alive()
@@ -0,0 +1,159 @@
+import json
+import os
+
+from prometheus_client import REGISTRY, CollectorRegistry
+
+import self_metrics
+import server
+from fake_rocmsmi import FakeRocmSmi
+from parallel import ERROR_MARKER, DevicePool
+from rsmi_backend import RsmiBackend
+from server import (
+    SMI_TIMEOUT,
+    GaugeUpdater,
+    PendingReloads,
+    SmiCliBackend,
+    _compile_metric_table,
+    collect_instrumented,
+)
+
+_EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "example.json")
+
+
+class _Backend:
+    def __init__(self, on_reload=None):
+        self.reloads = []
+        self._on_reload = on_reload
+
+    def reload(self, device=None):
+        self.reloads.append(device)
+        if self._on_reload is not None:
+            self._on_reload()
+
+
+class _Worker:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, flags, devices=None, timeout=None):
+        self.queries.append((devices, timeout))
+        return {"card0": {"GPU use (%)": 7}, "card1": {"GPU use (%)": 9}, "system": {}}
+
+
+def test_pending_reloads():
+    pending = PendingReloads()
+    backend = _Backend()
+
+    pending.request(1)
+    pending.request(2)
+    pending.request(1)
+    pending.apply(backend)
+    assert sorted(backend.reloads) == [1, 2]
+
+    # a full reload covers every device
+    backend.reloads = []
+    pending.request(1)
+    pending.request()
+    pending.apply(backend)
+    assert backend.reloads == [None]
+
+
+def test_pending_reloads_requested_during_apply():
+    # as a SIGHUP handler would, on the thread that is applying
+    pending = PendingReloads()
+    backend = _Backend(on_reload=lambda: pending.request(3))
+
+    pending.request(1)
+    pending.apply(backend)
+    assert backend.reloads == [1]
+
+    backend = _Backend()
+    pending.apply(backend)
+    assert backend.reloads == [3]
+
+
+def _last_success(card_name):
+    return REGISTRY.get_sample_value(
+        "rocm_exporter_last_success_timestamp_seconds", {"gpu": card_name}
+    )
+
+
+def test_failed_card_is_not_a_success():
+    pool = DevicePool(max_workers=2, timeout=5)
+    backend = RsmiBackend(FakeRocmSmi(), pool=pool)
+    read_device = backend.read_device
+
+    def failing_read(device, covered):
+        if device == 1:
+            raise OSError("card1 is gone")
+        return read_device(device, covered)
+
+    # read both cards once, so card1's identity fields are cached
+    collect_instrumented(backend)
+    self_metrics.last_success.labels("card0").set(0)
+    self_metrics.last_success.labels("card1").set(0)
+
+    backend.read_device = failing_read
+    output = collect_instrumented(backend)
+    pool.shutdown()
+
+    assert output["card0"][ERROR_MARKER] == 0
+    assert output["card1"][ERROR_MARKER] == 1
+    assert output["card1"]["Serial Number"] == "ac1b58f8c066790f"
+    assert _last_success("card0") > 0
+    assert _last_success("card1") == 0
+
+
+def test_smi_worker_reads_all_cards_in_one_query(monkeypatch):
+    worker = _Worker()
+    monkeypatch.setattr(server, "_smi_worker", worker)
+    monkeypatch.setattr(server, "COLLECTION_THREADS", 2)
+
+    output = SmiCliBackend().collect()
+
+    assert output["card1"]["GPU use (%)"] == 9
+    # the static info, then everything else, never per card or unbounded
+    assert worker.queries == [(None, SMI_TIMEOUT), (None, SMI_TIMEOUT)]
+
+
+def _gauge_value(spec, card_name):
+    values = [
+        sample.value
+        for metric in spec.gauge.collect()
+        for sample in metric.samples
+        if sample.labels["gpu"] == card_name
+    ]
+    return values[0] if values else None
+
+
+def test_gauge_updater_only_sets_changed_values():
+    with open(_EXAMPLE) as f:
+        card = json.load(f)["card0"]
+    table = _compile_metric_table(registry=CollectorRegistry())
+    use = table["GPU use (%)"][0]
+    power = table["Average Graphics Package Power (W)"][0]
+    updater = GaugeUpdater(table)
+
+    updater.update({"card0": card})
+    assert _gauge_value(use, "card0") == 99
+    assert _gauge_value(power, "card0") == 35
+
+    # an unchanged raw value isn't set again, so this sticks
+    labels = next(iter(use.gauge.collect())).samples[0].labels
+    use.gauge.labels(**labels).set(-1)
+    updater.update({"card0": {**card, "Average Graphics Package Power (W)": "40.0"}})
+    assert _gauge_value(use, "card0") == -1
+    assert _gauge_value(power, "card0") == 40
+
+    # a field missing from a collection (e.g. its group wasn't due) keeps its
+    # last value, as before change detection
+    partial = {name: value for name, value in card.items() if name != "GPU use (%)"}
+    updater.update({"card0": {**partial, "Average Graphics Package Power (W)": "41.0"}})
+    assert _gauge_value(use, "card0") == -1
+    assert _gauge_value(power, "card0") == 41
+
+    # a card that disappears is removed, and starts over when it comes back
+    updater.update({})
+    assert _gauge_value(use, "card0") is None
+    updater.update({"card0": card})
+    assert _gauge_value(use, "card0") == 99
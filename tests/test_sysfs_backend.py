@@ -0,0 +1,89 @@
+import os
+
+from fake_rocmsmi import DEVICE, FakeRocmSmi
+from gpu_metrics import synthesize
+from rsmi_backend import RsmiBackend
+from sysfs_backend import SysfsBackend, discover_cards
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def _add_card(root, name, bus, vendor="0x1002", gpu_metrics=None):
+    device = os.path.join(root, "devices", bus)
+    hwmon = os.path.join(device, "hwmon", "hwmon0")
+    _write(os.path.join(device, "vendor"), f"{vendor}\n")
+    _write(os.path.join(hwmon, "temp1_label"), "edge\n")
+    _write(os.path.join(hwmon, "temp1_input"), "52000\n")
+    _write(os.path.join(hwmon, "power1_average"), "35000000\n")
+    _write(os.path.join(hwmon, "power1_cap"), "203000000\n")
+    _write(os.path.join(device, "gpu_busy_percent"), "55\n")
+    _write(os.path.join(device, "mem_info_vram_used"), "1024\n")
+    _write(os.path.join(device, "mem_info_vram_total"), "4096\n")
+    if gpu_metrics is not None:
+        _write(os.path.join(device, "gpu_metrics"), gpu_metrics)
+
+    os.makedirs(os.path.join(root, name))
+    os.symlink(device, os.path.join(root, name, "device"))
+
+
+def _drm_tree(root):
+    _add_card(root, "card0", "0000:03:00.0")
+    _add_card(
+        root,
+        "card1",
+        "0000:04:00.0",
+        gpu_metrics=synthesize(1, 3, average_gfx_activity=66, temperature_mem=41),
+    )
+    # not amdgpu, and a connector rather than a card
+    _add_card(root, "card2", "0000:05:00.0", vendor="0x10de")
+    os.makedirs(os.path.join(root, "card0-DP-1"))
+
+
+def test_discover_cards(tmp_path):
+    _drm_tree(str(tmp_path))
+    cards = discover_cards(str(tmp_path))
+    try:
+        assert [card.pci_bus for card in cards] == ["0000:03:00.0", "0000:04:00.0"]
+        assert cards[0].read() == {
+            "Temperature (Sensor edge) (C)": 52.0,
+            "Average Graphics Package Power (W)": 35.0,
+            "Max Graphics Package Power (W)": 203.0,
+            "GPU use (%)": 55,
+            "GPU memory use": 1024,
+            "GPU memory available": 4096,
+            "GPU memory use (%)": 25.0,
+        }
+        # from gpu_metrics rather than gpu_busy_percent
+        assert cards[1].read()["GPU use (%)"] == 66
+        assert cards[1].read()["Temperature (Sensor memory) (C)"] == 41.0
+    finally:
+        for card in cards:
+            card.close()
+
+
+def test_sysfs_backend(tmp_path):
+    _drm_tree(str(tmp_path))
+    lib = FakeRocmSmi([dict(DEVICE, pci_id=0x300), dict(DEVICE, pci_id=0x400)])
+    backend = SysfsBackend(RsmiBackend(lib), str(tmp_path))
+
+    output = backend.collect()
+
+    # read from sysfs, matched by PCI bus
+    assert output["card0"]["GPU use (%)"] == 55
+    assert output["card1"]["GPU use (%)"] == 66
+    assert output["card0"]["Average Graphics Package Power (W)"] == 35.0
+    # only one card has it in sysfs, so the fallback reads it for the other
+    assert output["card0"]["Temperature (Sensor memory) (C)"] == 40.0
+    assert output["card1"]["Temperature (Sensor memory) (C)"] == 41.0
+    # and the rest from the fallback
+    assert output["card0"]["sclk clock speed:"] == 1700
+    assert output["system"] == {"Driver version": "6.1.5"}
+
+    # what every card has in sysfs isn't read through the fallback
+    assert lib.calls["rsmi_dev_busy_percent_get", 0] == 0
+    assert lib.calls["rsmi_dev_power_ave_get", 0] == 0
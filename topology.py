@@ -0,0 +1,153 @@
+"""
+GPU to GPU link topology, the same matrices as rocm-smi's --showtopo and
+--shownodesbw.
+
+Every matrix takes a library call per pair of devices, 256 calls per matrix
+on a 16 GPU node, but the topology only changes when devices are added or
+removed. TopologyCollector reads it once, builds the metric families from
+it, and serves those on every scrape until the number of devices changes or
+`reload()` is called.
+"""
+import logging
+import threading
+from ctypes import byref, c_bool, c_uint32, c_uint64
+from typing import Any, Dict, Iterator, List, Optional
+
+from prometheus_client.core import GaugeMetricFamily
+
+from rsmi_backend import RSMI_STATUS_SUCCESS, init_rocmsmi
+
+# RSMI_IO_LINK_TYPE
+_link_types = {
+    0: "undefined",
+    1: "pcie",
+    2: "xgmi",
+}
+
+# the library reports bandwidth in MB/s
+_MEGABYTE = 1000000
+
+logger = logging.getLogger(__name__)
+
+
+class TopologyCollector:
+    """
+    Custom collector exporting the link type, hops, weight, min/max bandwidth
+    and P2P accessibility between every pair of devices, as `rocm_link_*`
+    gauges labelled with the `src` and `dst` GPU.
+    """
+
+    def __init__(self, rocmsmi: Any = None):
+        self._lib = init_rocmsmi(rocmsmi)
+        self._lock = threading.Lock()
+        self._families: Optional[List[GaugeMetricFamily]] = None
+        self._num_devices = 0
+        # set by reload(), which doesn't take the lock so it can be called
+        # from a signal handler while collect() holds it
+        self._stale = False
+
+    def reload(self):
+        """
+        Read the topology again on the next collection
+        """
+        self._stale = True
+
+    def read_link(self, src: int, dst: int) -> Dict[str, Any]:
+        """
+        Everything the library reports about the link from `src` to `dst`,
+        leaving out what it doesn't support
+        """
+        values: Dict[str, Any] = {}
+
+        hops = c_uint64(0)
+        link_type = c_uint32(0)
+        ret = self._lib.rsmi_topo_get_link_type(src, dst, byref(hops), byref(link_type))
+        if ret == RSMI_STATUS_SUCCESS:
+            values["hops"] = hops.value
+            values["type"] = _link_types.get(link_type.value, "undefined")
+
+        weight = c_uint64(0)
+        if self._lib.rsmi_topo_get_link_weight(src, dst, byref(weight)) == RSMI_STATUS_SUCCESS:
+            values["weight"] = weight.value
+
+        # only reported for XGMI links
+        min_bandwidth = c_uint64(0)
+        max_bandwidth = c_uint64(0)
+        ret = self._lib.rsmi_minmax_bandwidth_get(
+            src, dst, byref(min_bandwidth), byref(max_bandwidth)
+        )
+        if ret == RSMI_STATUS_SUCCESS:
+            values["min_bandwidth"] = min_bandwidth.value * _MEGABYTE
+            values["max_bandwidth"] = max_bandwidth.value * _MEGABYTE
+
+        accessible = c_bool(False)
+        if self._lib.rsmi_is_P2P_accessible(src, dst, byref(accessible)) == RSMI_STATUS_SUCCESS:
+            values["p2p_accessible"] = int(accessible.value)
+
+        return values
+
+    def _build_families(self, num_devices: int) -> List[GaugeMetricFamily]:
+        labels = ["src", "dst"]
+        info = GaugeMetricFamily(
+            "rocm_link_info", "Type of the link between two GPUs", labels=[*labels, "type"]
+        )
+        families = {
+            "hops": GaugeMetricFamily(
+                "rocm_link_hops", "Number of hops between two GPUs", labels=labels
+            ),
+            "weight": GaugeMetricFamily(
+                "rocm_link_weight", "Weight of the link between two GPUs", labels=labels
+            ),
+            "min_bandwidth": GaugeMetricFamily(
+                "rocm_link_min_bandwidth_bytes_per_second",
+                "Minimum bandwidth of the XGMI link between two GPUs",
+                labels=labels,
+            ),
+            "max_bandwidth": GaugeMetricFamily(
+                "rocm_link_max_bandwidth_bytes_per_second",
+                "Maximum bandwidth of the XGMI link between two GPUs",
+                labels=labels,
+            ),
+            "p2p_accessible": GaugeMetricFamily(
+                "rocm_link_p2p_accessible",
+                "Whether the source GPU can access the destination GPU's memory directly",
+                labels=labels,
+            ),
+        }
+
+        for src in range(num_devices):
+            for dst in range(num_devices):
+                if src == dst:
+                    continue
+                label_values = [f"card{src}", f"card{dst}"]
+                link = self.read_link(src, dst)
+                if "type" in link:
+                    info.add_metric([*label_values, link["type"]], 1)
+                for key, family in families.items():
+                    if key in link:
+                        family.add_metric(label_values, link[key])
+
+        return [info, *families.values()]
+
+    def describe(self):
+        # nothing to describe up front, and describing would mean reading the
+        # topology at registration time
+        return []
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        count = c_uint32(0)
+        if self._lib.rsmi_num_monitor_devices(byref(count)) != RSMI_STATUS_SUCCESS:
+            return
+
+        with self._lock:
+            # a change in device count is a hotplug, the links will have
+            # changed too
+            if self._families is None or self._stale or count.value != self._num_devices:
+                # cleared first, so a reload during the read reads it again
+                self._stale = False
+                logger.info("Reading the topology of %d devices", count.value)
+                self._families = self._build_families(count.value)
+                self._num_devices = count.value
+            families = self._families
+
+        yield from families
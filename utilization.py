@@ -0,0 +1,83 @@
+"""
+Cumulative GFX and memory activity, from rsmi_utilization_count_get.
+
+"GPU use (%)" is the activity at the moment it's read, so a 1s sample of a
+bursty workload can land on either side of a burst. The SMU also accumulates
+activity continuously, and those accumulators are exported here as counters,
+so rate() over any window gives the average activity over that window
+without sampling more often. Each sample carries the driver's timestamp of
+the reading rather than the scrape time, so the rate is over exactly the
+time the accumulator covered.
+"""
+import time
+from ctypes import byref, c_uint32, c_uint64
+from typing import Any, Iterator, Optional, Tuple
+
+from prometheus_client.core import CounterMetricFamily
+
+from rsmi_backend import RSMI_STATUS_SUCCESS, RsmiUtilizationCounter, init_rocmsmi
+
+# RSMI_UTILIZATION_COUNTER_TYPE, in enum order, and the metric for each
+_counter_types = [
+    ("rocm_gfx_activity", "Accumulated GFX activity, rate() is the average GPU use"),
+    ("rocm_memory_activity", "Accumulated memory activity, rate() is the average memory use"),
+]
+
+
+def boot_time() -> float:
+    """
+    Unix time the system booted, to convert the driver's CLOCK_BOOTTIME
+    timestamps
+    """
+    return time.time() - time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+class UtilizationCollector:
+    """
+    Custom collector exporting the activity accumulators of every device,
+    read when /metrics is rendered.
+    """
+
+    def __init__(self, rocmsmi: Any = None):
+        self._lib = init_rocmsmi(rocmsmi)
+
+    def read(self, device: int) -> Optional[Tuple[Any, int]]:
+        """
+        The counters of `device` and their timestamp (ns since boot), or None
+        if the device doesn't support them
+        """
+        counters = (RsmiUtilizationCounter * len(_counter_types))()
+        for counter_type, counter in enumerate(counters):
+            counter.type = counter_type
+        timestamp = c_uint64(0)
+        ret = self._lib.rsmi_utilization_count_get(
+            device, counters, len(_counter_types), byref(timestamp)
+        )
+        if ret != RSMI_STATUS_SUCCESS:
+            return None
+        return counters, timestamp.value
+
+    def describe(self):
+        # nothing to describe up front
+        return []
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        families = [
+            CounterMetricFamily(name, documentation, labels=["gpu"])
+            for name, documentation in _counter_types
+        ]
+
+        count = c_uint32(0)
+        if self._lib.rsmi_num_monitor_devices(byref(count)) == RSMI_STATUS_SUCCESS:
+            booted = boot_time()
+            for device in range(count.value):
+                reading = self.read(device)
+                if reading is None:
+                    continue
+                counters, timestamp = reading
+                for counter in counters:
+                    families[counter.type].add_metric(
+                        [f"card{device}"], counter.value, timestamp=booted + timestamp / 1e9
+                    )
+
+        yield from families